@@ -1,3 +1,5 @@
+__version__ = "0.4"
+
 from clamp.declarative import clamp_base, Constant
 from clamp.proxymaker import ClampProxyMaker
 
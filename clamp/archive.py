@@ -0,0 +1,356 @@
+"""Low-level support for writing jars
+
+JarOutputStream always compresses entries itself, so it cannot carry
+over an entry that is already compressed in another archive without
+inflating and deflating it again. ArchiveWriter extends zipfile.ZipFile
+so entries can be written from chunks of data, or transferred raw -
+compressed bytes, CRC and sizes verbatim - from an archive opened for
+reading.
+"""
+
+import fnmatch
+import logging
+import os
+import struct
+import time
+import zipfile
+import zlib
+
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 8192
+DEFAULT_LEVEL = zlib.Z_DEFAULT_COMPRESSION
+MANIFEST_NAME = "META-INF/MANIFEST.MF"
+CONFLICT_POLICIES = ("first", "last", "error", "merge")
+DEFAULT_CONFLICT_RULES = [("META-INF/services/*", "merge")]
+REPRODUCIBLE_DATE_TIME = (1980, 1, 2, 0, 0, 0)  # a day in, so no timezone takes it before the zip epoch
+
+
+class DuplicateEntryError(Exception):
+    pass
+
+
+class CompressionPolicy(object):
+    """Chooses how to compress entries from a list of (glob, level) rules.
+
+    The first rule whose glob matches the entry name wins; a level of
+    None stores the entry, otherwise it is deflated at that level.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+
+    def __repr__(self):
+        return "CompressionPolicy({!r})".format(self.rules)
+
+    @classmethod
+    def parse(cls, spec):
+        """Parses a spec like "*.jar=store,*.class=store,*=9" """
+        def parse_level(rule, level):
+            if level == "store":
+                return None
+            elif level.isdigit() and 0 <= int(level) <= 9:
+                return int(level)
+            raise ValueError("Compression level in {!r} must be store or 0-9".format(rule))
+        return cls(parse_rules(spec, parse_level))
+
+    def match(self, name):
+        """Returns (compress_type, level) for `name`, or None if no rule matches"""
+        for pattern, level in self.rules:
+            if fnmatch.fnmatchcase(name, pattern):
+                if level is None:
+                    return zipfile.ZIP_STORED, DEFAULT_LEVEL
+                return zipfile.ZIP_DEFLATED, level
+        return None
+
+    def get(self, name):
+        return self.match(name) or (zipfile.ZIP_DEFLATED, DEFAULT_LEVEL)
+
+
+def parse_rules(spec, parse_value):
+    """Parses a spec of comma-separated GLOB=VALUE rules"""
+    rules = []
+    for rule in spec.split(","):
+        rule = rule.strip()
+        if not rule:
+            continue
+        pattern, sep, value = rule.rpartition("=")
+        if not sep or not pattern:
+            raise ValueError("Rule {!r} is not of the form GLOB=VALUE".format(rule))
+        rules.append((pattern, parse_value(rule, value)))
+    return rules
+
+
+class ConflictPolicy(object):
+    """Chooses how to resolve duplicate entries from a list of (glob, policy) rules.
+
+    The first rule whose glob matches the entry name wins, falling back
+    to merging service provider files and otherwise keeping the first
+    entry. Policies are first, last, error (unless the duplicates are
+    identical) and merge (concatenating distinct lines).
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules) + DEFAULT_CONFLICT_RULES
+
+    def __repr__(self):
+        return "ConflictPolicy({!r})".format(self.rules)
+
+    @classmethod
+    def parse(cls, spec):
+        """Parses a spec like "*.properties=last,org/example/*=error" """
+        def parse_policy(rule, policy):
+            if policy not in CONFLICT_POLICIES:
+                raise ValueError("Conflict policy in {!r} must be one of {}".format(rule, ", ".join(CONFLICT_POLICIES)))
+            return policy
+        return cls(parse_rules(spec, parse_policy))
+
+    def uses(self, policy):
+        return any(rule_policy == policy for pattern, rule_policy in self.rules)
+
+    def get(self, name):
+        if name.endswith("/") or name == MANIFEST_NAME:
+            return "first"
+        for pattern, policy in self.rules:
+            if fnmatch.fnmatchcase(name, pattern):
+                return policy
+        return "first"
+
+
+class EntryIndex(object):
+    """Index of the entries in a jar being written, with the source and hash of each.
+
+    A duplicate entry is resolved by the ConflictPolicy when it is
+    claimed, before any of its data is read. Hashes are (CRC, size)
+    pairs, available from an archive's central directory without
+    reading the entry.
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy or ConflictPolicy()
+        self.entries = {}  # name -> (source, hash)
+        self.last_sources = {}  # name -> the last source to provide it, for the last policy
+        self.merged = OrderedDict()  # name -> list of data to merge
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def scan(self, source, names):
+        """Records that `source` will provide `names`, so the last policy can pick the winner up front"""
+        for name in names:
+            if self.policy.get(name) == "last":
+                self.last_sources[name] = source
+
+    def claim(self, name, source=None, hash=None):
+        """Returns True if entry `name` from `source` should be written.
+
+        `hash` identifies the entry's contents, or is a function
+        computing it, called only if needed to resolve a conflict.
+        """
+        policy = self.policy.get(name)
+        if policy == "merge":
+            return False
+        if policy == "last" and self.last_sources.get(name, source) != source:
+            return False
+        existing = self.entries.get(name)
+        if existing is None:
+            self.entries[name] = (source, hash)
+            return True
+        if policy == "error" and not same_hash(existing[1], hash):
+            raise DuplicateEntryError("Entry {} from {} conflicts with the entry from {}".format(
+                name, source, existing[0]))
+        return False
+
+    def merges(self, name):
+        return self.policy.get(name) == "merge"
+
+    def merge(self, name, data):
+        self.merged.setdefault(name, []).append(data)
+
+    def merged_entries(self):
+        """Yields (name, data) for the entries merged from their distinct lines"""
+        for name, parts in self.merged.iteritems():
+            lines = OrderedDict()
+            for data in parts:
+                for line in data.splitlines():
+                    if line.strip():
+                        lines[line] = True
+            yield name, "".join(line + "\n" for line in lines)
+
+
+def same_hash(a, b):
+    if callable(a):
+        a = a()
+    if callable(b):
+        b = b()
+    return a is not None and a == b
+
+
+def file_hash(path):
+    """Returns the (CRC, size) hash of the file at `path`"""
+    crc = 0
+    size = 0
+    with open(path, "rb") as f:
+        for data in read_chunks(f):
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+    return crc & 0xffffffff, size
+
+
+def to_date_time(millis):
+    """Converts a Java timestamp in milliseconds to a zip date_time tuple"""
+    date_time = time.localtime(millis / 1000.)[:6]
+    if date_time[0] < 1980:
+        return (1980, 1, 1, 0, 0, 0)  # earliest time a zip entry can represent
+    return date_time
+
+
+def to_millis(date_time):
+    """Converts a zip date_time tuple to a Java timestamp, as read back from an archive"""
+    # Zip entries only store even seconds
+    return int(time.mktime(date_time[:5] + (date_time[5] // 2 * 2, 0, 0, -1))) * 1000
+
+
+def reproducible_date_time():
+    """Returns the timestamp of every entry in a reproducible archive.
+
+    That is $SOURCE_DATE_EPOCH in UTC if set, as for other reproducible
+    builds, otherwise a fixed date.
+    """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        date_time = time.gmtime(int(epoch))[:6]
+        if date_time[0] >= 1980:
+            return date_time[:5] + (date_time[5] // 2 * 2,)  # zip entries only store even seconds
+    return REPRODUCIBLE_DATE_TIME
+
+
+def read_chunks(f, size=CHUNK_SIZE):
+    """Iterates over the data of the Python file `f`"""
+    return iter(lambda: f.read(size), "")
+
+
+def compress(data, compress_type=zipfile.ZIP_DEFLATED, level=DEFAULT_LEVEL):
+    """Returns the CRC and compressed form of `data`, so compression can be done apart from writing"""
+    crc = zlib.crc32(data) & 0xffffffff
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    return crc, data
+
+
+def read_raw(archive, info):
+    """Iterates over the compressed bytes of `info` in `archive`, an open zipfile.ZipFile"""
+    fp = archive.fp
+    fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+    fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    remaining = info.compress_size
+    while remaining > 0:
+        data = fp.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            raise zipfile.BadZipfile("Truncated entry {} in {}".format(info.filename, archive.filename))
+        remaining -= len(data)
+        yield data
+
+
+class ArchiveWriter(zipfile.ZipFile):
+    """Writes an archive; if `date_time` is given, every entry has that timestamp, including raw transfers"""
+
+    def __init__(self, path, date_time=None):
+        zipfile.ZipFile.__init__(self, path, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.date_time = date_time
+
+    def __contains__(self, name):
+        return name in self.NameToInfo
+
+    def _new_info(self, name, date_time, compress_type):
+        info = zipfile.ZipInfo(name, self.date_time or date_time)
+        if name.endswith("/"):
+            info.compress_type = zipfile.ZIP_STORED
+            info.external_attr = (0o40755 << 16) | 0x10  # MS-DOS directory flag
+        else:
+            info.compress_type = compress_type
+            info.external_attr = 0o644 << 16
+        return info
+
+    def _start_entry(self, info):
+        info.header_offset = self.fp.tell()
+        self._writecheck(info)
+        self._didModify = True
+        self.fp.write(info.FileHeader())
+
+    def _finish_entry(self, info):
+        self.filelist.append(info)
+        self.NameToInfo[info.filename] = info
+
+    def write_chunks(self, name, millis, chunks, compress_type=zipfile.ZIP_DEFLATED, level=DEFAULT_LEVEL):
+        """Writes entry `name` from an iterable of data, compressing as it goes"""
+        self._write_chunks(self._new_info(name, to_date_time(millis), compress_type), chunks, level)
+
+    def _write_chunks(self, info, chunks, level):
+        info.CRC = info.compress_size = info.file_size = 0  # patched once the data has been written
+        self._start_entry(info)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        else:
+            compressor = None
+        crc = 0
+        for data in chunks:
+            info.file_size += len(data)
+            crc = zlib.crc32(data, crc)
+            if compressor:
+                data = compressor.compress(data)
+            info.compress_size += len(data)
+            self.fp.write(data)
+        if compressor:
+            data = compressor.flush()
+            info.compress_size += len(data)
+            self.fp.write(data)
+        if info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile("Entry {} is too large to be written from a stream".format(info.filename))
+        info.CRC = crc & 0xffffffff
+        position = self.fp.tell()
+        self.fp.seek(info.header_offset + 14)  # offset of CRC and sizes in the local file header
+        self.fp.write(struct.pack("<LLL", info.CRC, info.compress_size, info.file_size))
+        self.fp.seek(position)
+        self._finish_entry(info)
+
+    def write_bytes(self, name, millis, data, compress_type=zipfile.ZIP_DEFLATED, level=DEFAULT_LEVEL):
+        if name.endswith("/"):
+            compress_type = zipfile.ZIP_STORED
+        crc, compressed = compress(data, compress_type, level)
+        self.write_compressed(name, millis, len(data), crc, compressed, compress_type)
+
+    def write_compressed(self, name, millis, file_size, crc, data, compress_type=zipfile.ZIP_DEFLATED):
+        """Writes entry `name` from `data` already compressed by `compress`"""
+        info = self._new_info(name, to_date_time(millis), compress_type)
+        info.CRC = crc
+        info.file_size = file_size
+        info.compress_size = len(data)
+        self._start_entry(info)
+        self.fp.write(data)
+        self._finish_entry(info)
+
+    def write_raw(self, archive, info, name=None):
+        """Transfers `info` from `archive` without decompressing it, optionally renamed to `name`"""
+        output_info = zipfile.ZipInfo(name or info.filename, self.date_time or info.date_time)
+        output_info.compress_type = info.compress_type
+        output_info.external_attr = info.external_attr
+        output_info.CRC = info.CRC
+        output_info.compress_size = info.compress_size
+        output_info.file_size = info.file_size
+        self._start_entry(output_info)
+        for data in read_raw(archive, info):
+            self.fp.write(data)
+        self._finish_entry(output_info)
+
+    def write_recompressed(self, archive, info, name=None, compress_type=zipfile.ZIP_DEFLATED, level=DEFAULT_LEVEL):
+        """Transfers `info` from `archive`, decompressing and compressing it again as specified"""
+        output_info = self._new_info(name or info.filename, info.date_time, compress_type)
+        output_info.external_attr = info.external_attr
+        with archive.open(info) as f:
+            self._write_chunks(output_info, read_chunks(f), level)
@@ -1,25 +1,62 @@
-# NOTE the obivious lack of support for simultaneous installs.  If in
-# fact we need to do this, implement an obvious advisory locking
-# scheme when writing files like jar.pth
-
 import distutils
 import glob
-import jarray
+import hashlib
+import json
 import os
 import os.path
+import shutil
 import site
 import sys
+import tempfile
+import threading
 import time
+import urllib
 import logging
+import zipfile
 
 from collections import OrderedDict
 from contextlib import closing, contextmanager  # FIXME need to merge in Java 7 support for AutoCloseable
-from java.io import BufferedInputStream, FileInputStream
-from java.util.jar import Attributes, JarEntry, JarInputStream, JarOutputStream, Manifest
-from java.util.zip import ZipException, ZipInputStream
+from java.io import ByteArrayOutputStream
+from java.util.jar import Attributes, JarFile, Manifest
+
+from clamp.archive import (
+    ArchiveWriter, CompressionPolicy, EntryIndex, compress, file_hash, read_chunks,
+    reproducible_date_time, to_millis)
+from clamp.cache import ContentCache
+from clamp.launcher import NESTED_DIR, NESTED_LIST_NAME, SITECUSTOMIZE
+from clamp.locking import file_lock
+from clamp.packages import (
+    INDEX_NAMES, JAR_INDEX_NAME, LOAD_SITE_CACHE, PACKAGES_NAME, install_site_loader, jar_index, java_packages,
+    update_site_cache, write_packages)
+from clamp.parallel import WorkerPool, imap_ordered
+from clamp.precompile import COMPILED_SUFFIX, compiled_name
+from clamp.report import NullReport
+from clamp.startup import order_entries
 
 log = logging.getLogger(__name__)
 
+OUTPUTS_NAME = ".clamp-outputs"  # the class files a DirectoryBuilder wrote, one name per line
+LAYERS = ("runtime", "deps")  # linked from the application layer, in this order
+LAYER_MARKER = "META-INF/clamp/layer"
+
+# Written into the runtime layer, whose Lib is on sys.path as in any
+# singlejar; puts the Lib of each layer after it there too
+LAYERS_SITECUSTOMIZE = """\
+import sys
+from java.io import File
+from java.lang import ClassLoader
+
+def _add_layers():
+    urls = ClassLoader.getSystemClassLoader().getResources("{marker}")
+    while urls.hasMoreElements():
+        connection = urls.nextElement().openConnection()
+        connection.setUseCaches(False)
+        sys.path.append(File(connection.getJarFileURL().toURI()).getPath() + "/Lib")
+
+_add_layers()
+del _add_layers
+""".format(marker=LAYER_MARKER)
+
 
 class NullBuilder(object):
 
@@ -30,21 +67,30 @@ class NullBuilder(object):
         pass
 
 
-_builder = NullBuilder = NullBuilder()
+NullBuilder = NullBuilder()
+
+_context = threading.local()
 
 
 @contextmanager
 def register_builder(builder):
-    global _builder
-    log.debug("Registering builder %r, old builder was %r", builder, _builder)
-    old_builder = _builder
-    _builder = builder
-    yield
-    _builder = old_builder
+    """Registers `builder` for the proxies made on this thread.
+
+    Builders are registered per thread, so builds running concurrently
+    in one JVM - in the build daemon, or a test suite - write to their
+    own jars.
+    """
+    old_builder = get_builder()
+    log.debug("Registering builder %r, old builder was %r", builder, old_builder)
+    _context.builder = builder
+    try:
+        yield
+    finally:
+        _context.builder = old_builder
 
 
 def get_builder():
-    return _builder
+    return getattr(_context, "builder", NullBuilder)
 
 
 # probably refactor in a class
@@ -53,6 +99,18 @@ def get_package_name(path):
     return "-".join(os.path.split(path)[1].split("-")[:-1])
 
 
+def pth_key(path):
+    """Returns the key of `path` in jar.pth.
+
+    A jar built by build_jar is keyed by its package name, so the next
+    version replaces it; any other path, such as an included jar, is
+    keyed by itself.
+    """
+    if is_clamped_jar(path):
+        return get_package_name(path)
+    return os.path.normpath(path)
+
+
 def read_pth(pth_path):
     paths = OrderedDict()
     if os.path.exists(pth_path):
@@ -61,15 +119,22 @@ def read_pth(pth_path):
                 path = path.strip()
                 if path.startswith("#") or path.startswith("import "):
                     continue  # FIXME consider preserving comments, other user changes
-                name = get_package_name(os.path.split(path)[1])
-                paths[name] = path
+                paths[pth_key(path)] = path
     return paths
 
 
 class JarPth(object):
+    """The jars registered in site-packages/jar.pth, by package name or path (see pth_key).
+
+    Changes are written on closing, under a lock: jar.pth is read again
+    and only the changed entries applied, so concurrent installs do not
+    lose each other's entries, then it is replaced atomically.
+    """
+
     def __init__(self):
         self._jar_pth_path = os.path.join(site.getsitepackages()[0], "jar.pth")
         self._paths = read_pth(self._jar_pth_path)
+        self._changes = OrderedDict()  # name -> path, or None if removed
         self._mutated = False
         log.debug("paths in jar.pth %s are %r", self._jar_pth_path, self)
 
@@ -80,23 +145,45 @@ class JarPth(object):
         self.close()
 
     def _write_jar_pth(self):
-        if self._mutated:
-            with open(self._jar_pth_path, "w") as jar_pth:
-                for name, path in sorted(self.iteritems()):
-                    jar_pth.write(path + "\n")
+        site_dir = os.path.dirname(self._jar_pth_path)
+        with tempfile.NamedTemporaryFile(dir=site_dir, prefix="jar.pth.", delete=False) as jar_pth:
+            for name, path in sorted(self.iteritems()):
+                jar_pth.write(path + "\n")
+            jar_pth.write(LOAD_SITE_CACHE + "\n")
+        os.chmod(jar_pth.name, 0o644)  # readable by every interpreter, unlike a temporary file
+        if os.name == "nt" and os.path.exists(self._jar_pth_path):
+            os.remove(self._jar_pth_path)  # rename does not replace files on Windows
+        os.rename(jar_pth.name, self._jar_pth_path)
 
     def close(self):
-        self._write_jar_pth()
+        if not self._mutated:
+            return
+        with file_lock(self._jar_pth_path + ".lock"):
+            paths = read_pth(self._jar_pth_path)  # including entries written since this was read
+            for name, path in self._changes.iteritems():
+                if path is None:
+                    paths.pop(name, None)
+                else:
+                    paths[name] = path
+            self._paths = paths
+            install_site_loader(os.path.dirname(self._jar_pth_path))  # before jar.pth imports it
+            self._write_jar_pth()
+            # Jars may have been rebuilt even if their paths are unchanged
+            update_site_cache(os.path.dirname(self._jar_pth_path), self.itervalues())
+        self._changes.clear()
+        self._mutated = False
 
     def __getitem__(self, key):
         return self._paths[key]
  
     def __setitem__(self, key, value):
         self._paths[key] = value
+        self._changes[key] = value
         self._mutated = True
 
     def __delitem__(self, key):
         del self._paths[key]
+        self._changes[key] = None
         self._mutated = True
  
     def __contains__(self, key):
@@ -134,11 +221,16 @@ class OutputJar(object):
     # Derived, with heavy modifications, from
     # http://stackoverflow.com/questions/1281229/how-to-use-jaroutputstream-to-create-a-jar-file
 
-    def __init__(self, jar=None, output_path="output.jar"):
+    source = None  # the input being copied, for resolving duplicate entries
+    class_path = ()  # jars the manifest links to, relative to this one
+
+    def __init__(self, jar=None, output_path="output.jar", compression=None, conflicts=None, reproducible=False):
         self.output_path = output_path
+        self.compression = compression or CompressionPolicy()
+        self.index = EntryIndex(conflicts)
+        self.reproducible = reproducible
         if jar is not None:
             self.jar = jar
-            self.output = None
             return
         self.runpy = None
         self.setup()
@@ -157,79 +249,338 @@ class OutputJar(object):
         else:
             log.debug("No __run__.py defined, so defaulting to Jython command line")
             manifest.getMainAttributes()[Attributes.Name.MAIN_CLASS] = "org.python.util.jython"
-
-        self.output = open(self.output_path, "wb")
-        self.jar = JarOutputStream(self.output, manifest)
-        self.created_paths = set()
-        self.build_time = int(time.time() * 1000)
+        if self.class_path:
+            manifest.getMainAttributes()[Attributes.Name.CLASS_PATH] = " ".join(
+                urllib.pathname2url(path) for path in self.class_path)
+
+        if self.reproducible:
+            # Every entry gets the same timestamp, whatever the build time, timezone or file mtimes
+            date_time = reproducible_date_time()
+            self.jar = ArchiveWriter(self.output_path, date_time)
+            self.build_time = to_millis(date_time)
+        else:
+            self.jar = ArchiveWriter(self.output_path)
+            self.build_time = int(time.time() * 1000)
+        manifest_bytes = ByteArrayOutputStream()
+        manifest.write(manifest_bytes)
+        self.jar.write_bytes(JarFile.MANIFEST_NAME, self.build_time, manifest_bytes.toByteArray().tostring())
 
     def close(self):
+        for name, data in self.index.merged_entries():
+            self.create_ancestry(tuple(name.split("/")))
+            self.jar.write_bytes(name, self.build_time, data, *self.compression.get(name))
+        self.write_package_indexes()
         self.jar.close()
-        if self.output:
-            self.output.close()
+
+    def write_package_indexes(self):
+        """Writes META-INF/INDEX.LIST and the Jython package listing for all entries written"""
+        names = self.jar.namelist()
+        self.create_ancestry(tuple(PACKAGES_NAME.split("/")))
+        if not self.class_path:  # with an index, the JVM ignores Class-Path
+            self.jar.write_bytes(JAR_INDEX_NAME, self.build_time, jar_index(os.path.basename(self.output_path), names))
+        self.jar.write_bytes(PACKAGES_NAME, self.build_time, write_packages(java_packages(names)))
+
+    def write_entry(self, name, data):
+        """Writes entry `name` generated by the build, rather than copied from an input"""
+        self.create_ancestry(tuple(name.split("/")))
+        if self.claim(name):
+            self.jar.write_bytes(name, self.build_time, data, *self.compression.get(name))
+
+    def entry_time(self, millis):
+        """Returns the timestamp of an entry from an input last modified at `millis`"""
+        return self.build_time if self.reproducible else millis
+
+    def claim(self, name, hash=None):
+        """Returns True if entry `name` should be written, resolving duplicates by the conflict policy.
+
+        `hash` is the (CRC, size) of the entry, or a function returning
+        it, so byte-identical duplicates are recognized without reading.
+        """
+        return self.index.claim(name, self.source, hash)
+
+    def merge(self, name, data):
+        """Adds `data` to entry `name`, written once all inputs are copied"""
+        self.index.merge(name, data)
 
     def create_ancestry(self, path_parts):
         for i in xrange(len(path_parts), 0, -1):  # right to left
             ancestor = "/".join(path_parts[:-i]) + "/"
             if ancestor == "/":
                 continue  # FIXME shouldn't need to do this special casing
-            if ancestor not in self.created_paths:
-                entry = JarEntry(ancestor)
-                entry.time = self.build_time
-                try:
-                    self.jar.putNextEntry(entry)
-                    self.jar.closeEntry()
-                except ZipException, e:
-                    if not "duplicate entry" in str(e):
-                        log.error("Problem in creating entry %r", entry, exc_info=True)
-                        raise
-                self.created_paths.add(ancestor)
+            if self.claim(ancestor):
+                self.jar.write_bytes(ancestor, self.build_time, "")
+
+
+def fingerprints_path(output_path):
+    return output_path + ".fingerprints"
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for data in read_chunks(f):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class Fingerprints(object):
+    """Records the inputs of a jar (path, size, mtime, content hash) and the entries each contributed"""
+
+    VERSION = 3
+
+    def __init__(self, path, settings=None):
+        self.path = path
+        self.settings = settings or {}
+        self.sources = OrderedDict()
+
+    @classmethod
+    def load(cls, path):
+        fingerprints = cls(path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            log.debug("No usable fingerprints in %s", path)
+            return fingerprints
+        if data.get("version") == cls.VERSION:
+            fingerprints.settings = data["settings"]
+            fingerprints.sources.update(data["sources"])
+        return fingerprints
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump({"version": self.VERSION, "settings": self.settings, "sources": self.sources}, f)
+
+    def stat(self, path):
+        st = os.stat(path)
+        return {"path": path, "size": st.st_size, "mtime": st.st_mtime}
+
+    def unchanged(self, path, previous):
+        """Returns True if `path` has the same size and mtime as recorded in `previous`"""
+        record = self.stat(path)
+        return all(previous[k] == record[k] for k in ("path", "size", "mtime"))
+
+    def fingerprint(self, path, previous=None):
+        """Fingerprints `path`, only rehashing its contents if its size or mtime changed since `previous`"""
+        record = self.stat(path)
+        if previous and all(previous[k] == record[k] for k in ("path", "size", "mtime")):
+            record["sha1"] = previous["sha1"]
+        else:
+            record["sha1"] = hash_file(path)
+        return record
 
 
 class JarCopy(OutputJar):
 
-    def __init__(self, jar=None, output_path="output.jar", runpy=None):
+    def __init__(self, jar=None, output_path="output.jar", runpy=None, incremental=False, workers=1,
+                 compression=None, precompiler=None, pruner=None, conflicts=None, report=NullReport,
+                 reproducible=False, class_path=()):
         self.output_path = output_path
+        self.class_path = class_path
+        self.compression = compression or CompressionPolicy()
+        self.index = EntryIndex(conflicts)
+        self.reproducible = reproducible
+        self.report = report
+        self.precompiler = precompiler
+        self.pruner = pruner
+        self.previous = None
+        self.fingerprints = None
+        self.record = None
+        self.workers = workers
         if jar is not None:
             self.jar = jar
-            self.output = None
             return
         self.runpy = runpy
+        self.incremental = incremental
         self.setup()
 
-    def copy_zip_input_stream(self, zip_input_stream, parent=None):
-        """Given a `zip_input_stream`, copy all entries to the output jar"""
+    def __exit__ (self, type, value, tb):
+        if type is not None:
+            self.fingerprints = None  # do not trust a partially written jar in a later incremental build
+        self.close()
+
+    def setup(self):
+        fingerprints = fingerprints_path(self.output_path)
+        if self.incremental:
+            # Entries are carried over as is, so settings that change
+            # how they are written require a full rebuild
+            settings = {
+                "compression": self.compression.rules,
+                "precompile": self.precompiler.mode if self.precompiler else None,
+                "conflicts": self.index.policy.rules,
+                "reproducible": reproducible_date_time() if self.reproducible else None,
+            }
+            if os.path.exists(self.output_path) and os.path.exists(fingerprints):
+                previous_fingerprints = Fingerprints.load(fingerprints)
+                if json.loads(json.dumps(settings)) == previous_fingerprints.settings:
+                    previous_path = self.output_path + ".previous"
+                    os.rename(self.output_path, previous_path)
+                    self.previous = zipfile.ZipFile(previous_path)
+                    self.previous_fingerprints = previous_fingerprints
+                    log.debug("Incrementally updating %s", self.output_path)
+                else:
+                    log.debug("Settings changed, so fully rebuilding %s", self.output_path)
+            self.fingerprints = Fingerprints(fingerprints, settings)
+        if os.path.exists(fingerprints):
+            os.remove(fingerprints)  # rewritten only once this build completes
+        OutputJar.setup(self)
+
+    def close(self):
+        OutputJar.close(self)
+        if self.previous is not None:
+            self.previous.close()
+            os.remove(self.previous.filename)
+            self.previous = None
+        if self.fingerprints is not None:
+            self.fingerprints.save()
+
+    def claim(self, name, hash=None):
+        claimed = OutputJar.claim(self, name, hash)
+        if self.record is not None:
+            self.record["entries" if claimed else "skipped"].append(name)
+        return claimed
+
+    def merge(self, name, data):
+        OutputJar.merge(self, name, data)
+        if self.record is not None:
+            self.record["merged"].append([name, data.encode("base64")])
+
+    def copy_source(self, key, path, copy):
+        """Calls `copy` to add the entries from the input at `path`.
+
+        In an incremental build, if `path` is unchanged since the
+        previous build its entries are instead carried over verbatim
+        from the previous jar.
+        """
+        self.source = path
+        try:
+            if self.fingerprints is None:
+                return copy()
+            previous = None
+            if self.previous is not None:
+                previous = self.previous_fingerprints.sources.get(key)
+            record = self.fingerprints.fingerprint(path, previous)
+            record["entries"] = []
+            record["skipped"] = []
+            record["excluded"] = []
+            record["merged"] = []
+            record["claimed"] = []  # [name, CRC, size] of entries claimed but not written, such as replaced sources
+            self.record = record
+            if previous is not None and previous["sha1"] == record["sha1"] and self._can_carry_over(previous):
+                log.debug("Carrying over %s", path)
+                for name in previous["entries"]:
+                    info = self.previous.getinfo(name)
+                    if self.claim(name, (info.CRC, info.file_size)):
+                        self.jar.write_raw(self.previous, info)
+                for name, data in previous["merged"]:
+                    self.merge(name, data.decode("base64"))
+                for name, crc, file_size in previous["claimed"]:
+                    self._claim_unwritten(name, (crc, file_size))
+                copied = True
+            else:
+                copied = copy()
+        finally:
+            self.source = None
+            self.record = None
+        if copied is not False:
+            self.fingerprints.sources[key] = record
+        return copied
+
+    def _can_carry_over(self, previous):
+        # Entries that lost to an earlier duplicate must still be
+        # shadowed, otherwise this input now provides them
+        if any(name not in self.index for name in previous["skipped"]):
+            return False
+        # Likewise pruning must still exclude and include the same entries
+        if self.pruner is not None:
+            if any(self.pruner.includes(name) for name in previous["excluded"]):
+                return False
+            if not all(self.pruner.includes(name) for name in previous["entries"]):
+                return False
+        elif previous["excluded"]:
+            return False
+        return all(name in self.previous.NameToInfo for name in previous["entries"])
+
+    def _claim_unwritten(self, name, hash):
+        """Claims entry `name`, which will not be written, so later duplicates are still skipped"""
+        if OutputJar.claim(self, name, hash) and self.record is not None:
+            self.record["claimed"].append([name] + list(hash))
+
+    def _included(self, name):
+        """Returns False if pruning excludes entry `name`"""
+        if self.pruner is None or self.pruner.includes(name):
+            return True
+        if self.record is not None:
+            self.record["excluded"].append(name)
+        return False
 
-        chunk = jarray.zeros(8192, "b")
-        while True:
-            entry = zip_input_stream.getNextEntry()
-            if entry is None:
-                break
+    def copy_archive(self, path, parent=None):
+        """Copy all entries of the zip or jar at `path` to the output jar, without recompressing them"""
+        with zipfile.ZipFile(path) as archive:
+            self.copy_entries(archive, parent)
+
+    def copy_entries(self, archive, parent=None):
+        """Copy all entries of the open zip `archive` to the output jar, without recompressing them.
+
+        Sources to precompile are claimed before they are compiled, so a
+        duplicate is never compiled, then compiled on `workers` threads;
+        entries are written in the order of `archive` by the calling
+        thread.
+        """
+        def prepare((name, info, data)):
+            if data is None:
+                return name, info, None
+            return name, info, self._prepare_entries(name, self.entry_time(to_millis(info.date_time)), data)
+
+        for name, info, prepared in imap_ordered(prepare, self._claim_entries(archive, parent), self.workers):
+            if prepared is not None:
+                self._write_prepared(prepared, name, (info.CRC, info.file_size))
+                continue
+            if self.record is not None:
+                self.record["entries"].append(name)
+            compression = self.compression.match(name)
             try:
-                # NB: cannot simply use old entry because we need
-                # to recompute compressed size
-                if parent:
-                    name = "/".join([parent, entry.name])
+                # Only recompress if the policy asks for a different method
+                if compression is None or compression[0] == info.compress_type:
+                    self.jar.write_raw(archive, info, name)
                 else:
-                    name = entry.name
-                if name.startswith("META-INF/") and name.endswith(".SF"):
-                    # Skip signature files - by their nature, they do
-                    # not work when their source jars are copied
-                    log.debug("Skipping META-INF signature file %s", name)
-                    continue
-                output_entry = JarEntry(name)
-                output_entry.time = entry.time
-                self.jar.putNextEntry(output_entry)
-                while True:
-                    read = zip_input_stream.read(chunk, 0, 8192)
-                    if read == -1:
-                        break
-                    self.jar.write(chunk, 0, read)
-                self.jar.closeEntry()
-            except ZipException, e:
-                if not "duplicate entry" in str(e):
-                    log.error("Problem in copying entry %r", output_entry, exc_info=True)
-                    raise
+                    self.jar.write_recompressed(archive, info, name, *compression)
+            except Exception:
+                log.error("Problem in copying entry %r", name, exc_info=True)
+                raise
+
+    def _claim_entries(self, archive, parent):
+        """Yields (name, info, data) for each entry of `archive` claimed, with the data of a source to precompile.
+
+        The data is read here, on the calling thread, as a zip opened
+        from a file object cannot be read from several threads.
+        """
+        for info in archive.infolist():
+            if parent:
+                name = "/".join([parent, info.filename])
+            else:
+                name = info.filename
+            if name.startswith("META-INF/") and name.endswith(".SF"):
+                log.debug("Skipping META-INF signature file %s", name)
+                continue
+            if name in INDEX_NAMES:
+                log.debug("Skipping index %s, which is regenerated for the output jar", name)
+                continue
+            if self._superseded(info.filename, lambda source: source in archive.NameToInfo):
+                continue
+            if not self._included(name):
+                continue
+            if self.index.merges(name):
+                self.merge(name, archive.read(info))
+                continue
+            # Recorded once written, in the order of the output jar
+            if not OutputJar.claim(self, name, (info.CRC, info.file_size)):
+                if self.record is not None:
+                    self.record["skipped"].append(name)
+            elif self.precompiler is not None and self.precompiler.compiles(name):
+                yield name, info, archive.read(info)
+            else:
+                yield name, info, None
 
     def copy_jars(self, jars):
         """Consumes a sequence of jar paths, fixing up paths as necessary"""
@@ -238,38 +589,158 @@ class JarCopy(OutputJar):
             normed_path = os.path.realpath(os.path.normpath(jar_path))
             if os.path.splitext(normed_path)[1] != ".jar":
                 log.warn("Will only copy jars, not %s", normed_path)
-                next
+                continue
             if normed_path in seen:
-                next
+                continue
             seen.add(normed_path)
             log.debug("Copying %s", normed_path)
-            with open(normed_path) as f:
-                with closing(JarInputStream(f)) as input_jar:
-                    self.copy_zip_input_stream(input_jar)
+            with self.report.timer("jars", path=normed_path, bytes=os.path.getsize(normed_path)):
+                self.copy_source(normed_path, normed_path, lambda: self.copy_archive(normed_path))
+
+    def nest_jars(self, jars):
+        """Stores each (name, path) jar intact and uncompressed under META-INF/lib/, to be loaded in place"""
+        for name, path in jars:
+            log.debug("Nesting %s as %s", path, name)
+            with self.report.timer("jars", path=path, bytes=os.path.getsize(path), nested=True):
+                # Keyed by entry, so an exploded copy of the same jar is never carried over instead
+                self.copy_source(NESTED_DIR + name, path, lambda: self._nest_jar(NESTED_DIR + name, path))
+
+    def _nest_jar(self, name, path):
+        self.create_ancestry(tuple(name.split("/")))
+        if not self.claim(name, lambda: file_hash(path)):
+            return
+        with open(path, "rb") as f:
+            # Never compressed, whatever the policy, so the launcher can read it in place
+            self.jar.write_chunks(name, self.entry_time(int(os.path.getmtime(path) * 1000)), read_chunks(f),
+                                  zipfile.ZIP_STORED)
 
     def copy_file(self, relpath, path):
+        if self._included(relpath) and not self._superseded(relpath, os.path.exists, path):
+            self.copy_source(relpath, path, lambda: self._copy_file(relpath, path))
+
+    def copy_files(self, files):
+        """Copy a sequence of (relpath, path) pairs, compressing them on `workers` threads.
+
+        Compressed entries are written in the order of `files` by the
+        calling thread.
+        """
+        if self.workers <= 1:
+            for relpath, path in files:
+                self.copy_file(relpath, path)
+            return
+
+        def prepare((relpath, path)):
+            if self._likely_carried_over(relpath, path):
+                return relpath, path, None
+            return relpath, path, self._prepare_file(relpath, path)
+
+        files = ((relpath, path) for relpath, path in files
+                 if self._included(relpath) and not self._superseded(relpath, os.path.exists, path))
+        for relpath, path, prepared in imap_ordered(prepare, files, self.workers):
+            self.copy_source(relpath, path, lambda: self._copy_file(relpath, path, prepared))
+
+    def _superseded(self, name, exists, path=None):
+        """Returns True for an existing $py.class that precompiling will regenerate from its source"""
+        if self.precompiler is None or not name.endswith(COMPILED_SUFFIX):
+            return False
+        return exists((path or name)[:-len(COMPILED_SUFFIX)] + ".py")
+
+    def _likely_carried_over(self, key, path):
+        if self.previous is None:
+            return False
+        previous = self.previous_fingerprints.sources.get(key)
+        return previous is not None and self.fingerprints.unchanged(path, previous)
+
+    def _copy_file(self, relpath, path, prepared=None):
         path_parts = tuple(os.path.split(relpath)[0].split(os.sep))
         self.create_ancestry(path_parts)
-        chunk = jarray.zeros(8192, "b")
-        with open(path) as f:
-            with closing(BufferedInputStream(f)) as bis:
-                output_entry = JarEntry(relpath)
-                output_entry.time = os.path.getmtime(path) * 1000
-                try:
-                    self.jar.putNextEntry(output_entry)
-                    while True:
-                        read = bis.read(chunk, 0, 8192)
-                        if read == -1:
-                            break
-                        self.jar.write(chunk, 0, read)
-                    self.jar.closeEntry()
-                except ZipException, e:
-                    if not "duplicate entry" in str(e):
-                        log.error("Problem in creating entry %r", entry, exc_info=True)
-                        raise
+        if self.index.merges(relpath):
+            with open(path, "rb") as f:
+                self.merge(relpath, f.read())
+            return
+        if prepared is None and self.precompiler is not None and self.precompiler.compiles(relpath):
+            prepared = self._prepare_file(relpath, path)
+        if prepared is not None:
+            self._write_prepared(prepared)
+            return
+        if not self.claim(relpath, lambda: file_hash(path)):
+            return
+        try:
+            with open(path, "rb") as f:
+                self.jar.write_chunks(relpath, self.entry_time(int(os.path.getmtime(path) * 1000)), read_chunks(f),
+                                      *self.compression.get(relpath))
+        except Exception:
+            log.error("Problem in creating entry %r", relpath, exc_info=True)
+            raise
+
+    def _prepare_file(self, relpath, path):
+        millis = self.entry_time(int(os.path.getmtime(path) * 1000))
+        with open(path, "rb") as f:
+            data = f.read()
+        return self._prepare_entries(relpath, millis, data)
+
+    def _prepare_entries(self, name, millis, data):
+        """Compresses, and possibly precompiles, `data` for entry `name`.
+
+        Returns a list of (name, ArchiveWriter.write_compressed
+        arguments); safe to call from worker threads.
+        """
+        entries = [(name, data)]
+        if self.precompiler is not None and self.precompiler.compiles(name):
+            compiled = self.precompiler.compile(name, data, millis)
+            if compiled is not None:
+                if not self.precompiler.keep_source:
+                    entries = []
+                entries.append((compiled_name(name), compiled))
+        prepared = []
+        for entry_name, entry_data in entries:
+            compress_type, level = self.compression.get(entry_name)
+            crc, compressed = compress(entry_data, compress_type, level)
+            prepared.append((entry_name, (millis, len(entry_data), crc, compressed, compress_type)))
+        return prepared
+
+    def _write_prepared(self, prepared, claimed=None, claimed_hash=None):
+        """Writes the entries of _prepare_entries, claiming each but the source already `claimed`"""
+        if self.record is not None and claimed is not None:
+            if claimed in [name for name, compressed in prepared]:
+                self.record["entries"].append(claimed)
+            else:
+                self.record["claimed"].append([claimed] + list(claimed_hash))  # replaced by its compiled class
+        for name, compressed in prepared:
+            millis, file_size, crc = compressed[:3]
+            if name != claimed and not self.claim(name, (crc, file_size)):
+                continue
+            try:
+                self.jar.write_compressed(name, *compressed)
+            except Exception:
+                log.error("Problem in creating entry %r", name, exc_info=True)
+                raise
+
+
+def class_module(package, classname):
+    """Returns the Python module of a proxy class, named as package.module.Class"""
+    if package and classname.startswith(package + "."):
+        classname = classname[len(package) + 1:]
+    return classname.rpartition(".")[0]
 
 
 class JarBuilder(OutputJar):
+    """Collects the proxy classes generated while importing clamped modules.
+
+    Classes may be written from any thread; they are compressed on
+    `workers` threads, then written in order of name when the jar is
+    closed, so the jar does not depend on the order of imports.
+    """
+
+    def __init__(self, jar=None, output_path="output.jar", compression=None, proxy_cache=None, workers=1,
+                 report=NullReport, reproducible=False):
+        self.proxy_cache = proxy_cache  # ContentCache of proxy class bytes, if any
+        self.report = report
+        self.classes = {}  # name -> (path parts, result of _prepare_class)
+        self.modules = {}  # name -> the Python module defining the class
+        self.lock = threading.Lock()
+        self.pool = WorkerPool(workers)
+        OutputJar.__init__(self, jar, output_path, compression, reproducible=reproducible)
 
     def __repr__(self):
         return "JarBuilder(output={!r})".format(self.output_path)
@@ -279,12 +750,104 @@ class JarBuilder(OutputJar):
 
     def write_class_bytes(self, package, classname, bytes):
         path_parts = self._canonical_path_parts(package, classname)
-        self.create_ancestry(path_parts)
-        entry = JarEntry("/".join(path_parts) + ".class")
-        entry.time = self.build_time
-        self.jar.putNextEntry(entry)
-        self.jar.write(bytes.toByteArray())
-        self.jar.closeEntry()
+        name = "/".join(path_parts) + ".class"
+        data = bytes.toByteArray().tostring()
+        with self.lock:
+            if name in self.classes:
+                log.warn("Class %s was already written to %s", classname, self.output_path)
+                return
+            self.classes[name] = path_parts, self.pool.submit(self._prepare_class, name, data)
+            self.modules[name] = class_module(package, classname)
+
+    def _prepare_class(self, name, data):
+        compress_type, level = self.compression.get(name)
+        crc, compressed = compress(data, compress_type, level)
+        return len(data), crc, compressed, compress_type
+
+    def close(self):
+        try:
+            for name in sorted(self.classes):
+                path_parts, result = self.classes[name]
+                self.create_ancestry(path_parts)
+                if self.claim(name):
+                    self.jar.write_compressed(name, self.build_time, *result.get())
+        finally:
+            self.pool.close()
+        OutputJar.close(self)
+
+
+class DirectoryBuilder(object):
+    """Writes the proxy classes generated while importing clamped modules to a class directory.
+
+    Meant for development builds: classes are written in place, only if
+    their bytes changed, and the JVM loads them without decompressing.
+    The class files written are listed in .clamp-outputs in the
+    directory. On closing, those listed by the previous build but not
+    written by this one - nor listed in `keep` - are removed, such as
+    those of a renamed class; no other file is touched.
+    """
+
+    def __init__(self, output_path, proxy_cache=None, keep=(), report=NullReport):
+        self.output_path = output_path
+        self.compression = None
+        self.proxy_cache = proxy_cache
+        self.report = report
+        self.keep = set(keep)
+        self.modules = {}  # name -> the Python module defining the class
+        self.lock = threading.Lock()
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path)
+
+    def __repr__(self):
+        return "DirectoryBuilder(output={!r})".format(self.output_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def write_class_bytes(self, package, classname, bytes):
+        name = classname.replace(".", "/") + ".class"
+        data = bytes.toByteArray().tostring()
+        with self.lock:
+            if name in self.modules:
+                log.warn("Class %s was already written to %s", classname, self.output_path)
+                return
+            self.modules[name] = class_module(package, classname)
+        path = os.path.join(self.output_path, *name.split("/"))
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return  # so its mtime is unchanged, as for any tool watching the directory
+        dir_path = os.path.dirname(path)
+        with self.lock:
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def read_outputs(self):
+        try:
+            with open(os.path.join(self.output_path, OUTPUTS_NAME)) as f:
+                return set(line.strip() for line in f if line.strip())
+        except IOError:
+            return set()
+
+    def close(self):
+        outputs = set(self.modules) | self.keep
+        for name in sorted(self.read_outputs() - outputs):
+            path = os.path.join(self.output_path, *name.split("/"))
+            if not os.path.isfile(path):
+                continue
+            log.debug("Removing stale class %s", path)
+            os.remove(path)
+            dir_path = os.path.dirname(path)
+            while dir_path != self.output_path and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+                dir_path = os.path.dirname(dir_path)
+        with open(os.path.join(self.output_path, OUTPUTS_NAME), "w") as f:
+            f.write("".join(name + "\n" for name in sorted(outputs)))
 
 
 def find_jython_jars():
@@ -293,7 +856,7 @@ def find_jython_jars():
     jython_jar_dev_path = os.path.normpath(os.path.join(sys.executable, "../../jython-dev.jar"))
     if os.path.exists(jython_jar_dev_path):
         jars = [jython_jar_dev_path]
-        jars.extend(glob.glob(os.path.normpath(os.path.join(jython_jar_dev_path, "../javalib/*.jar"))))
+        jars.extend(sorted(glob.glob(os.path.normpath(os.path.join(jython_jar_dev_path, "../javalib/*.jar")))))
     elif os.path.exists(jython_jar_path):
         jars = [jython_jar_path]
     else:
@@ -310,13 +873,14 @@ def find_jython_lib_files():
     sitepackages = site.getsitepackages()
     root = os.path.normpath(os.path.join(sys.executable, "../../Lib"))
     for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames.sort()  # so entries are in the same order whatever the filesystem
         ignore = False
         for pkg in sitepackages:
             if dirpath.startswith(pkg):
                 ignore = True
         if ignore:
             continue
-        for filename in filenames:
+        for filename in sorted(filenames):
             path = os.path.join(dirpath, filename)
             relpath = path[len(root)-3:]   # this will of course not work for included directories FIXME bad hack!
             yield relpath, os.path.realpath(path)
@@ -326,75 +890,165 @@ def find_jython_lib_files():
 
 def find_package_libs(root):
     for dirpath, dirnames, filenames in os.walk(root):
-        for filename in filenames:
+        dirnames.sort()
+        for filename in sorted(filenames):
             path = os.path.join(dirpath, filename)
             relpath = path[len(root)+1:]
             yield relpath, path
 
 
-def copy_zip_file(path, output_jar):
-    try:
-        with open(path) as f:
-            with closing(BufferedInputStream(f)) as bis:
-                if not skip_zip_header(bis):
-                    return False
-                with closing(ZipInputStream(bis)) as input_zip:
-                    try:
-                        output_jar.copy_zip_input_stream(input_zip, "Lib")
-                        return True
-                    except ZipException:
-                        return False
-    except IOError:
-        return False
+def find_egg_libs(root):
+    for pkg_relpath, pkg_realpath in find_package_libs(root):
+        # Filter out egg metadata
+        parts = pkg_relpath.split(os.sep)
+        head = parts[0]
+        if head == "EGG-INFO" or head.endswith(".egg-info"):
+            continue
+        yield os.path.join("Lib", pkg_relpath), pkg_realpath
 
 
-def skip_zip_header(bis):
+def find_site_packages_inputs(sitepackage):
+    """Yields (path, files) for each input from site-packages, in the order to copy them.
+
+    `files` iterates over (relpath, path) pairs for packages and
+    unzipped eggs; it is None for zipped eggs.
+    """
+    # FOR NOW: copy everything in site-packages into Lib/ in the built jar;
+    # this is because Jython in standalone mode has the limitation that it can
+    # only properly find packages under Lib/ and cannot process .pth files
+    # THIS SHOULD BE FIXED
+
+    # copy top level packages
+    for item in sorted(os.listdir(sitepackage)):
+        path = os.path.join(sitepackage, item)
+        if path.endswith(".egg") or path.endswith(".egg-info") or path.endswith(".pth") or item == "jars":
+            continue
+        yield path, ((os.path.join("Lib", item, pkg_relpath), pkg_realpath)
+                     for pkg_relpath, pkg_realpath in find_package_libs(path))
+
+    # copy eggs
+    for path in read_pth(os.path.join(sitepackage, "easy-install.pth")).itervalues():
+        path = os.path.realpath(os.path.normpath(os.path.join(sitepackage, path)))
+        if os.path.isfile(path):
+            yield path, None
+        else:
+            yield path, find_egg_libs(path)
+
+
+def archive_names(path, parent=None):
     try:
-        for i in xrange(2000):
-            # peek ahead 2 bytes to look for PK in header
-            bis.mark(2)
-            first = chr(bis.read())
-            second = chr(bis.read())
-            if first == "P" and second == "K":
-                bis.reset() 
-                return True
-            else:
-                bis.reset()
-                bis.read()
+        with zipfile.ZipFile(path) as archive:
+            return ["/".join(filter(None, [parent, name])) for name in archive.namelist()]
+    except (IOError, zipfile.BadZipfile):
+        return []
+
+
+def scan_inputs(index, jars, lib_files, site_inputs, runpy=None):
+    """Records the entries each input provides, so the last policy can pick the winner before copying"""
+    for jar_path in jars:
+        normed_path = os.path.realpath(os.path.normpath(jar_path))
+        index.scan(normed_path, archive_names(normed_path))
+    for relpath, path in lib_files:
+        index.scan(path, [relpath])
+    for path, files in site_inputs:
+        if files is None:
+            index.scan(path, archive_names(path, "Lib"))
         else:
-            return False
-    except ValueError:  # consume -1 on unsuccessful read
+            for relpath, file_path in files:
+                index.scan(file_path, [relpath])
+    if runpy and os.path.exists(runpy):
+        index.scan(runpy, ["__run__.py"])
+
+
+def copy_zip_file(path, output_jar):
+    """Copies the zipped egg at `path` under Lib/, returning False if it cannot be opened as a zip.
+
+    Errors once entries are being copied are raised instead, as the
+    output jar already has some of them.
+    """
+    try:
+        archive = zipfile.ZipFile(path)
+    except (IOError, zipfile.BadZipfile):
+        log.warn("Not copying %s, which cannot be read as a zip", path, exc_info=True)
         return False
+    with archive:
+        output_jar.copy_entries(archive, "Lib")
+    return True
+
+
+def import_modules(builder, modules, workers=1):
+    """Imports `modules`, writing their proxy classes to `builder`.
 
+    With several `workers`, modules are imported on that many threads;
+    note that Jython serializes the execution of module bodies, so the
+    gain is mostly from compressing classes while imports continue.
+    """
+    report = getattr(builder, "report", NullReport)
 
-def build_jar(package_name, jar_name, clamp_setup, output_path=None):
+    def import_module(module):
+        with register_builder(builder):  # on the importing thread, which may be a worker
+            with report.timer("modules", name=module):
+                return __import__(module)
+
+    for module in imap_ordered(import_module, modules, workers):
+        pass
+
+
+def is_class_dir(output_path):
+    """Returns whether `output_path` is for a class directory rather than a jar, by ending in a separator"""
+    return output_path.endswith(("/", os.sep))
+
+
+def build_jar(package_name, jar_name, clamp_setup, output_path=None, compression=None, workers=1, exploded=False,
+              report=NullReport, reproducible=False, proxy_cache=True):
+    """Builds a jar of the proxy classes of the modules in `clamp_setup`, returning its closed builder.
+
+    With `exploded`, or if `output_path` ends in a separator, the
+    classes are instead written to a directory. With `reproducible`,
+    the same modules always give the same bytes. Without `proxy_cache`,
+    every proxy class is generated, and none is cached.
+    """
     update_jar_pth = not(output_path)
     if output_path is None:
         jar_dir = init_jar_dir()
         output_path = os.path.join(jar_dir, jar_name)
-        # Remove the old jar (if present) to prevent from being imported.
+        class_dir = os.path.join(jar_dir, os.path.splitext(jar_name)[0])
+        # Remove the old jar (if present) to prevent from being imported;
+        # a class directory is updated in place, so only leaves sys.path.
         #
         # Note that it will still be scanned by SysPackageManager,
         # because that happens before any user-level Python code (like
-        # this module) can be run. This will be addressed when the
-        # build preemptively creates such package cache data.
-        try:
-            sys.path.remove(output_path)
-        except ValueError:
-            pass
+        # this module) can be run. The new jar carries its own package
+        # listing (see clamp.packages), so it need not be scanned again.
+        for path in (output_path, class_dir):
+            try:
+                sys.path.remove(path)
+            except ValueError:
+                pass
         try:
             os.remove(output_path)
         except OSError:
             pass
-
-    with JarBuilder(output_path=output_path) as builder:
-        with register_builder(builder):
-            for module in clamp_setup.modules:
-                __import__(module)
+        if exploded:
+            output_path = class_dir
+    elif is_class_dir(output_path):
+        exploded = True
+        output_path = os.path.normpath(output_path)
+
+    cache = ContentCache("proxies") if proxy_cache else None
+    if exploded:
+        builder = DirectoryBuilder(output_path, proxy_cache=cache, report=report)
+    else:
+        builder = JarBuilder(output_path=output_path, compression=compression, proxy_cache=cache,
+                             workers=workers, report=report, reproducible=reproducible)
+    with builder:
+        import_modules(builder, clamp_setup.modules, workers)
+    report.measure_output(output_path)
 
     if update_jar_pth:
         with JarPth() as paths:
-            paths[package_name] = os.path.join("./jars", jar_name)
+            paths[package_name] = os.path.join("./jars", os.path.basename(output_path))
+    return builder
 
 
 def get_included_jars(src_dir, packages):
@@ -408,71 +1062,290 @@ def get_included_jars(src_dir, packages):
                     yield path[prefix_length:]
 
 
+def jar_store_dir():
+    """Content-addressed store of included jars, shared by all packages in site-packages"""
+    return os.path.join(site.getsitepackages()[0], "jars", "store")
+
+
+def make_dirs(dir_path):
+    if not os.path.isdir(dir_path):
+        try:
+            os.makedirs(dir_path)
+        except OSError:
+            if not os.path.isdir(dir_path):  # otherwise made by a concurrent install
+                raise
+
+
+def store_jar(path, store_dir):
+    """Adds the jar at `path` to the store, if not already there; returns its digest and stored path"""
+    digest = hash_file(path)
+    stored_path = os.path.join(store_dir, digest[:2], digest + ".jar")
+    if not os.path.exists(stored_path):
+        dir_path = os.path.dirname(stored_path)
+        make_dirs(dir_path)
+        # Copied under a temporary name, so the store never has partial jars
+        with tempfile.NamedTemporaryFile(dir=dir_path, delete=False) as f:
+            with open(path, "rb") as jar:
+                shutil.copyfileobj(jar, f)
+        os.chmod(f.name, 0o644)
+        os.rename(f.name, stored_path)
+        log.debug("Stored %s as %s", path, stored_path)
+    return digest, stored_path
+
+
+def install_stored_jar(digest, stored_path, dest_path):
+    """Hardlinks `dest_path` to the stored jar, or copies it if links are not supported.
+
+    Returns False if `dest_path` already has the same contents.
+    """
+    if os.path.exists(dest_path):
+        if os.path.samefile(stored_path, dest_path) or hash_file(dest_path) == digest:
+            return False
+        os.remove(dest_path)  # never write through a link shared with other packages
+    dir_path = os.path.dirname(dest_path)
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    try:
+        os.link(stored_path, dest_path)
+    except (AttributeError, OSError), e:
+        # Such as EXDEV, if site-packages spans filesystems, or no links on this platform
+        log.debug("Cannot link %s (%s), so copying it", stored_path, e)
+        shutil.copy2(stored_path, dest_path)
+    return True
+
+
+def prune_jar_store(store_dir):
+    """Removes the stored jars that no package links to, returning how many were removed.
+
+    A stored jar whose only link is its own is not installed anywhere -
+    packages that had to copy it have their own copy - so it would only
+    save hashing a future install. Call under the store lock.
+    """
+    removed = 0
+    for dirpath, dirs, files in os.walk(store_dir, topdown=False):
+        for filename in files:
+            path = os.path.join(dirpath, filename)
+            if filename.endswith(".jar") and os.stat(path).st_nlink <= 1:
+                log.debug("Removing unused stored jar %s", path)
+                os.remove(path)
+                removed += 1
+        if dirpath != store_dir and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
+
+
 def copy_included_jars(package_name, packages, src_dir=None, dest_dir=None):
+    """Installs the jars in `packages` into site-packages, returning their paths.
+
+    Each jar is stored once by content, then hardlinked into `dest_dir`,
+    so packages bundling the same jar share it, and a reinstall skips
+    jars that have not changed. Stored jars no longer linked from any
+    package, such as old versions, are then removed. Each jar is
+    registered in jar.pth by its path, replacing those the package no
+    longer includes.
+    """
     # FIXME ideally dest_dir would be the corresponding egg, but this requires additional work
     # so that setuptools will not remove upon subsequent runs of setuptool commands
     if src_dir is None:
         src_dir = os.getcwd()
     if dest_dir is None:
         dest_dir = os.path.join(site.getsitepackages()[0], package_name)
+    store_dir = jar_store_dir()
     jar_files = sorted(get_included_jars(src_dir, packages))
-    distutils.dir_util.create_tree(dest_dir, jar_files)
-    for jar_file in jar_files:
-        distutils.file_util.copy_file(os.path.join(src_dir, jar_file), os.path.join(dest_dir, jar_file))
+    changed = set()
+    make_dirs(store_dir)
+    # So a concurrent install never prunes a jar between storing and linking it
+    with file_lock(store_dir + ".lock"):
+        for jar_file in jar_files:
+            digest, stored_path = store_jar(os.path.join(src_dir, jar_file), store_dir)
+            if install_stored_jar(digest, stored_path, os.path.join(dest_dir, jar_file)):
+                log.debug("Installed %s", jar_file)
+                changed.add(jar_file)
+            else:
+                log.debug("Skipping unchanged %s", jar_file)
+        prune_jar_store(store_dir)
     with JarPth() as paths:
+        included = set(pth_key(os.path.join(".", package_name, jar_file)) for jar_file in jar_files)
+        for key, path in list(paths.iteritems()):
+            if key not in included and os.path.normpath(path).split(os.sep)[0] == package_name:
+                del paths[key]  # no longer included, such as an older version
         for jar_file in jar_files:
-            paths[jar_file] = os.path.join(".", package_name, jar_file)
+            path = os.path.join(".", package_name, jar_file)
+            key = pth_key(path)
+            # Left as is if unchanged, so jar.pth and its site cache are not rewritten
+            if jar_file in changed or key not in paths or paths[key] != path:
+                paths[key] = path
     return [os.path.join(dest_dir, jar_file) for jar_file in jar_files]
-            
-            
-def create_singlejar(output_path, classpath, runpy):
-    jars = classpath
-    jars.extend(find_jython_jars())
+
+
+def create_singlejar(output_path, classpath, runpy, incremental=False, workers=1, compression=None,
+                     precompiler=None, pruner=None, conflicts=None, report=NullReport, reproducible=False,
+                     nested=False, startup_order=None):
     site_path = site.getsitepackages()[0]
     with JarPth() as jar_pth:
-        for jar_path in sorted(jar_pth.itervalues()):
-            jars.append(os.path.join(site_path, jar_path))
-    
-    with JarCopy(output_path=output_path, runpy=runpy) as singlejar:
-        singlejar.copy_jars(jars)
+        pth_jars = [(jar_path, os.path.join(site_path, jar_path)) for jar_path in sorted(jar_pth.itervalues())]
+    if nested:
+        # Jython and the clamped jars are still copied, as loading the
+        # nested jars needs them; all other jars are nested whole
+        jars = find_jython_jars() + [path for jar_path, path in pth_jars if is_clamped_jar(jar_path)]
+        nested_jars = nested_names(classpath + [path for jar_path, path in pth_jars if not is_clamped_jar(jar_path)])
+        if pruner is not None and nested_jars:
+            pruner.roots.append("clamp.launcher")
+    else:
+        jars = classpath + find_jython_jars() + [path for jar_path, path in pth_jars]
+        nested_jars = []
+
+    lib_files = find_jython_lib_files()
+    site_inputs = find_site_packages_inputs(site_path)
+    scan = conflicts is not None and conflicts.uses("last")
+    if pruner is not None or scan or report is not NullReport:
+        # Every input has to be listed up front to resolve the import
+        # graph, or to know which input provides an entry last; listing
+        # also separates walking from copying in the report
+        with report.timer("phases", name="walk-stdlib"):
+            lib_files = list(lib_files)
+        with report.timer("phases", name="walk-site-packages"):
+            site_inputs = [(path, files if files is None else list(files)) for path, files in site_inputs]
+    if pruner is not None:
+        # In the order they are copied, so the first source of a module wins here too
+        for jar_path in jars:
+            pruner.add_archive(os.path.realpath(os.path.normpath(jar_path)))
+        pruner.add_files(lib_files)
+        for path, files in site_inputs:
+            if files is None:
+                pruner.add_archive(path, "Lib")
+            else:
+                pruner.add_files(files)
+        if runpy:
+            pruner.add_script(runpy)
+        with report.timer("phases", name="prune"):
+            pruner.resolve()
+
+    with JarCopy(output_path=output_path, runpy=runpy, incremental=incremental, workers=workers,
+                 compression=compression, precompiler=precompiler, pruner=pruner, conflicts=conflicts,
+                 report=report, reproducible=reproducible) as singlejar:
+        if scan:
+            with report.timer("phases", name="scan"):
+                scan_inputs(singlejar.index, jars, lib_files, site_inputs, runpy)
+        with report.timer("phases", name="jars"):
+            singlejar.copy_jars(jars)
+        if nested_jars:
+            with report.timer("phases", name="nested-jars"):
+                singlejar.nest_jars(nested_jars)
+            singlejar.write_entry(NESTED_LIST_NAME, "".join(name + "\n" for name, path in nested_jars))
+            singlejar.write_entry("Lib/sitecustomize.py", SITECUSTOMIZE)
         log.debug("Copying standard library")
-        for relpath, realpath in find_jython_lib_files():
-            singlejar.copy_file(relpath, realpath)
-
-        # FOR NOW: copy everything in site-packages into Lib/ in the built jar;
-        # this is because Jython in standalone mode has the limitation that it can
-        # only properly find packages under Lib/ and cannot process .pth files
-        # THIS SHOULD BE FIXED
-            
-        sitepackage = site.getsitepackages()[0]
-
-        # copy top level packages
-        for item in os.listdir(sitepackage):
-            path = os.path.join(sitepackage, item)
-            if path.endswith(".egg") or path.endswith(".egg-info") or path.endswith(".pth") or path == "jars":
-                continue
-            log.debug("Copying package %s", path)
-            for pkg_relpath, pkg_realpath in find_package_libs(path):
-                log.debug("Copy package file %s %s", pkg_relpath, pkg_realpath)
-                singlejar.copy_file(os.path.join("Lib", item, pkg_relpath), pkg_realpath)
+        with report.timer("phases", name="stdlib"):
+            singlejar.copy_files(lib_files)
 
-        # copy eggs
-        for path in read_pth(os.path.join(sitepackage, "easy-install.pth")).itervalues():
-            relpath = "/".join(os.path.normpath(os.path.join("Lib", path)).split(os.sep))  # ZIP only uses /
-            path = os.path.realpath(os.path.normpath(os.path.join(sitepackage, path)))
+        with report.timer("phases", name="site-packages"):
+            copy_site_inputs(singlejar, site_inputs)
 
-            if copy_zip_file(path, singlejar):
+        if runpy and os.path.exists(runpy):
+            singlejar.copy_file("__run__.py", runpy)
+    if startup_order:
+        with report.timer("phases", name="startup-order"):
+            order_entries(output_path, startup_order)
+    report.measure_output(output_path)
+
+
+def nested_names(jars):
+    """Returns (name, path) for each of `jars` to nest, named by its file name, made unique in order"""
+    seen = set()
+    names = set()
+    nested = []
+    for jar_path in jars:
+        normed_path = os.path.realpath(os.path.normpath(jar_path))
+        if normed_path in seen:
+            continue
+        seen.add(normed_path)
+        base, ext = os.path.splitext(os.path.basename(normed_path))
+        name = base + ext
+        count = 1
+        while name in names:
+            count += 1
+            name = "{}-{}{}".format(base, count, ext)
+        names.add(name)
+        nested.append((name, normed_path))
+    return nested
+
+
+def copy_site_inputs(singlejar, site_inputs):
+    for path, files in site_inputs:
+        if files is None:
+            if singlejar.copy_source(path, path, lambda: copy_zip_file(path, singlejar)):
                 log.debug("Copying %s (zipped file)", path)  # tiny lie - already copied, but keeping consistent!
-                continue
+            continue
+        log.debug("Copying %s", path)
+        singlejar.copy_files(files)
 
-            log.debug("Copying egg %s", path)
-            for pkg_relpath, pkg_realpath in find_package_libs(path):
-                # Filter out egg metadata
-                parts = pkg_relpath.split(os.sep)
-                head = parts[0]
-                if head == "EGG-INFO" or head.endswith(".egg-info"):
-                    continue
-                singlejar.copy_file(os.path.join("Lib", pkg_relpath), pkg_realpath)
 
-        if runpy and os.path.exists(runpy):
-            singlejar.copy_file("__run__.py", runpy)
+def layer_path(output_path, layer):
+    """Returns the path of `layer` of the layered singlejar at `output_path`"""
+    base, ext = os.path.splitext(output_path)
+    return "{}-{}{}".format(base, layer, ext or ".jar")
+
+
+def is_clamped_jar(jar_path):
+    """Returns whether `jar_path`, as listed in jar.pth, was built by build_jar rather than included"""
+    return os.path.normpath(jar_path).split(os.sep)[0] == "jars"
+
+
+def create_layered_jars(output_path, classpath, runpy, incremental=False, workers=1, compression=None,
+                        precompiler=None, conflicts=None, report=NullReport, reproducible=False, startup_order=None):
+    """Writes a singlejar as three jars, so a change to the application does not rewrite the runtime.
+
+    - runtime layer: the Jython jars and standard library
+    - deps layer: jars on `classpath`, included jars and eggs
+    - application (`output_path`): clamped jars, the other packages in
+      site-packages and __run__.py, linking the other layers from the
+      Class-Path of its manifest
+
+    The layers are written next to `output_path`, and must be shipped
+    together. Each is a jar built as a singlejar is, so incremental and
+    reproducible builds leave the layers whose inputs did not change
+    identical. Returns the paths of the layers.
+    """
+    site_path = site.getsitepackages()[0]
+    app_jars = []
+    dep_jars = list(classpath)
+    with JarPth() as jar_pth:
+        for jar_path in sorted(jar_pth.itervalues()):
+            (app_jars if is_clamped_jar(jar_path) else dep_jars).append(os.path.join(site_path, jar_path))
+    with report.timer("phases", name="walk-stdlib"):
+        lib_files = list(find_jython_lib_files())
+    with report.timer("phases", name="walk-site-packages"):
+        site_inputs = [(path, files if files is None else list(files))
+                       for path, files in find_site_packages_inputs(site_path)]
+    eggs = [(path, files) for path, files in site_inputs if path.endswith(".egg")]
+    packages = [(path, files) for path, files in site_inputs if not path.endswith(".egg")]
+
+    runtime_path, deps_path = [layer_path(output_path, layer) for layer in LAYERS]
+    layers = [
+        ("runtime", runtime_path, None, list(find_jython_jars()), lib_files, [], ()),
+        ("deps", deps_path, None, dep_jars, [], eggs, ()),
+        ("app", output_path, runpy, app_jars, [], packages,
+         (os.path.basename(deps_path), os.path.basename(runtime_path))),
+    ]
+    for layer, path, layer_runpy, jars, layer_lib_files, layer_site_inputs, class_path in layers:
+        log.debug("Writing %s layer to %s", layer, path)
+        with report.timer("phases", name="layer-" + layer):
+            with JarCopy(output_path=path, runpy=layer_runpy, incremental=incremental, workers=workers,
+                         compression=compression, precompiler=precompiler, conflicts=conflicts, report=report,
+                         reproducible=reproducible, class_path=class_path) as layer_jar:
+                if conflicts is not None and conflicts.uses("last"):
+                    scan_inputs(layer_jar.index, jars, layer_lib_files, layer_site_inputs, layer_runpy)
+                layer_jar.copy_jars(jars)
+                layer_jar.copy_files(layer_lib_files)
+                copy_site_inputs(layer_jar, layer_site_inputs)
+                if layer == "runtime":
+                    layer_jar.write_entry("Lib/sitecustomize.py", LAYERS_SITECUSTOMIZE)
+                else:
+                    layer_jar.write_entry(LAYER_MARKER, layer + "\n")
+                if layer_runpy and os.path.exists(layer_runpy):
+                    layer_jar.copy_file("__run__.py", layer_runpy)
+            if startup_order:
+                order_entries(path, startup_order)
+        report.measure_output(path, layer=layer)
+    report.measure_output(output_path)
+    return [runtime_path, deps_path, output_path]
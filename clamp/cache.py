@@ -0,0 +1,70 @@
+"""Local cache of build outputs, shared across builds
+
+Outputs are stored under a hash of everything that determines them,
+so an entry never needs to be invalidated - a changed input simply
+produces a different key.
+"""
+
+import hashlib
+import logging
+import os
+import os.path
+import tempfile
+
+log = logging.getLogger(__name__)
+
+
+def cache_dir():
+    """Root of the cache, which can be set with the CLAMP_CACHE_DIR environment variable"""
+    return os.environ.get("CLAMP_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".clamp", "cache")
+
+
+def make_key(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode("utf-8")
+        else:
+            part = str(part)
+        digest.update(str(len(part)))  # length prefix, so adjacent parts cannot run together
+        digest.update(":")
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ContentCache(object):
+
+    def __init__(self, namespace, root=None):
+        self.path = os.path.join(root or cache_dir(), namespace)
+
+    def __repr__(self):
+        return "ContentCache({!r})".format(self.path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Returns the data stored under `key`, or None"""
+        try:
+            with open(self._entry_path(key), "rb") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def put(self, key, data):
+        """Stores `data` under `key`; concurrent builds may safely put the same key"""
+        path = self._entry_path(key)
+        dir_path = os.path.dirname(path)
+        try:
+            if not os.path.isdir(dir_path):
+                try:
+                    os.makedirs(dir_path)
+                except OSError:
+                    if not os.path.isdir(dir_path):  # lost a race with another build
+                        raise
+            with tempfile.NamedTemporaryFile(dir=dir_path, delete=False) as f:
+                f.write(data)
+            os.rename(f.name, path)
+        except (IOError, OSError):
+            # Caching is only an optimization, so never fail the build
+            log.warn("Could not write %s to %r", key, self, exc_info=True)
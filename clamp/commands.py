@@ -3,12 +3,22 @@ import logging
 import os
 import os.path
 import setuptools
+import shlex
 import sys
 from contextlib import contextmanager
-from distutils.errors import DistutilsOptionError, DistutilsSetupError
+from distutils.errors import DistutilsExecError, DistutilsOptionError, DistutilsSetupError
 from setuptools.command.install import install
 
-from clamp.build import create_singlejar, build_jar, copy_included_jars
+from clamp.archive import CompressionPolicy, ConflictPolicy
+from clamp.build import (
+    LAYERS, create_layered_jars, create_singlejar, build_jar, copy_included_jars, is_class_dir, layer_path)
+from clamp.daemon import DaemonUnavailable, submit
+from clamp.parallel import default_workers
+from clamp.precompile import MODES as PRECOMPILE_MODES, Precompiler
+from clamp.prune import Pruner
+from clamp.report import BuildReport, NullReport
+from clamp.startup import order_entries, read_profile, train_startup
+from clamp.watch import JarWatcher
 
 logging.basicConfig()
 log = logging.getLogger("clamp")
@@ -24,6 +34,53 @@ def honor_verbosity(verbose):
         log.setLevel(old_level)
 
 
+def parse_workers(value):
+    """Parses a number of worker threads, where 0 means one per available core"""
+    try:
+        workers = int(value)
+    except ValueError:
+        raise DistutilsOptionError("Number of workers must be an integer, not {}".format(value))
+    if workers < 0:
+        raise DistutilsOptionError("Number of workers must not be negative, not {}".format(workers))
+    return workers or default_workers()
+
+
+def parse_compression(spec):
+    """Parses a compression policy like "*.jar=store,*=9", if any"""
+    if not spec:
+        return None
+    try:
+        return CompressionPolicy.parse(spec)
+    except ValueError, e:
+        raise DistutilsOptionError(str(e))
+
+
+def parse_conflicts(spec):
+    """Parses how to resolve duplicate entries, like "*.properties=last,org/example/*=error", if at all"""
+    if not spec:
+        return None
+    try:
+        return ConflictPolicy.parse(spec)
+    except ValueError, e:
+        raise DistutilsOptionError(str(e))
+
+
+def parse_precompile(mode):
+    """Parses how to precompile bundled modules, if at all"""
+    if not mode:
+        return None
+    try:
+        return Precompiler(mode)
+    except ValueError, e:
+        raise DistutilsOptionError(str(e))
+
+
+def parse_list(value):
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
 class ClampSetup(object):
     
     # FIXME include such things as excluded/included jars, etc
@@ -32,6 +89,64 @@ class ClampSetup(object):
         self.modules = modules
 
 
+def startup_order(job):
+    """Returns the entries of the startup profile of `job` to write first, unless it is about to be retrained"""
+    profile = job.get("startup_profile")
+    if profile and not job.get("train_startup") and os.path.exists(profile):
+        return read_profile(profile)
+    return None
+
+
+def run_job(job):
+    """Runs the build described by `job`, a dict of options as given on the command line"""
+    command = job["command"]
+    report = BuildReport(command) if job.get("report") else NullReport
+    if command == "build_jar":
+        builder = build_jar(job["package_name"], job["jar_name"], ClampSetup(job["modules"]), job["output"],
+                            parse_compression(job["compression"]), job["workers"], job.get("exploded", False), report,
+                            job.get("reproducible", False), job.get("proxy_cache", True))
+    elif command == "singlejar" and job.get("layered"):
+        create_layered_jars(job["output"], job["classpath"], job["runpy"], job["incremental"], job["workers"],
+                            parse_compression(job["compression"]), parse_precompile(job["precompile"]),
+                            parse_conflicts(job["conflicts"]), report, job.get("reproducible", False),
+                            startup_order(job))
+    elif command == "singlejar":
+        pruner = Pruner(job["modules"], parse_list(job["include_modules"])) if job["prune"] else None
+        create_singlejar(job["output"], job["classpath"], job["runpy"], job["incremental"], job["workers"],
+                         parse_compression(job["compression"]), parse_precompile(job["precompile"]), pruner,
+                         parse_conflicts(job["conflicts"]), report, job.get("reproducible", False),
+                         job.get("nested", False), startup_order(job))
+    else:
+        raise DistutilsOptionError("Unknown build command {}".format(command))
+    if command == "singlejar" and job.get("train_startup"):
+        outputs = [job["output"]]
+        if job.get("layered"):
+            outputs.extend(layer_path(job["output"], layer) for layer in LAYERS)
+        with report.timer("phases", name="train-startup"):
+            names = train_startup(job["output"], job["startup_profile"], outputs, shlex.split(job.get("train_args") or ""))
+            for path in outputs:
+                order_entries(path, names)
+    if job.get("report"):
+        report.save(job["report"])
+    if command == "build_jar" and job.get("watch"):
+        JarWatcher(job["modules"], builder, job["workers"], report_path=job.get("report")).run()
+
+
+def run_build(job, daemon=False, verbose=1):
+    """Runs `job` on the build daemon if asked to and one is running, otherwise in this process"""
+    if daemon:
+        try:
+            error = submit(job, verbose)
+        except DaemonUnavailable, e:
+            log.warn("%s, so building in this process", e)
+        else:
+            if error is not None:
+                raise DistutilsExecError("Build failed on the build daemon:\n{}".format(error))
+            return
+    with honor_verbosity(verbose):
+        run_job(job)
+
+
 def parse_clamp_keyword(distribution, keyword, values):
     if keyword != "clamp":
         raise DistutilsSetupError("invalid keyword: {}".format(keyword))
@@ -59,35 +174,83 @@ class build_jar_command(setuptools.Command):
 
     description = "create a jar for all clamped Python classes for this package"
     user_options = [
-        ("output=",   "o", "write jar to output path"),
+        ("output=",   "o", "write jar to output path, or classes to a directory if it ends in a separator"),
+        ("exploded",   "x",  "write classes to a directory, registered in jar.pth instead of the jar"),
+        ("compression=", "z", "comma-separated GLOB=LEVEL rules, where LEVEL is store or 0-9"),
+        ("workers=",   "j",  "number of threads importing modules and compressing classes (0 for one per core)"),
+        ("daemon",     "d",  "run the build on the build daemon, if one is running"),
+        ("watch",      "w",  "after building, rebuild the classes of modules as their sources change"),
+        ("report=",    None, "write timings and sizes of the build as JSON to this path"),
+        ("reproducible", None, "write the same bytes for the same modules, with fixed timestamps"),
+        ("no-proxy-cache", None, "generate every proxy class, without reading or writing the proxy cache"),
     ]
+    boolean_options = ["exploded", "daemon", "watch", "reproducible", "no-proxy-cache"]
 
     def initialize_options(self):
         self.output = None
+        self.exploded = False
+        self.report = None
+        self.reproducible = False
+        self.no_proxy_cache = False
+        self.compression = None
+        self.workers = 1
+        self.daemon = False
+        self.watch = False
 
     def finalize_options(self):
+        self.workers = parse_workers(self.workers)
+        if self.watch and self.daemon:
+            raise DistutilsOptionError("--watch runs until interrupted, so cannot run on the build daemon")
+        parse_compression(self.compression)  # validated here, but parsed by the build itself
         if self.output is not None:
             dir_path = os.path.split(self.output)[0]
             if dir_path and not os.path.exists(dir_path):
                 raise DistutilsOptionError("Directory {} to write jar must exist".format(dir_path))
-            if os.path.splitext(self.output)[1] != ".jar":
-                raise DistutilsOptionError("Path must be to a valid jar name, not {}".format(self.output))
+            if is_class_dir(self.output):
+                self.exploded = True
+            if self.exploded and os.path.isfile(self.output):
+                raise DistutilsOptionError("--exploded writes to a directory, not {}".format(self.output))
+            if not self.exploded and os.path.isdir(self.output):
+                raise DistutilsOptionError(
+                    "{} is a directory; pass --exploded, or end it in a separator, to write classes to it".format(
+                        self.output))
+            if os.path.isfile(self.output) and os.path.splitext(self.output)[1] != ".jar":
+                raise DistutilsOptionError("Path must be to a valid jar name or a directory, not {}".format(
+                    self.output))
 
     def get_jar_name(self):
         metadata = self.distribution.metadata
         return "{}-{}.jar".format(metadata.get_name(), metadata.get_version())
 
     def run(self):
-        with honor_verbosity(self.distribution.verbose):
-            if not self.distribution.clamp:
-                raise DistutilsOptionError("Specify the modules to be built into a jar  with the 'clamp' setup keyword")
-            build_jar(self.distribution.metadata.get_name(),
-                      self.get_jar_name(), self.distribution.clamp, self.output)
+        if not self.distribution.clamp:
+            raise DistutilsOptionError("Specify the modules to be built into a jar  with the 'clamp' setup keyword")
+        run_build({
+            "command": "build_jar",
+            "package_name": self.distribution.metadata.get_name(),
+            "jar_name": self.get_jar_name(),
+            "modules": list(self.distribution.clamp.modules),
+            "output": self.output and os.path.abspath(self.output),
+            "compression": self.compression,
+            "workers": self.workers,
+            "exploded": bool(self.exploded),
+            "watch": bool(self.watch),
+            "report": self.report and os.path.abspath(self.report),
+            "reproducible": bool(self.reproducible),
+            "proxy_cache": not self.no_proxy_cache,
+        }, self.daemon, self.distribution.verbose)
 
 
 class clamp_command(install):
 
     description = "install required jars, run usual install, and clamp modules into jar"
+    user_options = install.user_options + [
+        ("report=",    None, "write timings and sizes of building the jar as JSON to this path"),
+    ]
+
+    def initialize_options(self):
+        install.initialize_options(self)
+        self.report = None
 
     def get_jar_name(self):
         metadata = self.distribution.metadata
@@ -116,8 +279,11 @@ class clamp_command(install):
             self.do_egg_install()
 
             # 3. Building clamped jar relies on both included jars and Python classes
+            report = BuildReport("clamp") if self.report else NullReport
             build_jar(self.distribution.metadata.get_name(),
-                      self.get_jar_name(), self.distribution.clamp)
+                      self.get_jar_name(), self.distribution.clamp, report=report)
+            if self.report:
+                report.save(self.report)
 
 
 class singlejar_command(setuptools.Command):
@@ -127,22 +293,88 @@ class singlejar_command(setuptools.Command):
         ("output=",    "o",  "write jar to output path"),
         ("classpath=", None, "jars to include in addition to Jython runtime and site-packages jars"),  # FIXME take a list?
         ("runpy=",     "r",  "path to __run__.py to make a runnable jar"),
+        ("incremental", "i", "only recopy inputs that changed since the previous build of the output jar"),
+        ("workers=",   "j",  "number of threads compressing entries (0 for one per core)"),
+        ("compression=", "z", "comma-separated GLOB=LEVEL rules, where LEVEL is store or 0-9"),
+        ("precompile=", None, "compile bundled modules to $py.class, added next to (add) or instead of (replace) sources"),
+        ("prune",      None, "only include modules reachable from __run__.py and the clamped modules"),
+        ("include-modules=", None, "comma-separated globs of modules to keep when pruning, such as dynamic imports"),
+        ("conflicts=", None, "comma-separated GLOB=POLICY rules for duplicate entries, where POLICY is first, last, error or merge"),
+        ("daemon",     "d",  "run the build on the build daemon, if one is running"),
+        ("report=",    None, "write timings and sizes of the build as JSON to this path"),
+        ("reproducible", None, "write the same bytes for the same inputs, with fixed timestamps and sorted entries"),
+        ("layered",    None, "split the jar into runtime, deps and application layers, linked by Class-Path"),
+        ("nested",     None, "store dependency jars whole, loaded in place at startup, rather than copying their entries"),
+        ("startup-profile=", None, "write the entries listed in this startup profile first, in order"),
+        ("train-startup", None, "run the built jar once, recording the entries it reads at startup as the startup profile"),
+        ("train-args=", None, "arguments for the training run, which should start up and exit"),
     ]
+    boolean_options = ["incremental", "prune", "daemon", "reproducible", "layered", "nested", "train_startup"]
 
     def initialize_options(self):
         metadata = self.distribution.metadata
         self.output = os.path.join(os.getcwd(), "{}-{}-single.jar".format(metadata.get_name(), metadata.get_version()))
         self.classpath = []
         self.runpy = os.path.join(os.getcwd(), "__run__.py")
+        self.incremental = False
+        self.workers = 1
+        self.compression = None
+        self.precompile = None
+        self.prune = False
+        self.include_modules = None
+        self.conflicts = None
+        self.daemon = False
+        self.report = None
+        self.reproducible = False
+        self.layered = False
+        self.nested = False
+        self.startup_profile = None
+        self.train_startup = False
+        self.train_args = None
             
     def finalize_options(self):
         # could validate self.output is a valid path FIXME
         if self.classpath:
             self.classpath = self.classpath.split(":")
+        self.workers = parse_workers(self.workers)
+        # Validated here, but parsed by the build itself
+        parse_compression(self.compression)
+        parse_precompile(self.precompile)
+        parse_conflicts(self.conflicts)
+        if parse_list(self.include_modules) and not self.prune:
+            raise DistutilsOptionError("--include-modules only applies with --prune")
+        if self.layered and self.prune:
+            raise DistutilsOptionError("--prune cannot be combined with --layered, which keeps the runtime layer whole")
+        if self.layered and self.nested:
+            raise DistutilsOptionError("--nested cannot be combined with --layered")
+        if self.train_startup and not self.startup_profile:
+            raise DistutilsOptionError("--train-startup needs --startup-profile to write the profile to")
+        if self.train_args and not self.train_startup:
+            raise DistutilsOptionError("--train-args only applies with --train-startup")
 
     def run(self):
-        with honor_verbosity(self.distribution.verbose):
-            create_singlejar(self.output, self.classpath, self.runpy)
+        clamp_setup = getattr(self.distribution, "clamp", None)
+        run_build({
+            "command": "singlejar",
+            "output": os.path.abspath(self.output),
+            "classpath": [os.path.abspath(path) for path in self.classpath],
+            "runpy": os.path.abspath(self.runpy),
+            "incremental": bool(self.incremental),
+            "workers": self.workers,
+            "compression": self.compression,
+            "precompile": self.precompile,
+            "prune": bool(self.prune),
+            "modules": list(clamp_setup.modules) if clamp_setup else [],
+            "include_modules": self.include_modules,
+            "conflicts": self.conflicts,
+            "report": self.report and os.path.abspath(self.report),
+            "reproducible": bool(self.reproducible),
+            "layered": bool(self.layered),
+            "nested": bool(self.nested),
+            "startup_profile": self.startup_profile and os.path.abspath(self.startup_profile),
+            "train_startup": bool(self.train_startup),
+            "train_args": self.train_args,
+        }, self.daemon, self.distribution.verbose)
 
 
 def singlejar_script_command():
@@ -153,9 +385,78 @@ def singlejar_script_command():
                         help="jars to include in addition to Jython runtime and site-packages jars")
     parser.add_argument("--runpy", "-r", default=os.path.join(os.getcwd(), "__run__.py"), metavar="PATH",
                         help="path to __run__.py to make a runnable jar")
+    parser.add_argument("--incremental", "-i", action="store_true",
+                        help="only recopy inputs that changed since the previous build of the output jar")
+    parser.add_argument("--workers", "-j", default="1", metavar="N",
+                        help="number of threads compressing entries (0 for one per core)")
+    parser.add_argument("--compression", "-z", default=None, metavar="RULES",
+                        help="comma-separated GLOB=LEVEL rules, where LEVEL is store or 0-9")
+    parser.add_argument("--precompile", default=None, choices=PRECOMPILE_MODES,
+                        help="compile bundled modules to $py.class, added next to (add) or instead of (replace) sources")
+    parser.add_argument("--prune", action="store_true",
+                        help="only include modules reachable from __run__.py and --include-modules")
+    parser.add_argument("--include-modules", default=None, metavar="GLOBS",
+                        help="comma-separated globs of modules to keep when pruning, such as dynamic imports")
+    parser.add_argument("--conflicts", default=None, metavar="RULES",
+                        help="comma-separated GLOB=POLICY rules for duplicate entries, where POLICY is first, last, error or merge")
+    parser.add_argument("--daemon", "-d", action="store_true",
+                        help="run the build on the build daemon, if one is running")
+    parser.add_argument("--report", default=None, metavar="PATH",
+                        help="write timings and sizes of the build as JSON to this path")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="write the same bytes for the same inputs, with fixed timestamps and sorted entries")
+    parser.add_argument("--layered", action="store_true",
+                        help="split the jar into runtime, deps and application layers, linked by Class-Path")
+    parser.add_argument("--nested", action="store_true",
+                        help="store dependency jars whole, loaded in place at startup, rather than copying their entries")
+    parser.add_argument("--startup-profile", default=None, metavar="PATH",
+                        help="write the entries listed in this startup profile first, in order")
+    parser.add_argument("--train-startup", action="store_true",
+                        help="run the built jar once, recording the entries it reads at startup as the startup profile")
+    parser.add_argument("--train-args", default=None, metavar="ARGS",
+                        help="arguments for the training run, which should start up and exit")
     args = parser.parse_args()
     if args.classpath:
         args.classpath = args.classpath.split(":")
     else:
         args.classpath = []
-    create_singlejar(args.output, args.classpath, args.runpy)
+    try:
+        args.workers = parse_workers(args.workers)
+        parse_compression(args.compression)
+        parse_conflicts(args.conflicts)
+    except DistutilsOptionError, e:
+        parser.error(str(e))
+    if parse_list(args.include_modules) and not args.prune:
+        parser.error("--include-modules only applies with --prune")
+    if args.layered and args.prune:
+        parser.error("--prune cannot be combined with --layered, which keeps the runtime layer whole")
+    if args.layered and args.nested:
+        parser.error("--nested cannot be combined with --layered")
+    if args.train_startup and not args.startup_profile:
+        parser.error("--train-startup needs --startup-profile to write the profile to")
+    if args.train_args and not args.train_startup:
+        parser.error("--train-args only applies with --train-startup")
+    try:
+        run_build({
+            "command": "singlejar",
+            "output": os.path.abspath(args.output),
+            "classpath": [os.path.abspath(path) for path in args.classpath],
+            "runpy": os.path.abspath(args.runpy),
+            "incremental": args.incremental,
+            "workers": args.workers,
+            "compression": args.compression,
+            "precompile": args.precompile,
+            "prune": args.prune,
+            "modules": [],
+            "include_modules": args.include_modules,
+            "conflicts": args.conflicts,
+            "report": args.report and os.path.abspath(args.report),
+            "reproducible": args.reproducible,
+            "layered": args.layered,
+            "nested": args.nested,
+            "startup_profile": args.startup_profile and os.path.abspath(args.startup_profile),
+            "train_startup": args.train_startup,
+            "train_args": args.train_args,
+        }, args.daemon)
+    except DistutilsExecError, e:
+        sys.exit(str(e))
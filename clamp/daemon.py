@@ -0,0 +1,277 @@
+"""Build daemon, keeping a warm Jython JVM for build_jar and singlejar
+
+Each build otherwise pays for starting the JVM and Jython, importing
+setuptools and importing every clamped module, before any work is
+done. The daemon runs builds one at a time in a single long-lived
+interpreter, restoring sys.modules, sys.path and the working directory
+after each, so clamped modules are imported afresh by every build.
+Each build runs with the sys.path of its client in front, so projects
+that are not installed are imported from where the client would, and
+with the client's values of the environment variables read by builds.
+Builds only run for clients of the same Jython install - builds write jar.pth and
+the site cache into site-packages, so other clients build themselves.
+
+Jython does not support Unix domain sockets, so the daemon listens on
+the loopback interface instead; clients authenticate with a random
+token from a state file that only the user can read. Requests and
+responses are JSON, one object per line.
+"""
+
+import argparse
+import json
+import logging
+import os
+import os.path
+import socket
+import sys
+import traceback
+
+from contextlib import closing, contextmanager
+
+log = logging.getLogger(__name__)
+
+# Read by builds, so forwarded from the client: the timestamp of
+# reproducible jars, and the location of the cache
+BUILD_ENVIRONMENT = ("SOURCE_DATE_EPOCH", "CLAMP_CACHE_DIR")
+
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+def state_path():
+    """Path of the state file, which can be set with the CLAMP_DAEMON_STATE environment variable"""
+    return os.environ.get("CLAMP_DAEMON_STATE") or os.path.join(os.path.expanduser("~"), ".clamp", "daemon.json")
+
+
+def read_state(path=None):
+    try:
+        with open(path or state_path()) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def write_state(path, state):
+    dir_path = os.path.dirname(path)
+    if dir_path and not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)  # the token must stay private
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+
+
+def same_token(a, b):
+    """Compares tokens in constant time"""
+    if not isinstance(a, basestring) or len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+class StreamHandler(logging.Handler):
+    """Forwards log records to a client as they are emitted"""
+
+    def __init__(self, send):
+        logging.Handler.__init__(self)
+        self.send = send
+        self.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    def emit(self, record):
+        try:
+            self.send({"log": self.format(record)})
+        except Exception:
+            self.handleError(record)
+
+
+def same_prefix(a, b):
+    return os.path.normcase(os.path.realpath(a)) == os.path.normcase(os.path.realpath(b))
+
+
+def build_environment():
+    """Returns the variables of BUILD_ENVIRONMENT, None for those not set"""
+    return dict((name, os.environ.get(name)) for name in BUILD_ENVIRONMENT)
+
+
+def set_environment(environment):
+    for name, value in environment.iteritems():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+@contextmanager
+def isolated(cwd, verbose, client_path=(), environment=None):
+    """Runs a build in `cwd` with `client_path` in front of sys.path, then undoes its changes to the interpreter.
+
+    The variables of BUILD_ENVIRONMENT are set as in `environment`.
+    """
+    modules = set(sys.modules)
+    path = list(sys.path)
+    old_cwd = os.getcwd()
+    old_environment = build_environment()
+    clamp_log = logging.getLogger("clamp")
+    old_level = clamp_log.level
+    os.chdir(cwd)
+    sys.path[:] = list(client_path) + [entry for entry in path if entry not in client_path]
+    set_environment(dict((name, (environment or {}).get(name)) for name in BUILD_ENVIRONMENT))
+    if verbose > 1:
+        clamp_log.setLevel(logging.DEBUG)
+    try:
+        yield
+    finally:
+        clamp_log.setLevel(old_level)
+        set_environment(old_environment)
+        os.chdir(old_cwd)
+        sys.path[:] = path
+        for name in set(sys.modules) - modules:
+            del sys.modules[name]
+
+
+class BuildDaemon(object):
+
+    def __init__(self, path=None, port=0):
+        self.path = path or state_path()
+        self.port = port
+        self.token = os.urandom(16).encode("hex")
+        self.running = False
+
+    def __repr__(self):
+        return "BuildDaemon(state={!r})".format(self.path)
+
+    def serve_forever(self):
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as server:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(("127.0.0.1", self.port))
+            server.listen(5)
+            port = server.getsockname()[1]
+            write_state(self.path, {"port": port, "token": self.token, "pid": os.getpid()})
+            log.info("Build daemon listening on port %d", port)
+            self.running = True
+            try:
+                while self.running:
+                    conn, address = server.accept()
+                    with closing(conn):
+                        try:
+                            self.handle(conn)
+                        except Exception:
+                            # Such as a client that went away, which must not stop the daemon
+                            log.warn("Could not handle a request", exc_info=True)
+            finally:
+                state = read_state(self.path)
+                if state and state.get("token") == self.token:
+                    os.remove(self.path)
+
+    def handle(self, conn):
+        def send(message):
+            conn.sendall(json.dumps(message) + "\n")
+
+        with closing(conn.makefile("rb")) as f:
+            try:
+                request = json.loads(f.readline())
+            except ValueError:
+                request = None
+        if not isinstance(request, dict) or not isinstance(request.get("job") or {}, dict):
+            send({"status": "error", "error": "Malformed request"})
+            return
+        if not same_token(request.get("token"), self.token):
+            send({"status": "error", "error": "Invalid token"})
+            return
+        job = request.get("job") or {}
+        if job.get("command") == "ping":
+            send({"status": "ok"})
+            return
+        if job.get("command") == "stop":
+            self.running = False
+            send({"status": "ok"})
+            return
+
+        prefix = request.get("prefix")
+        if prefix is None or not same_prefix(prefix, sys.prefix):
+            send({"status": "unavailable",
+                  "error": "The build daemon runs from {}, not {}".format(sys.prefix, prefix)})
+            return
+
+        from clamp.commands import run_job  # imported late, as the commands import this module
+        handler = StreamHandler(send)
+        clamp_log = logging.getLogger("clamp")
+        clamp_log.addHandler(handler)
+        try:
+            with isolated(request.get("cwd") or os.getcwd(), request.get("verbose", 1), request.get("path") or (),
+                          request.get("environment")):
+                run_job(job)
+        except Exception:
+            log.debug("Build %r failed", job, exc_info=True)
+            send({"status": "error", "error": traceback.format_exc()})
+        else:
+            send({"status": "ok"})
+        finally:
+            clamp_log.removeHandler(handler)
+
+
+def connect(path=None):
+    state = read_state(path)
+    if state is None:
+        raise DaemonUnavailable("No build daemon is running")
+    try:
+        conn = socket.create_connection(("127.0.0.1", state["port"]))
+    except socket.error, e:
+        raise DaemonUnavailable("Cannot connect to the build daemon: {}".format(e))
+    return conn, state["token"]
+
+
+def submit(job, verbose=1, path=None):
+    """Runs `job` on the build daemon, printing its log.
+
+    Raises DaemonUnavailable if none is running, or if it runs from
+    another Jython install. Returns None if the build succeeded,
+    otherwise the error.
+    """
+    conn, token = connect(path)
+    with closing(conn):
+        try:
+            conn.sendall(json.dumps({
+                "token": token, "job": job, "cwd": os.getcwd(), "verbose": verbose,
+                "path": sys.path, "prefix": sys.prefix, "environment": build_environment(),
+            }) + "\n")
+            with closing(conn.makefile("rb")) as f:
+                for line in f:
+                    message = json.loads(line)
+                    if "log" in message:
+                        print >> sys.stderr, message["log"]
+                    elif message["status"] == "ok":
+                        return None
+                    elif message["status"] == "unavailable":
+                        raise DaemonUnavailable(message["error"])
+                    else:
+                        return message["error"]
+        except socket.error, e:
+            raise DaemonUnavailable("Lost the connection to the build daemon: {}".format(e))
+    raise DaemonUnavailable("The build daemon closed the connection")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="keep a warm Jython JVM to run build_jar and singlejar builds")
+    parser.add_argument("--state", default=None, metavar="PATH",
+                        help="state file with the port and token of the daemon (default {})".format(state_path()))
+    parser.add_argument("--port", default=0, type=int,
+                        help="loopback port to listen on (default any free port)")
+    parser.add_argument("--stop", action="store_true",
+                        help="stop the running daemon")
+    parser.add_argument("--status", action="store_true",
+                        help="exit with status 0 if the daemon is running")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.stop or args.status:
+        try:
+            submit({"command": "stop" if args.stop else "ping"}, path=args.state)
+        except DaemonUnavailable, e:
+            print >> sys.stderr, e
+            sys.exit(1)
+        return
+    BuildDaemon(args.state, args.port).serve_forever()
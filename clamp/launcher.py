@@ -0,0 +1,201 @@
+"""Class loading for singlejars with nested dependency jars
+
+With --nested, singlejar stores dependency jars intact and uncompressed
+under META-INF/lib/, instead of copying them entry by entry. A stored
+entry is just a byte range of the singlejar, so each nested jar is
+opened in place, without extracting it. At startup, the sitecustomize
+module written into the singlejar calls install(), which loads the
+classes and resources of the nested jars through a NestedJarLoader and
+registers their Java packages with Jython.
+"""
+
+import array
+import logging
+import struct
+import sys
+import threading
+import zipfile
+
+from java.io import ByteArrayInputStream, File, FileNotFoundException
+from java.lang import ClassLoader, ClassNotFoundException, Thread
+from java.net import URL, URLConnection, URLStreamHandler
+from java.util import Collections
+
+from clamp.packages import java_packages, register_packages
+
+log = logging.getLogger(__name__)
+
+NESTED_DIR = "META-INF/lib/"
+NESTED_LIST_NAME = "META-INF/clamp/nested.list"
+URL_PROTOCOL = "clamp-nested"
+SITECUSTOMIZE = "import clamp.launcher\nclamp.launcher.install()\n"
+
+_installed = []
+
+
+def data_offset(f, info):
+    """Returns the offset in `f` of the data of the zip entry `info`, following its local header"""
+    f.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, f.read(zipfile.sizeFileHeader))
+    return (info.header_offset + zipfile.sizeFileHeader +
+            header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+
+class EntryWindow(object):
+    """Read-only file over `size` bytes of `f` at `offset`, so zipfile can read a stored nested zip"""
+
+    def __init__(self, f, offset, size):
+        self.f = f
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def seek(self, position, whence=0):
+        if whence == 1:
+            position += self.position
+        elif whence == 2:
+            position += self.size
+        self.position = max(0, min(position, self.size))
+
+    def tell(self):
+        return self.position
+
+    def read(self, n=-1):
+        if n < 0 or n > self.size - self.position:
+            n = self.size - self.position
+        self.f.seek(self.offset + self.position)
+        data = self.f.read(n)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        pass
+
+
+class NestedJar(object):
+    """A jar stored as entry `info` of the singlejar open as `f`; reads are serialized by `lock`"""
+
+    def __init__(self, f, lock, info):
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError("Nested jar {} is compressed, so cannot be read in place".format(info.filename))
+        self.name = info.filename[len(NESTED_DIR):]
+        self.lock = lock
+        with lock:
+            self.archive = zipfile.ZipFile(EntryWindow(f, data_offset(f, info), info.file_size))
+
+    def __repr__(self):
+        return "NestedJar({!r})".format(self.name)
+
+    def __contains__(self, name):
+        return name in self.archive.NameToInfo
+
+    def read(self, name):
+        """Returns the contents of entry `name`, or None if this jar does not have it"""
+        if name not in self.archive.NameToInfo:
+            return None
+        with self.lock:
+            return self.archive.read(name)
+
+
+class NestedURLConnection(URLConnection):
+
+    def __init__(self, url, loader):
+        URLConnection.__init__(self, url)
+        self.loader = loader
+
+    def connect(self):
+        pass
+
+    def getInputStream(self):
+        jar_name, sep, name = self.getURL().getFile().partition("!/")
+        data = self.loader.read(jar_name, name)
+        if data is None:
+            raise FileNotFoundException(self.getURL().toString())
+        return ByteArrayInputStream(array.array("b", data))
+
+
+class NestedURLHandler(URLStreamHandler):
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def openConnection(self, url):
+        return NestedURLConnection(url, self.loader)
+
+
+class NestedJarLoader(ClassLoader):
+    """Loads classes and resources from nested jars, in order, after those of `parent`"""
+
+    def __init__(self, parent, jars):
+        ClassLoader.__init__(self, parent)
+        self.jars = list(jars)
+        self.handler = NestedURLHandler(self)
+
+    def __repr__(self):
+        return "NestedJarLoader({!r})".format(self.jars)
+
+    def read(self, jar_name, name):
+        for jar in self.jars:
+            if jar.name == jar_name:
+                return jar.read(name)
+        return None
+
+    def findClass(self, name):
+        path = name.replace(".", "/") + ".class"
+        for jar in self.jars:
+            data = jar.read(path)
+            if data is not None:
+                return self.defineClass(name, array.array("b", data), 0, len(data))
+        raise ClassNotFoundException(name)
+
+    def _url(self, jar, name):
+        return URL(URL_PROTOCOL, None, -1, "{}!/{}".format(jar.name, name), self.handler)
+
+    def findResource(self, name):
+        for jar in self.jars:
+            if name in jar:
+                return self._url(jar, name)
+        return None
+
+    def findResources(self, name):
+        return Collections.enumeration([self._url(jar, name) for jar in self.jars if name in jar])
+
+
+def open_nested_jars(path, names):
+    """Opens the jars `names` nested in the singlejar at `path`, sharing one file between them"""
+    f = open(path, "rb")
+    lock = threading.Lock()
+    with zipfile.ZipFile(path) as singlejar:
+        return [NestedJar(f, lock, singlejar.getinfo(NESTED_DIR + name)) for name in names]
+
+
+def install():
+    """Makes the nested jars of the running singlejar loadable, returning their loader.
+
+    The loader becomes Jython's class loader, and the context class
+    loader of the calling thread - and so of the threads it starts -
+    for libraries that look up classes or services through it.
+    """
+    if _installed:
+        return _installed[0]
+    url = ClassLoader.getSystemClassLoader().getResource(NESTED_LIST_NAME)
+    if url is None:
+        log.debug("No nested jars to load")
+        return None
+    connection = url.openConnection()
+    connection.setUseCaches(False)
+    path = File(connection.getJarFileURL().toURI()).getPath()
+    with zipfile.ZipFile(path) as singlejar:
+        names = singlejar.read(NESTED_LIST_NAME).splitlines()
+    jars = open_nested_jars(path, names)
+
+    thread = Thread.currentThread()
+    parent = sys.getClassLoader() or thread.getContextClassLoader() or ClassLoader.getSystemClassLoader()
+    loader = NestedJarLoader(parent, jars)
+    sys.setClassLoader(loader)
+    thread.setContextClassLoader(loader)
+    for jar in jars:
+        register_packages(java_packages(jar.archive.namelist()).iteritems(), "{}!/{}".format(path, jar.name))
+    _installed.append(loader)
+    log.debug("Installed %r", loader)
+    return loader
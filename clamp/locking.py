@@ -0,0 +1,42 @@
+"""Advisory file locks, for files shared by concurrent installs and builds
+
+Jython has no fcntl, so locks are taken through Java's FileChannel.
+Those are held on behalf of the whole JVM - a second lock of the same
+file in one JVM fails rather than waits - so threads, such as builds on
+the build daemon, also wait on a lock within the process.
+"""
+
+import logging
+import os
+import os.path
+import threading
+
+from contextlib import contextmanager
+from java.io import RandomAccessFile
+
+log = logging.getLogger(__name__)
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _thread_lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+@contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on the lock file at `path`, created if need be, waiting for other holders"""
+    path = os.path.abspath(path)
+    with _thread_lock(path):
+        lock_file = RandomAccessFile(path, "rw")
+        try:
+            log.debug("Waiting for lock on %s", path)
+            lock = lock_file.getChannel().lock()
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            lock_file.close()
@@ -0,0 +1,247 @@
+"""Precomputed indexes of the packages and classes in a jar
+
+Without META-INF/INDEX.LIST, finding a resource on a classpath of jars
+means opening each jar in turn; without a package cache, Jython's
+package manager scans every entry of every jar on startup - reading
+every class to check its access flags. Both indexes are instead
+written when a jar is built.
+
+The Jython listing is a sequence of (package, classes) records, as in
+the package cache files of CachedJarsPackageManager, where classes is
+a comma-separated list of the class names in the package.
+
+For installed jars, registered in jar.pth, the listings of all jars
+are merged into one site cache next to it, which jar.pth loads on
+startup through an import line. Jython scans a jar on sys.path when it
+first searches it; each jar registered from the site cache is put on
+sys.path already prepared for searching, so it is never scanned. The
+startup side is in clamp.sitecache, copied next to jar.pth.
+"""
+
+import array
+import logging
+import os
+import os.path
+import pkgutil
+import sys
+import tempfile
+import zipfile
+
+from collections import OrderedDict
+from java.io import ByteArrayInputStream, ByteArrayOutputStream, DataInputStream, DataOutputStream, EOFException, File
+from java.lang import ClassLoader
+from java.util.jar import JarFile
+
+from clamp.sitecache import SITE_CACHE_NAME, SITE_CACHE_VERSION, jar_stat, read_site_cache
+
+log = logging.getLogger(__name__)
+
+JAR_INDEX_NAME = "META-INF/INDEX.LIST"
+PACKAGES_NAME = "META-INF/clamp/packages.pkc"
+INDEX_NAMES = (JAR_INDEX_NAME, PACKAGES_NAME)
+SITE_LOADER_MODULE = "clamp_sitecache"
+# Imports only the loader copied next to jar.pth, which needs nothing else installed
+LOAD_SITE_CACHE = "import {0}; {0}.load_site_cache()".format(SITE_LOADER_MODULE)
+MAX_UTF = 65535  # longest string DataOutputStream.writeUTF can write
+
+
+def jar_index(jar_name, names):
+    """Returns the META-INF/INDEX.LIST for the jar `jar_name` with entries `names`"""
+    packages = set()
+    for name in names:
+        if name.startswith("META-INF/"):
+            continue
+        if name.endswith("/"):
+            name = name[:-1]
+        package, sep, filename = name.rpartition("/")
+        packages.add(package or filename)  # files in the root are listed by name
+    return "".join(["JarIndex-Version: 1.0\n\n", jar_name, "\n"] + [package + "\n" for package in sorted(packages)])
+
+
+def java_packages(names):
+    """Returns an ordered mapping of each Java package in `names` to its comma-separated classes"""
+    packages = {}
+    for name in names:
+        if not name.endswith(".class") or name.startswith("META-INF/"):
+            continue
+        package, sep, filename = name.rpartition("/")
+        classname = filename[:-len(".class")]
+        if not package or "$" in classname:
+            continue  # as in Jython, skip the default package and inner classes
+        packages.setdefault(package.replace("/", "."), []).append(classname)
+    return OrderedDict((package, ",".join(sorted(packages[package]))) for package in sorted(packages))
+
+
+def split_records(packages):
+    """Yields (package, classes) records from the mapping `packages`, splitting classes too long to write.
+
+    Registering the same package again adds to its classes, so a large
+    package can span several records.
+    """
+    for package, classes in packages.iteritems():
+        while len(classes.encode("utf-8")) > MAX_UTF:
+            split = classes.rindex(",", 0, MAX_UTF // 3)  # at most 3 bytes per char
+            yield package, classes[:split]
+            classes = classes[split + 1:]
+        yield package, classes
+
+
+def write_records(output, packages):
+    for package, classes in split_records(packages):
+        output.writeUTF(package)
+        output.writeUTF(classes)
+
+
+def write_packages(packages):
+    """Returns the Jython package listing for the mapping `packages`"""
+    data = ByteArrayOutputStream()
+    output = DataOutputStream(data)
+    write_records(output, packages)
+    output.close()
+    return data.toByteArray().tostring()
+
+
+def merge_records(records):
+    """Returns a mapping of package to classes from (package, classes) records"""
+    packages = OrderedDict()
+    for package, classes in records:
+        if package in packages:
+            classes = packages[package] + "," + classes
+        packages[package] = classes
+    return packages
+
+
+def read_packages(input_stream):
+    """Yields (package, classes) from a Jython package listing in the Java `input_stream`"""
+    input = DataInputStream(input_stream)
+    try:
+        while True:
+            try:
+                package = input.readUTF()
+            except EOFException:
+                return
+            yield package, input.readUTF()
+    finally:
+        input.close()
+
+
+def register_packages(packages, jar_path):
+    """Registers (package, classes) pairs from `jar_path` with Jython's package manager"""
+    count = 0
+    for package, classes in packages:
+        sys.packageManager.makeJavaPackage(package, classes, jar_path)
+        count += 1
+    log.debug("Registered %d packages from %s", count, jar_path)
+    return count
+
+
+def load_packages(jar_path):
+    """Registers the packages listed in the jar at `jar_path`; returns False if it has no listing"""
+    jar = JarFile(jar_path)
+    try:
+        entry = jar.getJarEntry(PACKAGES_NAME)
+        if entry is None:
+            return False
+        register_packages(read_packages(jar.getInputStream(entry)), jar_path)
+        return True
+    finally:
+        jar.close()
+
+
+def load_classpath_packages():
+    """Registers the packages listed in every jar on the classpath, such as a singlejar.
+
+    Call this at the start of __run__.py, and run with the classpath
+    excluded from Jython's own scan, such as with
+    -Dpython.packages.paths=sun.boot.class.path
+    """
+    urls = ClassLoader.getSystemClassLoader().getResources(PACKAGES_NAME)
+    while urls.hasMoreElements():
+        connection = urls.nextElement().openConnection()
+        connection.setUseCaches(False)
+        jar_path = File(connection.getJarFileURL().toURI()).getPath()
+        register_packages(read_packages(connection.getInputStream()), jar_path)
+
+
+def list_jar_packages(path):
+    """Returns the Java packages of the jar at `path`, from its own listing if it has one"""
+    with zipfile.ZipFile(path) as jar:
+        if PACKAGES_NAME in jar.NameToInfo:
+            data = jar.read(PACKAGES_NAME)
+            return merge_records(read_packages(ByteArrayInputStream(array.array("b", data))))
+        return java_packages(jar.namelist())
+
+
+def site_cache_path(site_dir):
+    return os.path.join(site_dir, SITE_CACHE_NAME)
+
+
+def write_site_file(path, data):
+    # Replaced atomically, since it is read by every interpreter that starts
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+        f.write(data)
+    os.chmod(f.name, 0o644)  # readable by every interpreter, unlike a temporary file
+    os.rename(f.name, path)
+
+
+def install_site_loader(site_dir):
+    """Copies clamp.sitecache into `site_dir` as the loader jar.pth imports, unless it is up to date"""
+    path = os.path.join(site_dir, SITE_LOADER_MODULE + ".py")
+    source = pkgutil.get_data("clamp", "sitecache.py")  # also within a zipped egg
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == source:
+                return
+    write_site_file(path, source)
+    log.debug("Installed site cache loader %s", path)
+
+
+def write_site_cache(path, jars):
+    """Writes (jar path, size, mtime, packages) for each of `jars` to the site cache at `path`"""
+    data = ByteArrayOutputStream()
+    output = DataOutputStream(data)
+    output.writeInt(SITE_CACHE_VERSION)
+    for jar_path, size, mtime, packages in jars:
+        records = list(split_records(packages))
+        output.writeUTF(jar_path)
+        output.writeLong(size)
+        output.writeLong(mtime)
+        output.writeInt(len(records))
+        for package, classes in records:
+            output.writeUTF(package)
+            output.writeUTF(classes)
+    output.close()
+    write_site_file(path, data.toByteArray().tostring())
+
+
+def update_site_cache(site_dir, jar_paths):
+    """Updates the site cache in `site_dir` for `jar_paths`, relative to it as in jar.pth.
+
+    Jars with the same size and mtime as when last cached are not
+    opened again.
+    """
+    path = site_cache_path(site_dir)
+    cached = dict((jar_path, (size, mtime, merge_records(records)))
+                  for jar_path, size, mtime, records in read_site_cache(path))
+    jars = []
+    for jar_path in sorted(jar_paths):
+        full_path = os.path.join(site_dir, jar_path)
+        if os.path.isdir(full_path):
+            continue  # class directories are not scanned on startup, so need no cache
+        try:
+            size, mtime = jar_stat(full_path)
+        except OSError:
+            log.debug("Not caching packages of missing jar %s", full_path)
+            continue
+        previous = cached.get(jar_path)
+        if previous is not None and previous[:2] == (size, mtime):
+            packages = previous[2]
+        else:
+            try:
+                packages = list_jar_packages(full_path)
+            except (IOError, zipfile.BadZipfile):
+                log.warn("Cannot list packages of %s", full_path, exc_info=True)
+                continue
+        jars.append((jar_path, size, mtime, packages))
+    write_site_cache(path, jars)
+    log.debug("Cached packages of %d jars in %s", len(jars), path)
@@ -0,0 +1,108 @@
+"""Thread pools for the build
+
+Jython has no GIL, so CPU-bound work such as compression scales with
+the number of threads.
+"""
+
+import collections
+import logging
+import sys
+import threading
+import Queue
+
+from java.lang import Runtime
+
+log = logging.getLogger(__name__)
+
+
+def default_workers():
+    return Runtime.getRuntime().availableProcessors()
+
+
+class _Result(object):
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._exc_info = None
+
+    def set(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, exc_info):
+        self._exc_info = exc_info
+        self._done.set()
+
+    def get(self):
+        self._done.wait()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+def _call(result, func, args):
+    try:
+        result.set(func(*args))
+    except Exception:
+        result.fail(sys.exc_info())
+
+
+class WorkerPool(object):
+    """Calls functions on `workers` threads, or on the calling thread if there is only one"""
+
+    def __init__(self, workers):
+        self.tasks = Queue.Queue()
+        self.threads = []
+        if workers > 1:
+            self.threads = [threading.Thread(target=self._work, name="clamp-worker-{}".format(i))
+                            for i in xrange(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            _call(*task)
+
+    def submit(self, func, *args):
+        """Calls func(*args), returning a result whose get() waits for its value"""
+        result = _Result()
+        if self.threads:
+            self.tasks.put((result, func, args))
+        else:
+            _call(result, func, args)
+        return result
+
+    def close(self):
+        for thread in self.threads:
+            self.tasks.put(None)
+        self.threads = []
+
+
+def imap_ordered(func, iterable, workers, window=None):
+    """Like itertools.imap, but calls `func` on `workers` threads.
+
+    Results are yielded in the order of `iterable`, so output built from
+    them is deterministic; at most `window` results are pending at once.
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+    if window is None:
+        window = workers * 4
+    pool = WorkerPool(workers)
+    pending = collections.deque()
+    try:
+        for item in iterable:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
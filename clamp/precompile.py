@@ -0,0 +1,83 @@
+"""Ahead-of-time compilation of Python modules to $py.class
+
+Jython compiles a module to Java bytecode on first import, and caches
+the result next to the source - which is not possible for modules
+imported from a read-only jar. Compiling while the jar is built saves
+this work on every cold start.
+"""
+
+import array
+import logging
+import os
+import sys
+
+from java.io import ByteArrayInputStream
+from org.python.core import imp as jython_imp
+
+from clamp.archive import to_date_time, to_millis
+from clamp.cache import ContentCache, make_key
+
+log = logging.getLogger(__name__)
+
+MODES = ("add", "replace")
+COMPILED_SUFFIX = "$py.class"
+
+
+def compiled_name(relpath):
+    """Returns the name of the $py.class compiled from the source at `relpath`"""
+    return relpath[:-len(".py")] + COMPILED_SUFFIX
+
+
+def module_name(relpath):
+    """Returns the name of the module at `relpath` in a singlejar, or None if it is not importable from Lib"""
+    parts = relpath.replace(os.sep, "/").split("/")
+    if len(parts) < 2 or parts[0] != "Lib" or not parts[-1].endswith(".py"):
+        return None
+    parts[-1] = parts[-1][:-len(".py")]
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts[1:])
+
+
+class Precompiler(object):
+    """Compiles modules to $py.class, caching the output by a hash of the source"""
+
+    def __init__(self, mode="add", cache=None):
+        if mode not in MODES:
+            raise ValueError("Precompile mode must be one of {}, not {!r}".format(", ".join(MODES), mode))
+        self.mode = mode
+        self.cache = cache or ContentCache("pyclass")
+
+    def __repr__(self):
+        return "Precompiler(mode={!r}, cache={!r})".format(self.mode, self.cache)
+
+    def compiles(self, relpath):
+        return module_name(relpath) is not None
+
+    @property
+    def keep_source(self):
+        return self.mode == "add"
+
+    def compile(self, relpath, source, millis):
+        """Returns the bytes of the $py.class for the `source` at `relpath`, or None.
+
+        `millis` is the timestamp of the source entry; Jython only uses
+        a $py.class next to its source if the compiled mtime matches.
+        """
+        name = module_name(relpath)
+        if name is None:
+            return None
+        filename = relpath.replace(os.sep, "/")
+        mtime = to_millis(to_date_time(millis))  # as read back from the jar
+        key = make_key(sys.version, name, filename, mtime, source)
+        compiled = self.cache.get(key)
+        if compiled is None:
+            try:
+                compiled = jython_imp.compileSource(
+                    name, ByteArrayInputStream(array.array("b", source)), filename, mtime).tostring()
+            except Exception:
+                # Such as the deliberately broken modules in the stdlib tests
+                log.debug("Not precompiling %s", relpath, exc_info=True)
+                return None
+            self.cache.put(key, compiled)
+        return compiled
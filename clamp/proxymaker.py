@@ -1,15 +1,21 @@
+import array
 import inspect
 import logging
 import re
+import sys
 
 import java
-from java.io import Serializable
+from java.io import ByteArrayOutputStream, Serializable
 from java.lang.reflect import Modifier
-from org.python.core import Py
+from java.util import ArrayList
+from org.python.core import BytecodeLoader, Py
 from org.python.compiler import CustomMaker, ProxyCodeHelpers
 from org.python.util import CodegenUtils
 
+from clamp import __version__
 from clamp.build import get_builder
+from clamp.cache import make_key
+from clamp.report import NullReport
 from clamp.signature import Constant
 
 _MATCH_PRIVATE_NAME = re.compile('^_(?P<class>\w+)__(?P<attribute>\w+)$')
@@ -39,6 +45,13 @@ class SerializableProxyMaker(CustomMaker):
         self.mapping = mapping
         self.package = package
         self.kwargs = kwargs
+        self.names = (className, pythonModuleName, fullProxyName)
+        self.builder = get_builder()  # of the build importing this class, whichever thread later saves it
+        self.cache = None
+        self.cache_key = None
+        self.cache_hit = False
+        self.class_size = None
+        self._clamped_methods = None
 
         log.debug("superclass=%s, interfaces=%s, className=%s, pythonModuleName=%s, fullProxyName=%s, mapping=%s, "
                   "package=%s, kwargs=%s", superclass, interfaces, className, pythonModuleName, fullProxyName, mapping,
@@ -52,6 +65,7 @@ class SerializableProxyMaker(CustomMaker):
         for cls in inheritance:
             if issubclass(cls, Serializable):
                 is_serializable = True
+        self.referents = ([superclass] if superclass else []) + list(interfaces)
 
         if is_serializable:
             self.constants = { "serialVersionUID" : (java.lang.Long(1), java.lang.Long.TYPE) }
@@ -85,10 +99,57 @@ class SerializableProxyMaker(CustomMaker):
         code.return_()
 
     def saveBytes(self, bytes):
-        get_builder().write_class_bytes(self.package, self.myClass, bytes)
+        self.class_size = bytes.size()
+        if self.cache_key is not None and not self.cache_hit:
+            self.cache.put(self.cache_key, bytes.toByteArray().tostring())
+        self.builder.write_class_bytes(self.package, self.myClass, bytes)
+
+    def fingerprint(self):
+        """Returns a key for everything that determines the bytes of this proxy class.
+
+        That is its Java-facing shape - names, the members of its
+        superclass and interfaces, clamped methods, annotations and
+        constants - along with the versions of clamp and Jython.
+        """
+        parts = [__version__, sys.version, self.package]
+        parts.extend(self.names)
+        for cls in self.referents:
+            parts.extend(class_shape(cls))
+        # Python methods without type information are still proxied by name
+        parts.extend(sorted(name for name, value in self.mapping.iteritems() if inspect.isfunction(value)))
+        class_info = self.mapping.get('_clamp')
+        if class_info is not None:
+            parts.extend(annotation_key(annotation) for annotation in class_info.annotations)
+        for name, method_info, access, arg_annotations in self.clampedMethods():
+            parts.extend([name, method_info.name, type_name(method_info.return_type), access])
+            parts.extend(type_name(arg_type) for arg_type in method_info.arg_types)
+            parts.extend(type_name(exception_type) for exception_type in method_info.exception_types)
+            parts.extend(annotation_key(annotation) for annotation in method_info.annotations)
+            for annotations in arg_annotations:
+                parts.append(len(annotations))
+                parts.extend(annotation_key(annotation) for annotation in annotations)
+        for constant, (value, constant_type) in sorted(self.constants.iteritems()):
+            parts.extend([constant, repr(value), type_name(constant_type)])
+        return make_key(*parts)
+
+    def makeCachedClass(self, builder):
+        """Returns the proxy class from the builder's proxy cache, or None if it is not cached"""
+        self.cache = getattr(builder, "proxy_cache", None)
+        if self.cache is None:
+            return None
+        self.cache_key = self.fingerprint()
+        data = self.cache.get(self.cache_key)
+        if data is None:
+            return None
+        log.debug("Using cached proxy: %r", self.myClass)
+        self.cache_hit = True
+        bytes = ByteArrayOutputStream()
+        bytes.write(array.array("b", data))
+        self.saveBytes(bytes)
+        return BytecodeLoader.makeClass(self.myClass, ArrayList(self.referents), bytes.toByteArray())
 
     def makeClass(self):
-        builder = get_builder()
+        builder = self.builder
         log.debug("Entering makeClass for %r", self)
         try:
             import sys
@@ -101,9 +162,14 @@ class SerializableProxyMaker(CustomMaker):
                 raise TypeError("No proxy class")
         except:
             if builder:
-                log.debug("Calling super... for %r", self.package)
-                cls = CustomMaker.makeClass(self)
-                log.info("Built proxy: %r", self.myClass)
+                with getattr(builder, "report", NullReport).timer("classes", name=self.myClass) as record:
+                    cls = self.makeCachedClass(builder)
+                    if cls is None:
+                        log.debug("Calling super... for %r", self.package)
+                        cls = CustomMaker.makeClass(self)
+                        log.info("Built proxy: %r", self.myClass)
+                    record["bytes"] = self.class_size
+                    record["cached"] = self.cache_hit
             else:
                 raise TypeError("Cannot clamp proxy class {} without a defined builder".format(self.myClass))
         return cls
@@ -127,7 +193,15 @@ class SerializableProxyMaker(CustomMaker):
         self.super__visitMethods()
 
         # Add methods with type information.
-        for name, method in self.mapping.iteritems():
+        for name, method_info, access, arg_annotations in self.clampedMethods():
+            self.addMethod(method_info.name, name, method_info.return_type, method_info.arg_types, method_info.exception_types, access, None, method_info.annotations, arg_annotations)
+
+    def clampedMethods(self):
+        """Returns (name, method info, access, argument annotations) for each method with type information"""
+        if self._clamped_methods is not None:
+            return self._clamped_methods
+        self._clamped_methods = clamped_methods = []
+        for name, method in sorted(self.mapping.iteritems()):
             if isinstance(method, (classmethod, staticmethod)):
                 log.warning("method:{!r} is not yet supported.".format(method))
                 continue
@@ -188,7 +262,8 @@ class SerializableProxyMaker(CustomMaker):
             # class.
             access |= Modifier.ABSTRACT
 
-            self.addMethod(method_info.name, name, method_info.return_type, method_info.arg_types, method_info.exception_types, access, None, method_info.annotations, arg_annotations)
+            clamped_methods.append((name, method_info, access, arg_annotations))
+        return clamped_methods
 
 
 class ClampProxyMaker(object):
@@ -207,6 +282,31 @@ class ClampProxyMaker(object):
             self.package, self.kwargs)
 
 
+def type_name(java_type):
+    if isinstance(java_type, java.lang.Class):
+        return java_type.getName()
+    return repr(java_type)
+
+
+def class_shape(cls):
+    """Returns the name and members of the Java class `cls`, as proxies of it depend on them"""
+    shape = [type_name(cls)]
+    shape.extend(sorted(str(method) for method in cls.getMethods()))
+    shape.extend(sorted(str(constructor) for constructor in cls.getDeclaredConstructors()))
+    # Proxies may also override protected methods
+    while cls is not None:
+        shape.extend(sorted(str(method) for method in cls.getDeclaredMethods() if Modifier.isProtected(method.getModifiers())))
+        cls = cls.getSuperclass()
+    return shape
+
+
+def annotation_key(annotation):
+    """Returns a key for an AnnotationDescr, with its fields in a deterministic order"""
+    fields = dict(annotation.fields or {})
+    return "{}({})".format(type_name(annotation.annotation),
+                           ", ".join("{}={!r}".format(name, value) for name, value in sorted(fields.iteritems())))
+
+
 def access_from_name(name):
     """
     Derive the method or field access from its name.
@@ -0,0 +1,200 @@
+"""Pruning of a singlejar to the modules its application can import
+
+Starting from root modules - those in `__run__.py`, the clamp `modules`
+and an allow-list for dynamic imports - the import statements of each
+reachable module are found with the ast module, then followed. Modules
+that are never reached, and the data files in their packages, are left
+out of the jar.
+"""
+
+import ast
+import fnmatch
+import logging
+import os
+import zipfile
+
+from clamp.precompile import COMPILED_SUFFIX
+
+log = logging.getLogger(__name__)
+
+# Imported by Jython itself at startup, or by name at runtime, so never
+# visible as import statements
+DEFAULT_INCLUDES = (
+    "site", "sitecustomize", "warnings", "traceback", "linecache", "codecs", "encodings", "encodings.*",
+)
+
+
+def split_entry(relpath):
+    """Returns the parts of `relpath` under Lib/, or None if it is outside of Lib/"""
+    parts = relpath.replace(os.sep, "/").split("/")
+    if len(parts) < 2 or parts[0] != "Lib":
+        return None
+    if not parts[-1]:
+        parts.pop()  # directory entry
+    return parts[1:]
+
+
+def module_for(parts):
+    """Returns (module name, is package) for a Python file under Lib/, or None"""
+    filename = parts[-1]
+    for suffix in (".py", COMPILED_SUFFIX):
+        if filename.endswith(suffix):
+            name = filename[:-len(suffix)]
+            if name == "__init__":
+                return ".".join(parts[:-1]), True
+            return ".".join(parts[:-1] + [name]), False
+    return None
+
+
+def find_imports(source, filename):
+    """Yields (names, level) for each module that `source` may import.
+
+    `names` lists the candidate absolute names, such as both pkg.mod
+    and pkg.mod.name for `from pkg.mod import name`; `level` is that
+    of relative imports.
+    """
+    try:
+        tree = ast.parse(source, filename)
+    except (SyntaxError, TypeError, ValueError):
+        log.debug("Cannot parse %s for imports", filename, exc_info=True)
+        return
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield [alias.name], 0
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            names = [base] if base else []
+            for alias in node.names:
+                if alias.name != "*":
+                    names.append(".".join(filter(None, [base, alias.name])))
+            yield names, node.level or 0
+        elif isinstance(node, ast.Call) and node.args and isinstance(node.args[0], ast.Str):
+            # __import__("name") and importlib.import_module("name")
+            func = node.func
+            func_name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+            if func_name in ("__import__", "import_module"):
+                yield [node.args[0].s], 0
+
+
+class Pruner(object):
+
+    def __init__(self, modules=(), includes=()):
+        self.roots = list(modules)
+        self.includes_patterns = list(DEFAULT_INCLUDES) + list(includes)
+        self.modules = {}  # name -> function returning its source, or None for compiled-only modules
+        self.packages = set()
+        self.scripts = []
+        self.reachable = None
+
+    def __repr__(self):
+        return "Pruner(roots={!r}, includes={!r})".format(self.roots, self.includes_patterns)
+
+    def _add(self, relpath, read):
+        parts = split_entry(relpath)
+        if not parts:
+            return
+        module = module_for(parts)
+        if module is None:
+            return
+        name, is_package = module
+        if is_package:
+            self.packages.add(name)
+        if relpath.endswith(".py") or name not in self.modules:
+            # First source wins, as when copying
+            if self.modules.get(name) is None:
+                self.modules[name] = read if relpath.endswith(".py") else None
+
+    def add_file(self, relpath, path):
+        def read():
+            with open(path, "rb") as f:
+                return f.read()
+        self._add(relpath, read)
+
+    def add_files(self, files):
+        for relpath, path in files:
+            self.add_file(relpath, path)
+
+    def add_archive(self, path, parent=None):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                names = archive.namelist()
+        except (IOError, zipfile.BadZipfile):
+            return
+
+        def reader(name):
+            def read():
+                with zipfile.ZipFile(path) as archive:
+                    return archive.read(name)
+            return read
+
+        for name in names:
+            self._add("/".join(filter(None, [parent, name])), reader(name))
+
+    def add_script(self, path):
+        """Adds a script such as __run__.py as a root"""
+        self.scripts.append(path)
+
+    def _resolve_import(self, importer, is_package, names, level):
+        if level:
+            base = importer.split(".") if is_package else importer.split(".")[:-1]
+            if level > 1:
+                base = base[:-(level - 1)]
+            candidates = [".".join(base + [name]) if name else ".".join(base) for name in names or [""]]
+        else:
+            candidates = list(names)
+            if importer:
+                # Implicit relative imports, as in Python 2
+                package = importer if is_package else importer.rpartition(".")[0]
+                if package:
+                    candidates.extend(package + "." + name for name in names)
+        for candidate in candidates:
+            parts = candidate.split(".")
+            for i in xrange(1, len(parts) + 1):  # importing a.b.c also imports a and a.b
+                name = ".".join(parts[:i])
+                if name in self.modules:
+                    yield name
+
+    def resolve(self):
+        """Computes the modules reachable from the roots"""
+        pending = []
+        for pattern in self.roots + self.includes_patterns:
+            pending.extend(name for name in self.modules if fnmatch.fnmatchcase(name, pattern))
+        for path in self.scripts:
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    source = f.read()
+                for names, level in find_imports(source, path):
+                    pending.extend(self._resolve_import("", False, names, level))
+        reachable = set()
+        while pending:
+            name = pending.pop()
+            if name in reachable or name not in self.modules:
+                continue
+            reachable.add(name)
+            if "." in name:
+                pending.append(name.rpartition(".")[0])
+            read = self.modules[name]
+            if read is None:
+                continue
+            is_package = name in self.packages
+            for names, level in find_imports(read(), name):
+                pending.extend(self._resolve_import(name, is_package, names, level))
+        log.debug("Pruned to %d of %d modules", len(reachable), len(self.modules))
+        self.reachable = reachable
+
+    def includes(self, relpath):
+        """Returns True if the entry at `relpath` should be in the jar"""
+        parts = split_entry(relpath)
+        if not parts:
+            return True
+        module = module_for(parts)
+        if module is not None:
+            return module[0] in self.reachable
+        # Data files and directories belong to their innermost package;
+        # anything outside of a package is kept
+        for i in xrange(len(parts), 0, -1):
+            package = ".".join(parts[:i])
+            if package in self.packages:
+                return package in self.reachable
+        return True
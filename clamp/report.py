@@ -0,0 +1,128 @@
+"""Timings and sizes of a build, written as JSON with --report
+
+A report has a list of records for each section:
+
+- modules: import time of each clamped module
+- classes: generation time and size of each proxy class, and whether
+  its bytes came from the proxy cache
+- jars: copy time and size of each input jar of a singlejar
+- phases: time of each phase of a singlejar build, such as walking
+  the files of the standard library, then copying them
+- layers: entries and size of each layer of a layered singlejar
+
+along with the totals of the output, for tracking regressions of
+builds over time.
+"""
+
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+import zipfile
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+
+class NullReport(object):
+
+    def __repr__(self):
+        return "NullReport"
+
+    @contextmanager
+    def timer(self, section, **fields):
+        yield fields
+
+    def add(self, section, **fields):
+        pass
+
+    def measure_output(self, output_path, layer=None):
+        pass
+
+
+NullReport = NullReport()
+
+
+class BuildReport(object):
+    """Records of a build, which may be added from any thread"""
+
+    def __init__(self, command):
+        self.command = command
+        self.started = time.time()
+        self.sections = OrderedDict((section, []) for section in ("modules", "classes", "jars", "phases", "layers"))
+        self.totals = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "BuildReport(command={!r})".format(self.command)
+
+    def add(self, section, **fields):
+        with self.lock:
+            self.sections.setdefault(section, []).append(fields)
+
+    @contextmanager
+    def timer(self, section, **fields):
+        """Times the enclosed block, adding a record of `fields` to `section`.
+
+        The record is yielded, so fields known only at the end of the
+        block, such as sizes, can be added to it.
+        """
+        started = time.time()
+        try:
+            yield fields
+        finally:
+            fields["seconds"] = round(time.time() - started, 6)
+            self.add(section, **fields)
+
+    def measure_output(self, output_path, layer=None):
+        """Records the number of entries and total bytes of the jar or class directory at `output_path`.
+
+        These are the totals of the report, or with `layer`, a record of
+        the layers section.
+        """
+        entries = uncompressed = compressed = 0
+        if os.path.isdir(output_path):
+            for dirpath, dirs, files in os.walk(output_path):
+                for filename in files:
+                    entries += 1
+                    uncompressed += os.path.getsize(os.path.join(dirpath, filename))
+            compressed = uncompressed
+        else:
+            with zipfile.ZipFile(output_path) as jar:
+                for info in jar.infolist():
+                    entries += 1
+                    uncompressed += info.file_size
+                    compressed += info.compress_size
+        totals = OrderedDict([
+            ("output", output_path),
+            ("entries", entries),
+            ("uncompressed_bytes", uncompressed),
+            ("compressed_bytes", compressed),
+        ])
+        if layer is None:
+            self.totals = totals
+        else:
+            self.add("layers", name=layer, **totals)
+
+    def as_dict(self):
+        report = OrderedDict([
+            ("version", REPORT_VERSION),
+            ("command", self.command),
+            ("seconds", round(time.time() - self.started, 6)),
+            ("totals", self.totals),
+        ])
+        with self.lock:
+            report.update((section, list(records)) for section, records in self.sections.iteritems())
+        return report
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2, separators=(",", ": "))
+            f.write("\n")
+        log.info("Wrote build report to %s", path)
@@ -0,0 +1,111 @@
+"""Loads the site cache of jar.pth on startup
+
+jar.pth imports this module on every startup, as a copy next to it,
+clamp_sitecache.py, so it imports nothing from clamp - only what
+Jython has loaded already - and keeps working once clamp is
+uninstalled. Errors are not logged, since logging is not set up yet;
+jars that cannot be registered are left to Jython to scan as usual.
+"""
+
+import os
+import os.path
+import sys
+
+from java.io import BufferedInputStream, DataInputStream, EOFException, FileInputStream, IOException
+from org.python.core import PySystemState, SyspathArchive
+from org.python.core.packagecache import PackageManager
+
+SITE_CACHE_NAME = "jar-packages.cache"
+SITE_CACHE_VERSION = 1
+
+
+def jar_stat(path):
+    st = os.stat(path)
+    return st.st_size, int(st.st_mtime * 1000)
+
+
+def read_site_cache(path):
+    """Yields (jar path, size, mtime, records) for each jar in the site cache at `path`.
+
+    Records are (package, classes) pairs; a package can span several.
+    Stops at the first error, such as a cache from another version.
+    """
+    if not os.path.exists(path):
+        return
+    input = DataInputStream(BufferedInputStream(FileInputStream(path)))
+    try:
+        if input.readInt() != SITE_CACHE_VERSION:
+            return
+        while True:
+            try:
+                jar_path = input.readUTF()
+            except EOFException:
+                return
+            size = input.readLong()
+            mtime = input.readLong()
+            records = [(input.readUTF(), input.readUTF()) for i in xrange(input.readInt())]
+            yield jar_path, size, mtime, records
+    except IOException:
+        return
+    finally:
+        input.close()
+
+
+class SkipJars(PackageManager):
+    """Stands in for Jython's package manager while jars are wrapped for sys.path, so they are not scanned"""
+
+    def addJar(self, jarfile, cache):
+        pass
+
+
+def skip_jar_scans(jar_paths):
+    """Wraps the `jar_paths` on sys.path for searching, as Jython does, but without scanning them.
+
+    Jython wraps a jar on sys.path in a SyspathArchive when it first
+    searches it, which adds the jar to the package manager - reading
+    its cached listing, or every entry. Wrapped beforehand with that
+    step skipped, a jar is searched for classes as usual. Returns the
+    number of jars wrapped.
+    """
+    skipped = set(os.path.normcase(os.path.abspath(path)) for path in jar_paths)
+    count = 0
+    manager = PySystemState.packageManager
+    PySystemState.packageManager = SkipJars()
+    try:
+        for i, entry in enumerate(sys.path):
+            if isinstance(entry, SyspathArchive) or not isinstance(entry, basestring):
+                continue
+            if os.path.normcase(os.path.abspath(entry)) in skipped:
+                try:
+                    sys.path[i] = SyspathArchive(entry)
+                except IOException:
+                    continue  # left to Jython
+                count += 1
+    finally:
+        PySystemState.packageManager = manager
+    return count
+
+
+def load_site_cache(site_dir=None):
+    """Registers the packages of the jars in jar.pth from the site cache, skipping jars changed since.
+
+    `site_dir` defaults to the directory of this module, as copied next
+    to jar.pth. The jars registered are not scanned again by Jython;
+    those changed since they were cached are. Returns the number of
+    jars registered.
+    """
+    if site_dir is None:
+        site_dir = os.path.dirname(os.path.abspath(__file__))
+    registered = []
+    for jar_path, size, mtime, records in read_site_cache(os.path.join(site_dir, SITE_CACHE_NAME)):
+        full_path = os.path.normpath(os.path.join(site_dir, jar_path))
+        try:
+            if jar_stat(full_path) != (size, mtime):
+                continue
+        except OSError:
+            continue
+        for package, classes in records:
+            sys.packageManager.makeJavaPackage(package, classes, full_path)
+        registered.append(full_path)
+    skip_jar_scans(registered)
+    return len(registered)
@@ -0,0 +1,152 @@
+"""Startup-ordered entry layout for singlejars
+
+At startup, the JVM and Jython read a predictable set of classes and
+modules from a singlejar, scattered among the other entries in the
+order of their inputs. Training runs the singlejar once with class
+loading traced - Jython modules are loaded as classes named after the
+module, with a $py suffix - and records the entries read, in order, as
+a startup profile. Building with the profile then writes those entries
+first and contiguously, for read locality on slow volumes.
+"""
+
+import logging
+import os
+import os.path
+import re
+import subprocess
+import zipfile
+
+from java.lang import System
+
+from clamp.archive import MANIFEST_NAME, ArchiveWriter
+from clamp.launcher import NESTED_DIR, NESTED_LIST_NAME, open_nested_jars
+from clamp.precompile import COMPILED_SUFFIX
+
+log = logging.getLogger(__name__)
+
+PROFILE_HEADER = "# clamp startup profile: entries read at startup, in order\n"
+# -verbose:class output, before Java 9 and with unified logging since
+LOADED_CLASS_PATTERNS = [
+    re.compile(r"^\[Loaded (\S+) from "),
+    re.compile(r"\[class,load\s*\] (\S+) source: "),
+]
+RUN_MODULES = ("__run__", "__main__")
+
+
+def read_profile(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def write_profile(path, names):
+    with open(path, "w") as f:
+        f.write(PROFILE_HEADER)
+        f.write("".join(name + "\n" for name in names))
+    log.info("Wrote startup profile of %d entries to %s", len(names), path)
+
+
+def loaded_classes(lines):
+    """Yields the names of the classes in -verbose:class output `lines`, in load order"""
+    for line in lines:
+        for pattern in LOADED_CLASS_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                yield match.group(1)
+                break
+
+
+def class_entries(class_name):
+    """Returns the entries that may provide `class_name`, a Java class or a Jython module"""
+    if not class_name.endswith("$py"):
+        return [class_name.replace(".", "/") + ".class"]
+    module = class_name[:-len("$py")]
+    if module in RUN_MODULES:
+        return ["__run__.py"]
+    path = "Lib/" + module.replace(".", "/")
+    return [path + COMPILED_SUFFIX, path + ".py", path + "/__init__" + COMPILED_SUFFIX, path + "/__init__.py"]
+
+
+def jar_entries(path):
+    """Returns the entry names of the jar at `path`, and a mapping of the entries of its nested jars to theirs"""
+    with zipfile.ZipFile(path) as jar:
+        names = set(jar.namelist())
+        nested_names = jar.read(NESTED_LIST_NAME).splitlines() if NESTED_LIST_NAME in names else []
+    nested = {}
+    for nested_jar in open_nested_jars(path, nested_names) if nested_names else []:
+        for name in nested_jar.archive.namelist():
+            nested.setdefault(name, NESTED_DIR + nested_jar.name)
+    return names, nested
+
+
+def startup_entries(classes, jars):
+    """Returns the entries of `jars` providing `classes`, in order; a nested jar is listed for its first class"""
+    provided = [jar_entries(path) for path in jars]
+    seen = set()
+    entries = []
+    for class_name in classes:
+        for candidate in class_entries(class_name):
+            found = None
+            for names, nested in provided:
+                if candidate in names:
+                    found = candidate
+                elif candidate in nested:
+                    found = nested[candidate]
+                if found:
+                    break
+            if found:
+                if found not in seen:
+                    seen.add(found)
+                    entries.append(found)
+                break
+    return entries
+
+
+def java_executable():
+    return os.path.join(System.getProperty("java.home"), "bin", "java")
+
+
+def train_startup(command_jar, profile_path, jars=None, args=(), java_options=()):
+    """Runs the singlejar `command_jar` with class loading traced, saving the entries it read as a profile.
+
+    The run, given `args`, should be a representative startup that
+    exits by itself. Entries are looked up in `jars`, by default just
+    `command_jar`. Returns the entries recorded.
+    """
+    command = [java_executable(), "-verbose:class"] + list(java_options) + ["-jar", command_jar] + list(args)
+    log.info("Training startup order with %s", " ".join(command))
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError("{} exited with status {}".format(" ".join(command), process.returncode))
+    entries = startup_entries(loaded_classes(output.splitlines()), jars or [command_jar])
+    write_profile(profile_path, entries)
+    return entries
+
+
+def order_entries(path, names):
+    """Rewrites the jar at `path` with the entries `names` first, in that order, just after the manifest.
+
+    Entries are transferred raw, so this copies the jar rather than
+    rebuilding it. Names not in the jar are ignored. Returns the number
+    of entries moved to the front.
+    """
+    temp_path = path + ".tmp"
+    moved = 0
+    with zipfile.ZipFile(path) as jar:
+        front = [MANIFEST_NAME] if MANIFEST_NAME in jar.NameToInfo else []
+        front_names = set(front)
+        for name in names:
+            if name in jar.NameToInfo and name not in front_names:
+                front.append(name)
+                front_names.add(name)
+                moved += 1
+        ordered = [jar.getinfo(name) for name in front]
+        ordered.extend(info for info in jar.infolist() if info.filename not in front_names)
+        with ArchiveWriter(temp_path) as output:
+            for info in ordered:
+                output.write_raw(jar, info)
+    if os.name == "nt":
+        os.remove(path)  # rename does not replace files on Windows
+    os.rename(temp_path, path)
+    log.debug("Moved %d startup entries to the front of %s", moved, path)
+    return moved
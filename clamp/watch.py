@@ -0,0 +1,162 @@
+"""Watch mode for build_jar
+
+After an initial build, the source files of the clamped modules, and
+of every submodule loaded with them, are polled for changes. When any
+of them changes, the clamped module and all its submodules are removed
+from sys.modules and imported afresh, and the jar is rewritten with
+only their classes replaced - all other entries are transferred raw
+from the previous jar, without recompressing them. A class directory
+is simply updated in place. Each rebuild keeps the settings of the
+initial build, and with a report path, rewrites the report for it.
+"""
+
+import logging
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+from clamp.archive import MANIFEST_NAME
+from clamp.build import DirectoryBuilder, JarBuilder, import_modules
+from clamp.packages import INDEX_NAMES
+from clamp.precompile import COMPILED_SUFFIX
+from clamp.report import BuildReport, NullReport
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.25
+
+
+def module_source(module):
+    """Returns the path of the source of the imported `module`, or None"""
+    path = getattr(sys.modules.get(module), "__file__", None)
+    if path is None:
+        return None
+    if path.endswith(COMPILED_SUFFIX):
+        path = path[:-len(COMPILED_SUFFIX)] + ".py"
+    elif path.endswith((".pyc", ".pyo")):
+        path = path[:-1]
+    return path
+
+
+def in_packages(module, packages):
+    """Returns whether `module` is one of `packages`, or a submodule of one"""
+    return any(module == package or module.startswith(package + ".") for package in packages)
+
+
+class JarWatcher(object):
+
+    def __init__(self, modules, builder, workers=1, interval=DEFAULT_INTERVAL, report_path=None):
+        self.modules = list(modules)
+        self.output_path = builder.output_path
+        self.exploded = isinstance(builder, DirectoryBuilder)
+        self.compression = builder.compression
+        self.proxy_cache = builder.proxy_cache
+        self.reproducible = getattr(builder, "reproducible", False)
+        self.report_path = report_path
+        self.class_modules = dict(builder.modules)
+        self.workers = workers
+        self.interval = interval
+        self.sources = self.find_sources()
+        self.mtimes = self.stat()
+
+    def find_sources(self):
+        """Returns the source path of each loaded module in the clamped modules"""
+        return dict((module, module_source(module)) for module, value in sys.modules.items()
+                    if value is not None and in_packages(module, self.modules))
+
+    def __repr__(self):
+        return "JarWatcher(output={!r}, modules={!r})".format(self.output_path, self.modules)
+
+    def stat(self):
+        mtimes = {}
+        for module, path in self.sources.iteritems():
+            try:
+                mtimes[module] = os.path.getmtime(path) if path else None
+            except OSError:
+                mtimes[module] = None
+        return mtimes
+
+    def run(self):
+        log.info("Watching %d modules for changes to %s", len(self.modules), self.output_path)
+        try:
+            while True:
+                time.sleep(self.interval)
+                mtimes = self.stat()
+                changed = [module for module in mtimes if mtimes[module] != self.mtimes.get(module)]
+                self.mtimes = mtimes
+                if changed:
+                    self.rebuild(changed)
+        except KeyboardInterrupt:
+            pass
+
+    def rebuild(self, changed):
+        """Imports the clamped modules containing the `changed` modules afresh, replacing their classes.
+
+        All submodules of those clamped modules are removed from
+        sys.modules first, so none of their state survives the rebuild.
+        """
+        started = time.time()
+        packages = set(package for package in self.modules if any(in_packages(module, [package]) for module in changed))
+        for module in [module for module in sys.modules if in_packages(module, packages)]:
+            del sys.modules[module]
+        report = BuildReport("build_jar") if self.report_path else NullReport
+        if self.exploded:
+            rebuilt = self.rebuild_directory(packages, report)
+        else:
+            rebuilt = self.rebuild_jar(packages, report)
+        if not rebuilt:
+            return False  # still watching the previous sources, so fixing the error rebuilds again
+        if self.report_path:
+            report.measure_output(self.output_path)
+            report.save(self.report_path)
+        self.sources = self.find_sources()
+        self.mtimes = self.stat()
+        log.info("Rebuilt %s for %s in %.3fs", self.output_path, ", ".join(sorted(changed)), time.time() - started)
+        return True
+
+    def rebuild_directory(self, packages, report=NullReport):
+        keep = [name for name, module in self.class_modules.iteritems() if not in_packages(module, packages)]
+        try:
+            with DirectoryBuilder(self.output_path, self.proxy_cache, keep, report) as builder:
+                import_modules(builder, sorted(packages), self.workers)
+        except Exception:
+            log.error("Could not rebuild %s", self.output_path, exc_info=True)
+            return False
+        self.class_modules = dict((name, self.class_modules[name]) for name in keep)
+        self.class_modules.update(builder.modules)
+        return True
+
+    def rebuild_jar(self, packages, report=NullReport):
+        # Named as the jar, which its index lists, in a directory next to it
+        temp_dir = tempfile.mkdtemp(prefix=".clamp-", dir=os.path.dirname(os.path.abspath(self.output_path)))
+        temp_path = os.path.join(temp_dir, os.path.basename(self.output_path))
+        try:
+            with zipfile.ZipFile(self.output_path) as previous:
+                with JarBuilder(output_path=temp_path, compression=self.compression, proxy_cache=self.proxy_cache,
+                                workers=self.workers, report=report, reproducible=self.reproducible) as builder:
+                    for info in previous.infolist():
+                        name = info.filename
+                        if name == MANIFEST_NAME or name in INDEX_NAMES:
+                            continue
+                        if name in self.class_modules and in_packages(self.class_modules[name], packages):
+                            continue
+                        if builder.claim(name, (info.CRC, info.file_size)):
+                            builder.jar.write_raw(previous, info)
+                            if name in self.class_modules:
+                                builder.modules[name] = self.class_modules[name]
+                    import_modules(builder, sorted(packages), self.workers)
+        except Exception:
+            log.error("Could not rebuild %s", self.output_path, exc_info=True)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return False
+        if os.name == "nt":
+            os.remove(self.output_path)  # rename does not replace files on Windows
+        os.rename(temp_path, self.output_path)
+        os.rmdir(temp_dir)
+        self.class_modules = builder.modules
+        return True
+
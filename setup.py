@@ -1,12 +1,18 @@
 import ez_setup
 ez_setup.use_setuptools()
 
+import re
+
 from setuptools import setup, find_packages
 
+# clamp/__init__.py cannot be imported outside Jython; the version also keys the proxy cache
+with open("clamp/__init__.py") as f:
+    version = re.search(r'^__version__ = "(.+)"$', f.read(), re.M).group(1)
+
 
 setup(
     name = "clamp",
-    version = "0.4",
+    version = version,
     packages = find_packages(),
     entry_points = {
         "distutils.commands": [
@@ -19,6 +25,7 @@ setup(
         ],
         "console_scripts": [
             "singlejar = clamp.commands:singlejar_script_command",
+            "clamp-daemon = clamp.daemon:main",
         ]
     },
     zip_safe = True
@@ -0,0 +1,40 @@
+from org.clamp_supports import Dispatch
+
+from clamp import clamp_base
+
+BenchBase = clamp_base("org")
+
+
+class DispatchMethods(object):
+
+    def intArgs0(self):
+        return 0
+
+    def intArgs1(self, a):
+        return a
+
+    def intArgs2(self, a, b):
+        return a + b
+
+    def intArgs3(self, a, b, c):
+        return a + b + c
+
+    def objectArgs0(self):
+        return self
+
+    def objectArgs1(self, a):
+        return a
+
+    def objectArgs2(self, a, b):
+        return b
+
+    def objectArgs3(self, a, b, c):
+        return c
+
+
+class ClampedDispatch(BenchBase, DispatchMethods, Dispatch):
+    """Constructed from Java by name, as the clamped class org.bench_samples.dispatch.ClampedDispatch"""
+
+
+class ProxyDispatch(DispatchMethods, Dispatch):
+    """A plain Jython proxy, which Java can only call once given an instance"""
@@ -0,0 +1,260 @@
+"""Benchmark of build_jar, create_singlejar and copy_included_jars on synthetic workloads
+
+Generates clamped modules, site-packages, eggs and included jars of a
+chosen size in a temporary directory, then times each build step,
+reporting its throughput and the peak heap used by the JVM. Run with
+the local Jython, from this directory:
+
+    $ jython27 build_bench.py --classes 1000 --site-files 50000 --output build-bench.json
+
+create_singlejar still copies the Jython runtime and standard library,
+so its phases are reported as well, to tell them from site-packages.
+"""
+
+import argparse
+import json
+import os
+import os.path
+import random
+import shutil
+import site
+import sys
+import tempfile
+import time
+import zipfile
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from java.lang import Runtime, System
+from java.lang.management import ManagementFactory, MemoryType
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+
+from clamp import __version__
+from clamp.build import build_jar, copy_included_jars, create_singlejar
+from clamp.report import BuildReport
+
+CLAMPED_PACKAGE = "bench_build_clamped"
+CLASSES_PER_MODULE = 20
+FILES_PER_PACKAGE = 100
+MB = 1024.0 * 1024.0
+
+
+class ClampSetup(object):
+
+    def __init__(self, modules):
+        self.modules = modules
+
+
+def write_file(path, data):
+    dir_path = os.path.dirname(path)
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def source_text(rng, size):
+    """Returns about `size` bytes of Python source, compressing about as well as real code"""
+    lines = []
+    length = 0
+    while length < size:
+        line = "value_{} = {!r}  # {}\n".format(rng.randint(0, 999), rng.random(), "x" * rng.randint(0, 40))
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)[:size]
+
+
+def generate_clamped(root, classes, methods):
+    """Writes a package of `classes` clamped classes with `methods` typed methods each; returns its modules"""
+    modules = []
+    package_dir = os.path.join(root, CLAMPED_PACKAGE)
+    for start in xrange(0, classes, CLASSES_PER_MODULE):
+        module = "mod{}".format(start // CLASSES_PER_MODULE)
+        lines = [
+            "from java.lang import Integer, Object, String",
+            "from clamp.declarative import clamp_class, method",
+            "",
+        ]
+        for i in xrange(start, min(start + CLASSES_PER_MODULE, classes)):
+            lines.extend(["", "@clamp_class('org')", "class Sample{}(Object):".format(i), "", "    x = 0"])
+            for j in xrange(methods):
+                lines.extend([
+                    "",
+                    "    @method(Integer.TYPE, (Integer.TYPE, String))",
+                    "    def method{}(self, a, b):".format(j),
+                    "        return a + {}".format(j),
+                ])
+        write_file(os.path.join(package_dir, module + ".py"), "\n".join(lines) + "\n")
+        modules.append(CLAMPED_PACKAGE + "." + module)
+    write_file(os.path.join(package_dir, "__init__.py"), "")
+    return modules
+
+
+def generate_site(site_dir, rng, files, file_size, eggs, egg_files):
+    """Writes `files` modules in packages, and `eggs` zipped eggs listed in easy-install.pth"""
+    for i in xrange(files):
+        package = "synthetic{}".format(i // FILES_PER_PACKAGE)
+        write_file(os.path.join(site_dir, package, "mod{}.py".format(i)), source_text(rng, file_size))
+    for i in xrange(0, files, FILES_PER_PACKAGE):
+        write_file(os.path.join(site_dir, "synthetic{}".format(i // FILES_PER_PACKAGE), "__init__.py"), "")
+    egg_paths = []
+    for i in xrange(eggs):
+        egg_name = "synthetic_egg{}-1.0-py2.7.egg".format(i)
+        with zipfile.ZipFile(os.path.join(site_dir, egg_name), "w", zipfile.ZIP_DEFLATED) as egg:
+            egg.writestr("synthetic_egg{}/__init__.py".format(i), "")
+            for j in xrange(egg_files):
+                egg.writestr("synthetic_egg{}/mod{}.py".format(i, j), source_text(rng, file_size))
+            egg.writestr("EGG-INFO/PKG-INFO", "Name: synthetic-egg{}\nVersion: 1.0\n".format(i))
+        egg_paths.append("./" + egg_name)
+    with open(os.path.join(site_dir, "easy-install.pth"), "w") as f:
+        f.write("".join(path + "\n" for path in egg_paths))
+
+
+def generate_jars(src_dir, package, rng, jars, jar_entries, file_size):
+    """Writes `jars` jars of `jar_entries` entries each in `package` of `src_dir`, as included by a project"""
+    jar_dir = os.path.join(src_dir, package)
+    os.makedirs(jar_dir)
+    for i in xrange(jars):
+        with zipfile.ZipFile(os.path.join(jar_dir, "lib{}-1.0.jar".format(i)), "w", zipfile.ZIP_DEFLATED) as jar:
+            for j in xrange(jar_entries):
+                jar.writestr("org/synthetic/lib{}/Entry{}.txt".format(i, j), source_text(rng, file_size))
+
+
+def tree_size(path):
+    count = total = 0
+    if os.path.isfile(path):
+        return 1, os.path.getsize(path)
+    for dirpath, dirs, files in os.walk(path):
+        for filename in files:
+            count += 1
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return count, total
+
+
+@contextmanager
+def synthetic_site(site_dir):
+    """Points site.getsitepackages, through which clamp finds site-packages, at `site_dir`"""
+    getsitepackages = site.getsitepackages
+    site.getsitepackages = lambda: [site_dir]
+    try:
+        yield
+    finally:
+        site.getsitepackages = getsitepackages
+
+
+def heap_pools():
+    return [pool for pool in ManagementFactory.getMemoryPoolMXBeans() if pool.getType() == MemoryType.HEAP]
+
+
+@contextmanager
+def measure(results, step, files, size):
+    """Times a step processing `files` files of `size` bytes in total, adding its record to `results`.
+
+    Peak heap is the sum of the peaks of each heap pool, which may be
+    reached at different times, so it is an upper bound.
+    """
+    System.gc()
+    for pool in heap_pools():
+        pool.resetPeakUsage()
+    record = OrderedDict([("step", step), ("files", files), ("bytes", size)])
+    started = time.time()
+    yield record
+    seconds = time.time() - started
+    record["seconds"] = round(seconds, 3)
+    record["files_per_second"] = round(files / seconds, 1)
+    record["mb_per_second"] = round(size / MB / seconds, 2)
+    record["peak_heap_mb"] = round(sum(pool.getPeakUsage().getUsed() for pool in heap_pools()) / MB, 1)
+    results.append(record)
+    print "{step:22} {files:8} files {seconds:8.2f}s {files_per_second:10.1f} files/s {mb_per_second:8.2f} MB/s " \
+          "peak heap {peak_heap_mb:8.1f} MB".format(**record)
+
+
+def run_benchmark(args, root):
+    rng = random.Random(args.seed)
+    results = []
+    src_dir = os.path.join(root, "src")
+    site_dir = os.path.join(root, "site-packages")
+    out_dir = os.path.join(root, "out")
+    for path in (src_dir, site_dir, out_dir):
+        os.makedirs(path)
+    os.environ["CLAMP_CACHE_DIR"] = os.path.join(root, "cache")  # so the first build is cold
+
+    started = time.time()
+    modules = generate_clamped(src_dir, args.classes, args.methods)
+    generate_site(site_dir, rng, args.site_files, args.file_size, args.eggs, args.egg_files)
+    generate_jars(src_dir, "bench_jars", rng, args.jars, args.jar_entries, args.file_size)
+    print "Generated workload in {:.2f}s".format(time.time() - started)
+
+    sys.path.insert(0, src_dir)
+    with synthetic_site(site_dir):
+        sources = tree_size(os.path.join(src_dir, CLAMPED_PACKAGE))
+        for step in ("build_jar", "build_jar (cached)"):
+            for module in list(sys.modules):
+                if module == CLAMPED_PACKAGE or module.startswith(CLAMPED_PACKAGE + "."):
+                    del sys.modules[module]
+            output = os.path.join(out_dir, "clamped.jar")
+            with measure(results, step, args.classes, sources[1]) as record:
+                build_jar("bench", "bench-1.0.jar", ClampSetup(modules), output)
+            record["output_bytes"] = os.path.getsize(output)
+
+        files, size = tree_size(os.path.join(src_dir, "bench_jars"))
+        with measure(results, "copy_included_jars", files, size):
+            copy_included_jars("bench_jars", ["bench_jars"], src_dir)
+
+        files, size = tree_size(site_dir)
+        report = BuildReport("singlejar")
+        output = os.path.join(out_dir, "single.jar")
+        with measure(results, "create_singlejar", files, size) as record:
+            create_singlejar(output, [], None, workers=args.workers, report=report)
+        record["output_bytes"] = os.path.getsize(output)
+        record["phases"] = report.as_dict()["phases"]
+
+    return OrderedDict([
+        ("environment", OrderedDict([
+            ("clamp", __version__),
+            ("jython", sys.version.split()[0]),
+            ("java", System.getProperty("java.version")),
+            ("processors", Runtime.getRuntime().availableProcessors()),
+            ("max_heap_mb", round(Runtime.getRuntime().maxMemory() / MB, 1)),
+        ])),
+        ("workload", OrderedDict((name, getattr(args, name)) for name in (
+            "classes", "methods", "site_files", "file_size", "eggs", "egg_files", "jars", "jar_entries", "workers",
+            "seed"))),
+        ("results", results),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time build_jar, create_singlejar and copy_included_jars "
+                                                 "on synthetic workloads")
+    parser.add_argument("--classes", type=int, default=1000, help="clamped classes")
+    parser.add_argument("--methods", type=int, default=5, help="typed methods per clamped class")
+    parser.add_argument("--site-files", type=int, default=5000, help="modules in site-packages")
+    parser.add_argument("--file-size", type=int, default=4096, help="bytes per generated module or jar entry")
+    parser.add_argument("--eggs", type=int, default=10, help="zipped eggs in site-packages")
+    parser.add_argument("--egg-files", type=int, default=100, help="modules per egg")
+    parser.add_argument("--jars", type=int, default=10, help="jars included by the project")
+    parser.add_argument("--jar-entries", type=int, default=500, help="entries per included jar")
+    parser.add_argument("--workers", "-j", type=int, default=1, help="threads for create_singlejar")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generated contents")
+    parser.add_argument("--output", "-o", default=None, metavar="PATH", help="write results as JSON to this path")
+    parser.add_argument("--keep", action="store_true", help="keep the generated workload")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="clamp-build-bench-")
+    try:
+        results = run_benchmark(args, root)
+    finally:
+        if args.keep:
+            print "Kept workload in", root
+        else:
+            shutil.rmtree(root)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, separators=(",", ": "))
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
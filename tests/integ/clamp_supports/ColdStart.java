@@ -0,0 +1,61 @@
+package org.clamp_supports;
+
+import java.io.File;
+import java.io.InputStream;
+import java.util.Properties;
+
+import org.python.core.PySystemState;
+import org.python.core.packagecache.SysPackageManager;
+import org.python.util.PythonInterpreter;
+
+/**
+ * Runs the __run__.py of a singlejar as JarRunner does, recording when
+ * each phase of startup ends, for the cold-start benchmark.
+ *
+ * Jython is initialized without scanning the classpath, which is then
+ * scanned separately - or, with -Dclamp.coldstart.index=true, replaced
+ * by the package listings clamp writes into jars - so that package
+ * scanning is timed on its own. The times are passed to __run__.py as
+ * clamp.coldstart.* system properties, in milliseconds since the epoch.
+ */
+public final class ColdStart {
+
+    private ColdStart() {
+    }
+
+    public static void main(String[] args) throws Exception {
+        mark("main");
+        Properties properties = new Properties();
+        properties.setProperty("python.packages.paths", "");
+        properties.setProperty("python.cachedir.skip", "true");
+        PySystemState.initialize(System.getProperties(), properties, args);
+        PythonInterpreter interp = new PythonInterpreter();
+        mark("init");
+
+        if (Boolean.getBoolean("clamp.coldstart.index")) {
+            interp.exec("import clamp.packages; clamp.packages.load_classpath_packages()");
+        } else {
+            SysPackageManager packageManager = (SysPackageManager) PySystemState.packageManager;
+            for (String path : System.getProperty("java.class.path").split(File.pathSeparator)) {
+                packageManager.addJar(path, false);
+            }
+        }
+        mark("packages");
+
+        InputStream runpy = ColdStart.class.getClassLoader().getResourceAsStream("__run__.py");
+        if (runpy == null) {
+            throw new IllegalStateException("No __run__.py on the classpath");
+        }
+        try {
+            interp.set("__name__", "__main__");
+            interp.execfile(runpy, "__run__.py");
+        } finally {
+            runpy.close();
+            interp.cleanup();
+        }
+    }
+
+    private static void mark(String phase) {
+        System.setProperty("clamp.coldstart." + phase, Long.toString(System.currentTimeMillis()));
+    }
+}
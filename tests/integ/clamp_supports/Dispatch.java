@@ -0,0 +1,17 @@
+package org.clamp_supports;
+
+/**
+ * Calls measured by DispatchBenchmark, with 0 to 3 primitive or object
+ * arguments, implemented in Java, by a clamped class and by a plain
+ * Jython proxy.
+ */
+public interface Dispatch {
+    int intArgs0();
+    int intArgs1(int a);
+    int intArgs2(int a, int b);
+    int intArgs3(int a, int b, int c);
+    Object objectArgs0();
+    Object objectArgs1(Object a);
+    Object objectArgs2(Object a, Object b);
+    Object objectArgs3(Object a, Object b, Object c);
+}
@@ -0,0 +1,132 @@
+package org.clamp_supports;
+
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.List;
+import java.util.concurrent.Callable;
+import java.util.concurrent.CyclicBarrier;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+
+/**
+ * Measures calls from Java to a Dispatch implementation.
+ *
+ * Timing a single call would mostly measure System.nanoTime, so each
+ * latency sample is the mean of a batch of calls. Results are kept in
+ * a volatile field so the JIT cannot drop the calls.
+ */
+public final class DispatchBenchmark {
+
+    public static final List<String> SHAPES = Arrays.asList(
+        "intArgs0", "intArgs1", "intArgs2", "intArgs3",
+        "objectArgs0", "objectArgs1", "objectArgs2", "objectArgs3");
+
+    private static final Object ARG = "arg";
+
+    private static volatile Object sink;
+
+    public static final class Result {
+        /** Nanoseconds per call, one sample per batch, over all threads */
+        public final long[] samples;
+        /** Wall-clock nanoseconds for all threads to make their calls */
+        public final long elapsed;
+        public final long calls;
+
+        Result(long[] samples, long elapsed, long calls) {
+            this.samples = samples;
+            this.elapsed = elapsed;
+            this.calls = calls;
+        }
+
+        public double callsPerSecond() {
+            return calls * 1e9 / elapsed;
+        }
+    }
+
+    private DispatchBenchmark() {
+    }
+
+    /**
+     * Calls `shape` on `target` from `threads` threads, each making
+     * `warmup` batches of `batch` calls, then `batches` timed ones.
+     */
+    public static Result run(final Dispatch target, String shape, int threads, final int warmup, final int batches,
+                             final int batch) throws Exception {
+        final int index = SHAPES.indexOf(shape);
+        if (index < 0) {
+            throw new IllegalArgumentException("Unknown shape " + shape);
+        }
+        final long[] started = new long[1];
+        final CyclicBarrier barrier = new CyclicBarrier(threads, new Runnable() {
+            public void run() {
+                started[0] = System.nanoTime();
+            }
+        });
+        ExecutorService executor = Executors.newFixedThreadPool(threads);
+        try {
+            List<Future<long[]>> futures = new ArrayList<Future<long[]>>();
+            for (int i = 0; i < threads; i++) {
+                futures.add(executor.submit(new Callable<long[]>() {
+                    public long[] call() throws Exception {
+                        for (int i = 0; i < warmup; i++) {
+                            callBatch(target, index, batch);
+                        }
+                        barrier.await();
+                        long[] samples = new long[batches];
+                        for (int i = 0; i < batches; i++) {
+                            long start = System.nanoTime();
+                            callBatch(target, index, batch);
+                            samples[i] = (System.nanoTime() - start) / batch;
+                        }
+                        return samples;
+                    }
+                }));
+            }
+            long[] samples = new long[threads * batches];
+            int offset = 0;
+            for (Future<long[]> future : futures) {
+                long[] threadSamples = future.get();
+                System.arraycopy(threadSamples, 0, samples, offset, threadSamples.length);
+                offset += threadSamples.length;
+            }
+            long elapsed = System.nanoTime() - started[0];
+            Arrays.sort(samples);
+            return new Result(samples, elapsed, (long) threads * batches * batch);
+        } finally {
+            executor.shutdown();
+        }
+    }
+
+    private static void callBatch(Dispatch target, int index, int batch) {
+        Object result = null;
+        int total = 0;
+        switch (index) {
+        case 0:
+            for (int i = 0; i < batch; i++) total += target.intArgs0();
+            break;
+        case 1:
+            for (int i = 0; i < batch; i++) total += target.intArgs1(i);
+            break;
+        case 2:
+            for (int i = 0; i < batch; i++) total += target.intArgs2(i, 1);
+            break;
+        case 3:
+            for (int i = 0; i < batch; i++) total += target.intArgs3(i, 1, 2);
+            break;
+        case 4:
+            for (int i = 0; i < batch; i++) result = target.objectArgs0();
+            break;
+        case 5:
+            for (int i = 0; i < batch; i++) result = target.objectArgs1(ARG);
+            break;
+        case 6:
+            for (int i = 0; i < batch; i++) result = target.objectArgs2(ARG, ARG);
+            break;
+        case 7:
+            for (int i = 0; i < batch; i++) result = target.objectArgs3(ARG, ARG, ARG);
+            break;
+        }
+        sink = result != null ? result : (Object) total;
+    }
+}
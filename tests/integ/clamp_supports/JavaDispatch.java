@@ -0,0 +1,38 @@
+package org.clamp_supports;
+
+/**
+ * Pure Java baseline for DispatchBenchmark.
+ */
+public class JavaDispatch implements Dispatch {
+    public int intArgs0() {
+        return 0;
+    }
+
+    public int intArgs1(int a) {
+        return a;
+    }
+
+    public int intArgs2(int a, int b) {
+        return a + b;
+    }
+
+    public int intArgs3(int a, int b, int c) {
+        return a + b + c;
+    }
+
+    public Object objectArgs0() {
+        return this;
+    }
+
+    public Object objectArgs1(Object a) {
+        return a;
+    }
+
+    public Object objectArgs2(Object a, Object b) {
+        return b;
+    }
+
+    public Object objectArgs3(Object a, Object b, Object c) {
+        return c;
+    }
+}
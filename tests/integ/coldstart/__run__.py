@@ -0,0 +1,32 @@
+"""Fixture for the cold-start benchmark
+
+Reports when it starts running, then times importing a clamped module
+and first using its clamped class from Java, as a line of JSON.
+"""
+import time
+run = int(time.time() * 1000)
+
+import json
+
+from java.lang import Boolean, Class, System
+from java.lang.management import ManagementFactory
+
+if Boolean.getBoolean("clamp.coldstart.index") and System.getProperty("clamp.coldstart.packages") is None:
+    # Run by JarRunner, so the packages have not been registered from the listings yet
+    import clamp.packages
+    clamp.packages.load_classpath_packages()
+
+import bench_samples.dispatch
+imports = int(time.time() * 1000)
+
+dispatch = Class.forName("org.bench_samples.dispatch.ClampedDispatch").newInstance()
+dispatch.intArgs1(1)
+proxy = int(time.time() * 1000)
+
+marks = {"jvm_start": ManagementFactory.getRuntimeMXBean().getStartTime(), "run": run, "imports": imports,
+         "proxy": proxy}
+for phase in ("main", "init", "packages"):
+    value = System.getProperty("clamp.coldstart." + phase)
+    if value is not None:
+        marks[phase] = long(value)
+print "coldstart:", json.dumps(marks)
@@ -0,0 +1,145 @@
+"""Cold-start benchmark of singlejars
+
+Launches a singlejar built from this fixture project a number of times,
+each in a new JVM with no Jython package cache, and reports how long
+startup takes, from launch to the first line of coldstart/__run__.py
+and to the first use of a clamped class.
+
+Runs through org.clamp_supports.ColdStart break startup down into
+phases, from spawning the JVM process to the start time the JVM
+reports; runs with java -jar, through Jython's own JarRunner, give the
+end-to-end times the breakdown should add up to. Medians, minimums and
+maximums are in milliseconds.
+"""
+
+import json
+import os
+import os.path
+import subprocess
+import sys
+import time
+import zipfile
+
+from collections import OrderedDict
+from java.lang import System
+
+from clamp import __version__
+
+# (phase, start mark, end mark); jvm_start is when the JVM says it started,
+# so process is the time to spawn it and jvm the time it takes to boot
+LAUNCHER_PHASES = [
+    ("process", "launch", "jvm_start"),
+    ("jvm", "jvm_start", "main"),
+    ("jython_init", "main", "init"),
+    ("package_scan", "init", "packages"),
+    ("run_start", "packages", "run"),
+    ("imports", "run", "imports"),
+    ("proxy", "imports", "proxy"),
+    ("first_line", "launch", "run"),
+    ("total", "launch", "proxy"),
+]
+JAR_PHASES = [
+    ("process", "launch", "jvm_start"),
+    ("first_line", "launch", "run"),
+    ("imports", "run", "imports"),
+    ("proxy", "imports", "proxy"),
+    ("total", "launch", "proxy"),
+]
+MARKER = "coldstart:"
+
+
+def write_fixture_jar(path, packages):
+    """Writes the sources of `packages`, mapping names to directories, under Lib/ in the jar at `path`"""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as jar:
+        for package, package_dir in packages.iteritems():
+            for dirpath, dirs, files in os.walk(package_dir):
+                for filename in sorted(files):
+                    if filename.endswith(".py"):
+                        full_path = os.path.join(dirpath, filename)
+                        relpath = os.path.relpath(full_path, package_dir).replace(os.sep, "/")
+                        jar.write(full_path, "Lib/{}/{}".format(package, relpath))
+
+
+def java_executable():
+    return os.path.join(System.getProperty("java.home"), "bin", "java")
+
+
+def launch(command):
+    """Runs `command`, returning the marks reported by __run__.py along with when it was launched"""
+    launched = int(time.time() * 1000)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError("{} exited with status {}".format(" ".join(command), process.returncode))
+    for line in output.splitlines():
+        if line.startswith(MARKER):
+            marks = json.loads(line[len(MARKER):])
+            marks["launch"] = launched
+            return marks
+    raise RuntimeError("{} did not report its startup".format(" ".join(command)))
+
+
+def durations(marks, phases):
+    return OrderedDict((phase, marks[end] - marks[start]) for phase, start, end in phases if start in marks)
+
+
+def summarize(runs):
+    summary = OrderedDict()
+    for phase in runs[0]:
+        values = sorted(run[phase] for run in runs)
+        summary[phase] = OrderedDict([
+            ("median", values[len(values) // 2]),
+            ("min", values[0]),
+            ("max", values[-1]),
+        ])
+    return summary
+
+
+def run_benchmark(singlejar, runs, index=False):
+    java = java_executable()
+    properties = ["-Dpython.cachedir.skip=true"]
+    if index:
+        properties.extend(["-Dclamp.coldstart.index=true", "-Dpython.packages.paths=sun.boot.class.path"])
+    modes = OrderedDict([
+        ("launcher", ([java] + properties + ["-cp", singlejar, "org.clamp_supports.ColdStart"], LAUNCHER_PHASES)),
+        ("java -jar", ([java] + properties + ["-jar", singlejar], JAR_PHASES)),
+    ])
+    results = OrderedDict()
+    for mode, (command, phases) in modes.iteritems():
+        timings = [durations(launch(command), phases) for i in xrange(runs)]
+        results[mode] = summarize(timings)
+        print mode
+        for phase, summary in results[mode].iteritems():
+            print "  {:14} {median:6} ms  (min {min}, max {max})".format(phase, **summary)
+    return results
+
+
+def environment():
+    return OrderedDict([
+        ("clamp", __version__),
+        ("jython", sys.version.split()[0]),
+        ("java", System.getProperty("java.version")),
+    ])
+
+
+def compare(report, baseline):
+    """Prints the median times of `report` relative to those of `baseline`"""
+    print "Compared to {}:".format(", ".join("{}={}".format(*item) for item in baseline["options"].iteritems()))
+    for mode, phases in report["results"].iteritems():
+        previous = baseline["results"].get(mode, {})
+        for phase, summary in phases.iteritems():
+            if phase in previous and previous[phase]["median"]:
+                print "  {:9} {:14} {:6} ms vs {:6} ms {:7.2f}x".format(
+                    mode, phase, summary["median"], previous[phase]["median"],
+                    float(summary["median"]) / previous[phase]["median"])
+
+
+def save(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, separators=(",", ": "))
+        f.write("\n")
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
@@ -0,0 +1,104 @@
+"""Benchmarks of calls from Java to Python through clamped classes
+
+Each call shape of org.clamp_supports.Dispatch is timed against three
+implementations - pure Java, a clamped class constructed from Java by
+name, and a plain Jython proxy - from one thread and from several.
+Iteration counts are fixed and the environment is recorded along with
+the results, so that results from different versions of clamp and
+Jython can be compared with --baseline.
+"""
+
+import json
+import platform
+import sys
+
+from collections import OrderedDict
+from java.lang import Class, Runtime, System
+
+from clamp import __version__
+from org.clamp_supports import DispatchBenchmark, JavaDispatch
+
+CLAMPED_CLASS = "org.bench_samples.dispatch.ClampedDispatch"
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples, p):
+    """Returns the `p`th percentile of sorted `samples`, by nearest rank"""
+    rank = max(int(round(p / 100.0 * len(samples))), 1)
+    return samples[rank - 1]
+
+
+def environment():
+    return OrderedDict([
+        ("clamp", __version__),
+        ("jython", sys.version.split()[0]),
+        ("java", System.getProperty("java.version")),
+        ("vm", System.getProperty("java.vm.name")),
+        ("os", platform.platform()),
+        ("processors", Runtime.getRuntime().availableProcessors()),
+    ])
+
+
+def targets():
+    from bench_samples.dispatch import ProxyDispatch
+    return OrderedDict([
+        ("java", JavaDispatch()),
+        # Loaded from the built jar, as Java code using clamp would
+        ("clamped", Class.forName(CLAMPED_CLASS).newInstance()),
+        ("proxy", ProxyDispatch()),
+    ])
+
+
+def run_benchmarks(thread_counts, warmup, batches, batch):
+    results = []
+    for target_name, target in targets().iteritems():
+        for threads in thread_counts:
+            for shape in DispatchBenchmark.SHAPES:
+                result = DispatchBenchmark.run(target, shape, threads, warmup, batches, batch)
+                record = OrderedDict([
+                    ("target", target_name),
+                    ("shape", shape),
+                    ("threads", threads),
+                    ("calls_per_second", round(result.callsPerSecond())),
+                ])
+                for p in PERCENTILES:
+                    record["p{}_ns".format(p)] = percentile(result.samples, p)
+                record["max_ns"] = result.samples[-1]
+                results.append(record)
+                print "{target:8} {shape:12} {threads:3} threads {calls_per_second:14,.0f} calls/s  p50 {p50_ns:6} ns  " \
+                      "p99 {p99_ns:6} ns".format(**record)
+    return OrderedDict([
+        ("environment", environment()),
+        ("settings", OrderedDict([("warmup", warmup), ("batches", batches), ("batch", batch)])),
+        ("results", results),
+    ])
+
+
+def result_key(record):
+    return record["target"], record["shape"], record["threads"]
+
+
+def compare(report, baseline):
+    """Prints the throughput of `report` relative to that of `baseline`"""
+    if baseline["settings"] != report["settings"]:
+        print "Warning: baseline was run with settings {}".format(dict(baseline["settings"]))
+    previous = dict((result_key(record), record) for record in baseline["results"])
+    print "Compared to clamp {clamp}, Jython {jython}, Java {java}:".format(**baseline["environment"])
+    for record in report["results"]:
+        old = previous.get(result_key(record))
+        if old is None:
+            continue
+        print "{:8} {:12} {:3} threads {:7.2f}x".format(
+            record["target"], record["shape"], record["threads"],
+            float(record["calls_per_second"]) / old["calls_per_second"])
+
+
+def save(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, separators=(",", ": "))
+        f.write("\n")
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
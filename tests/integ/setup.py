@@ -5,18 +5,22 @@ import sys
 import os
 import zipfile
 
+from collections import OrderedDict
 from setuptools import setup, find_packages, Command
 from glob import glob
 
 # add parent clamp path
 sys.path.append("../../")
 
-from clamp.commands import clamp_command
+from clamp.build import create_singlejar
+from clamp.commands import ClampSetup, clamp_command, parse_compression, parse_precompile
+from clamp.prune import Pruner
 
 
 from org.junit.runner import JUnitCore
 from javax.tools import ToolProvider
 from java.io import File
+from java.lang import Runtime
 from java.net import URLClassLoader
 from java.net import URL
 
@@ -28,6 +32,7 @@ class test_command(Command):
         ("tempdir=",   "t", "temporary directory for test data"),
         ("junit-testdir=",   "j", "directory containing junit tests")
     ]
+    extra_modules = []  # clamped for this command only, besides the modules of setup()
 
     def initialize_options(self):
         self.tempdir = 'build/tmp'
@@ -43,7 +48,12 @@ class test_command(Command):
     def build_jar(self):
         build_jar_cmd = self.distribution.get_command_obj('build_jar')
         build_jar_cmd.output = os.path.join(self.testjar)
-        self.run_command('build_jar')
+        clamp_setup = self.distribution.clamp
+        self.distribution.clamp = ClampSetup(list(clamp_setup.modules) + self.extra_modules)
+        try:
+            self.run_command('build_jar')
+        finally:
+            self.distribution.clamp = clamp_setup
 
     def build_support_jar(self):
         with zipfile.ZipFile(self.supportjar, 'w') as fh:
@@ -121,6 +131,131 @@ class test_command(Command):
         self.run_junit()
 
 
+class bench_command(test_command):
+
+    description = "Run call dispatch benchmarks"
+    user_options = test_command.user_options + [
+        ("output=",    "o", "write results as JSON to this path"),
+        ("baseline=",  "b", "compare with results previously written with --output"),
+        ("threads=",   None, "comma-separated numbers of calling threads (default 1 and one per core)"),
+        ("batches=",   None, "timed batches of calls per thread"),
+        ("batch=",     None, "calls per batch, averaged for each latency sample"),
+        ("warmup=",    None, "untimed batches per thread, for the JIT to compile the calls"),
+    ]
+    extra_modules = ["bench_samples"]
+
+    def initialize_options(self):
+        test_command.initialize_options(self)
+        self.output = None
+        self.baseline = None
+        self.threads = None
+        self.batches = 2000
+        self.batch = 100
+        self.warmup = 1000
+
+    def finalize_options(self):
+        test_command.finalize_options(self)
+        if self.threads:
+            self.threads = [int(threads) for threads in self.threads.split(",")]
+        else:
+            self.threads = sorted(set([1, Runtime.getRuntime().availableProcessors()]))
+        self.batches = int(self.batches)
+        self.batch = int(self.batch)
+        self.warmup = int(self.warmup)
+
+    def import_test_jar(self):
+        addURL = URLClassLoader.getDeclaredMethod('addURL', [URL])
+        addURL.accessible = True
+        addURL.invoke(URLClassLoader.getSystemClassLoader(), [File(os.path.abspath(self.testjar)).toURL()])
+
+    def run(self):
+        self.mkpath(self.support_classesdir)
+        self.run_support_javac()
+        self.build_support_jar()
+        self.import_support_jar()
+        self.build_jar()
+        self.import_test_jar()
+
+        import dispatch_bench
+        report = dispatch_bench.run_benchmarks(self.threads, self.warmup, self.batches, self.batch)
+        if self.output:
+            dispatch_bench.save(report, self.output)
+        if self.baseline:
+            dispatch_bench.compare(report, dispatch_bench.load(self.baseline))
+
+
+class coldstart_command(test_command):
+
+    description = "Run the cold-start benchmark of a singlejar of this project"
+    user_options = test_command.user_options + [
+        ("runs=",      "n", "launches of the singlejar per mode"),
+        ("output=",    "o", "write results as JSON to this path"),
+        ("baseline=",  "b", "compare with results previously written with --output"),
+        ("compression=", "z", "singlejar compression rules, as for the singlejar command"),
+        ("precompile=", None, "singlejar precompile mode, as for the singlejar command"),
+        ("prune",      None, "prune the singlejar to modules reachable from coldstart/__run__.py"),
+        ("index",      None, "register packages from the listings in the singlejar instead of scanning it"),
+    ]
+    boolean_options = ["prune", "index"]
+    extra_modules = ["bench_samples"]
+
+    def initialize_options(self):
+        test_command.initialize_options(self)
+        self.runs = 10
+        self.output = None
+        self.baseline = None
+        self.compression = None
+        self.precompile = None
+        self.prune = False
+        self.index = False
+
+    def finalize_options(self):
+        test_command.finalize_options(self)
+        self.runs = int(self.runs)
+        self.fixturejar = os.path.join(self.tempdir, 'coldstart-fixture.jar')
+        self.singlejar = os.path.join(self.tempdir, 'coldstart-single.jar')
+        self.runpy = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coldstart', '__run__.py')
+
+    def build_singlejar(self):
+        import coldstart_bench
+        root = os.path.dirname(os.path.abspath(__file__))
+        # The singlejar has to carry the clamped modules and clamp itself
+        coldstart_bench.write_fixture_jar(self.fixturejar, {
+            "bench_samples": os.path.join(root, "bench_samples"),
+            "clamp": os.path.join(root, "../../clamp"),
+        })
+        pruner = Pruner(["bench_samples"]) if self.prune else None
+        create_singlejar(self.singlejar, [self.supportjar, self.testjar, self.fixturejar], self.runpy,
+                         compression=parse_compression(self.compression),
+                         precompiler=parse_precompile(self.precompile), pruner=pruner)
+
+    def run(self):
+        self.mkpath(self.support_classesdir)
+        self.run_support_javac()
+        self.build_support_jar()
+        self.import_support_jar()
+        self.build_jar()
+        self.build_singlejar()
+
+        import coldstart_bench
+        report = OrderedDict([
+            ("environment", coldstart_bench.environment()),
+            ("options", OrderedDict([
+                ("compression", self.compression),
+                ("precompile", self.precompile),
+                ("prune", bool(self.prune)),
+                ("index", bool(self.index)),
+                ("singlejar_bytes", os.path.getsize(self.singlejar)),
+                ("runs", self.runs),
+            ])),
+            ("results", coldstart_bench.run_benchmark(os.path.abspath(self.singlejar), self.runs, self.index)),
+        ])
+        if self.output:
+            coldstart_bench.save(report, self.output)
+        if self.baseline:
+            coldstart_bench.compare(report, coldstart_bench.load(self.baseline))
+
+
 setup(
     name = "clamp-tests",
     version = "0.1",
@@ -129,6 +264,8 @@ setup(
         "modules": ["clamp_samples"]
     },
     cmdclass = { "install": clamp_command,
-                 "test": test_command}
+                 "test": test_command,
+                 "bench": bench_command,
+                 "coldstart": coldstart_command}
 )
 
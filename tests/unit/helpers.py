@@ -0,0 +1,100 @@
+"""Shared fixtures for the unit tests"""
+
+import os
+import os.path
+import shutil
+import site
+import tempfile
+import unittest
+import zipfile
+
+from clamp import build
+
+
+def write_file(path, data):
+    dir_path = os.path.dirname(path)
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_jar(path, entries):
+    """Writes a jar of (name, data) `entries`, in order"""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as jar:
+        for name, data in entries:
+            jar.writestr(name, data)
+
+
+def read_entries(path):
+    """Returns the (name, data) entries of the jar at `path`, in order"""
+    with zipfile.ZipFile(path) as jar:
+        return [(info.filename, jar.read(info)) for info in jar.infolist()]
+
+
+def read_manifest(path):
+    """Returns the main attributes of the manifest of the jar at `path`"""
+    with zipfile.ZipFile(path) as jar:
+        lines = jar.read("META-INF/MANIFEST.MF").splitlines()
+    attributes = {}
+    for line in lines:
+        if not line:
+            break  # end of the main section
+        if line.startswith(" "):
+            attributes[name] += line[1:]  # continued, as lines are wrapped at 72 bytes
+        else:
+            name, value = line.split(": ", 1)
+            attributes[name] = value
+    return attributes
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Gives each test a temporary directory, `self.root`, also used as the proxy cache"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="clamp-test-")
+        self.old_cache_dir = os.environ.get("CLAMP_CACHE_DIR")
+        os.environ["CLAMP_CACHE_DIR"] = os.path.join(self.root, "cache")
+
+    def tearDown(self):
+        if self.old_cache_dir is None:
+            del os.environ["CLAMP_CACHE_DIR"]
+        else:
+            os.environ["CLAMP_CACHE_DIR"] = self.old_cache_dir
+        shutil.rmtree(self.root)
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+
+class SinglejarTestCase(TempDirTestCase):
+    """Builds singlejars from a site-packages and Jython install of its own, under `self.root`.
+
+    `self.jython_jars` and `self.lib_files`, (relpath, path) pairs of
+    the standard library, stand in for those of the running Jython.
+    """
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.site_packages = self.path("site-packages")
+        os.makedirs(self.site_packages)
+        self.jython_jars = []
+        self.lib_files = []
+        self.patch(site, "getsitepackages", lambda: [self.site_packages])
+        self.patch(build, "find_jython_jars", lambda: list(self.jython_jars))
+        self.patch(build, "find_jython_lib_files", lambda: iter(self.lib_files))
+
+    def patch(self, obj, name, value):
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
+    def add_lib_file(self, relpath, data):
+        path = self.path("jython", relpath)
+        write_file(path, data)
+        self.lib_files.append((relpath, path))
+        return path
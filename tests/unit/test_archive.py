@@ -0,0 +1,112 @@
+import unittest
+import zipfile
+
+from clamp.archive import DEFAULT_LEVEL, REPRODUCIBLE_DATE_TIME, ArchiveWriter, CompressionPolicy, read_raw
+from clamp.build import create_singlejar
+
+from helpers import SinglejarTestCase, TempDirTestCase
+
+DATA = "".join("line {}\n".format(i) for i in xrange(1000))
+
+
+class RawTransferTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.source = self.path("source.zip")
+        with zipfile.ZipFile(self.source, "w") as source:
+            source.writestr(zipfile.ZipInfo("deflated.txt", (2001, 2, 3, 4, 5, 6)), DATA, zipfile.ZIP_DEFLATED)
+            source.writestr(zipfile.ZipInfo("stored.txt", (2001, 2, 3, 4, 5, 6)), DATA, zipfile.ZIP_STORED)
+
+    def transfer(self, date_time=None, renames=None):
+        output = self.path("output.zip")
+        with zipfile.ZipFile(self.source) as source:
+            with ArchiveWriter(output, date_time) as writer:
+                for info in source.infolist():
+                    writer.write_raw(source, info, (renames or {}).get(info.filename))
+        return output
+
+    def test_copies_compressed_bytes_crc_and_sizes(self):
+        output = self.transfer()
+        with zipfile.ZipFile(self.source) as source:
+            with zipfile.ZipFile(output) as copy:
+                self.assertIsNone(copy.testzip())
+                for info in source.infolist():
+                    copied = copy.getinfo(info.filename)
+                    for field in ("compress_type", "CRC", "compress_size", "file_size", "date_time"):
+                        self.assertEqual(getattr(copied, field), getattr(info, field))
+                    self.assertEqual("".join(read_raw(copy, copied)), "".join(read_raw(source, info)))
+                    self.assertEqual(copy.read(copied), DATA)
+
+    def test_renames_and_restamps(self):
+        output = self.transfer(REPRODUCIBLE_DATE_TIME, {"deflated.txt": "Lib/deflated.txt"})
+        with zipfile.ZipFile(output) as copy:
+            self.assertEqual(copy.namelist(), ["Lib/deflated.txt", "stored.txt"])
+            self.assertEqual(set(info.date_time for info in copy.infolist()), set([REPRODUCIBLE_DATE_TIME]))
+            self.assertEqual(copy.read("Lib/deflated.txt"), DATA)
+
+
+class SinglejarRawCopyTest(SinglejarTestCase):
+
+    def test_jar_entries_are_not_recompressed(self):
+        jar_path = self.path("dep-1.0.jar")
+        with zipfile.ZipFile(jar_path, "w") as jar:
+            jar.writestr(zipfile.ZipInfo("org/dep/Dep.class", (2001, 2, 3, 4, 5, 6)), DATA, zipfile.ZIP_DEFLATED)
+            jar.writestr(zipfile.ZipInfo("org/dep/data.bin", (2001, 2, 3, 4, 5, 6)), DATA, zipfile.ZIP_STORED)
+        output = self.path("single.jar")
+        create_singlejar(output, [jar_path], None)
+        with zipfile.ZipFile(jar_path) as jar:
+            with zipfile.ZipFile(output) as single:
+                for info in jar.infolist():
+                    copied = single.getinfo(info.filename)
+                    for field in ("compress_type", "CRC", "compress_size", "file_size"):
+                        self.assertEqual(getattr(copied, field), getattr(info, field))
+                    self.assertEqual("".join(read_raw(single, copied)), "".join(read_raw(jar, info)))
+
+
+
+class CompressionPolicyTest(unittest.TestCase):
+
+    def test_parses_rules(self):
+        policy = CompressionPolicy.parse("*.jar=store, *.class=0,,*=9")
+        self.assertEqual(policy.rules, [("*.jar", None), ("*.class", 0), ("*", 9)])
+
+    def test_rejects_invalid_rules(self):
+        for spec in ("*.txt=fast", "*.txt=10", "*.txt=-1", "*.txt", "=9"):
+            self.assertRaises(ValueError, CompressionPolicy.parse, spec)
+
+    def test_first_matching_rule_wins(self):
+        policy = CompressionPolicy.parse("org/*.class=store,*.class=1")
+        self.assertEqual(policy.get("org/example/Foo.class"), (zipfile.ZIP_STORED, DEFAULT_LEVEL))
+        self.assertEqual(policy.get("com/example/Foo.class"), (zipfile.ZIP_DEFLATED, 1))
+        self.assertIsNone(policy.match("Lib/foo.py"))
+        self.assertEqual(policy.get("Lib/foo.py"), (zipfile.ZIP_DEFLATED, DEFAULT_LEVEL))
+
+
+class SinglejarCompressionTest(SinglejarTestCase):
+
+    def test_compresses_each_entry_by_policy(self):
+        jar_path = self.path("dep-1.0.jar")
+        with zipfile.ZipFile(jar_path, "w") as jar:
+            jar.writestr("org/dep/Dep.class", DATA, zipfile.ZIP_DEFLATED)
+            jar.writestr("org/dep/data.bin", DATA, zipfile.ZIP_STORED)
+            jar.writestr("org/dep/other.txt", DATA, zipfile.ZIP_DEFLATED)
+        self.add_lib_file("Lib/stored.py", DATA)
+        self.add_lib_file("Lib/deflated.txt", DATA)
+        output = self.path("single.jar")
+        policy = CompressionPolicy.parse("*.class=store,*.py=store,*.bin=9")
+        create_singlejar(output, [jar_path], None, compression=policy)
+        with zipfile.ZipFile(output) as single:
+            self.assertIsNone(single.testzip())
+            types = dict((info.filename, info.compress_type) for info in single.infolist())
+            self.assertEqual(types["org/dep/Dep.class"], zipfile.ZIP_STORED)
+            self.assertEqual(types["org/dep/data.bin"], zipfile.ZIP_DEFLATED)
+            self.assertEqual(types["org/dep/other.txt"], zipfile.ZIP_DEFLATED)  # unmatched, so left as is
+            self.assertEqual(types["Lib/stored.py"], zipfile.ZIP_STORED)
+            self.assertEqual(types["Lib/deflated.txt"], zipfile.ZIP_DEFLATED)
+            for name in ("org/dep/Dep.class", "org/dep/data.bin", "Lib/stored.py"):
+                self.assertEqual(single.read(name), DATA)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import sys
+import threading
+import unittest
+import zipfile
+
+from clamp.build import JarBuilder, import_modules, register_builder
+from clamp.watch import in_packages
+
+from helpers import TempDirTestCase, write_file
+
+CLAMPED_SOURCE = """\
+from java.lang import Object
+from clamp.declarative import clamp_class
+{wait}
+
+@clamp_class("org")
+class {name}(Object):
+    pass
+"""
+
+
+class ConcurrentBuildsTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        suffix = abs(hash(self.root))
+        self.sync = "concurrent_sync_{}".format(suffix)
+        self.first = "concurrent_first_{}".format(suffix)
+        self.second = "concurrent_second_{}".format(suffix)
+        write_file(self.path("src", self.sync + ".py"), "import threading\nregistered = threading.Event()\n")
+        # The first module's classes are made only once the second build has registered its builder
+        wait = "from {} import registered\nregistered.wait(10)\n".format(self.sync)
+        write_file(self.path("src", self.first, "__init__.py"), CLAMPED_SOURCE.format(wait=wait, name="First"))
+        write_file(self.path("src", self.second, "__init__.py"), CLAMPED_SOURCE.format(wait="", name="Second"))
+        sys.path.insert(0, self.path("src"))
+
+    def tearDown(self):
+        sys.path.remove(self.path("src"))
+        for module in [module for module in sys.modules if in_packages(module, [self.sync, self.first, self.second])]:
+            del sys.modules[module]
+        TempDirTestCase.tearDown(self)
+
+    def test_each_build_writes_its_own_proxies(self):
+        registered = __import__(self.sync).registered
+        errors = []
+
+        def build_first():
+            try:
+                with JarBuilder(output_path=self.path("first.jar")) as builder:
+                    import_modules(builder, [self.first])
+            except Exception, e:
+                errors.append(e)
+
+        def build_second():
+            try:
+                with JarBuilder(output_path=self.path("second.jar")) as builder:
+                    with register_builder(builder):
+                        registered.set()
+                        import_modules(builder, [self.second])
+            except Exception, e:
+                errors.append(e)
+            finally:
+                registered.set()
+
+        threads = [threading.Thread(target=build_first), threading.Thread(target=build_second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(errors, [])
+
+        def classes(jar_name):
+            with zipfile.ZipFile(self.path(jar_name)) as jar:
+                return [name for name in jar.namelist() if name.endswith(".class")]
+
+        self.assertEqual(classes("first.jar"), ["org/{}/First.class".format(self.first)])
+        self.assertEqual(classes("second.jar"), ["org/{}/Second.class".format(self.second)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+from clamp.archive import ConflictPolicy, DuplicateEntryError, EntryIndex
+from clamp.build import create_singlejar
+
+from helpers import SinglejarTestCase, read_entries, write_jar
+
+
+class ConflictPolicyTest(unittest.TestCase):
+
+    def test_parse(self):
+        policy = ConflictPolicy.parse("*.properties=last,org/example/*=error")
+        self.assertEqual(policy.get("app.properties"), "last")
+        self.assertEqual(policy.get("org/example/A.class"), "error")
+        self.assertEqual(policy.get("org/other/A.class"), "first")
+        self.assertEqual(policy.get("META-INF/services/javax.script.ScriptEngineFactory"), "merge")
+
+    def test_parse_rejects_unknown_policy(self):
+        self.assertRaises(ValueError, ConflictPolicy.parse, "*.properties=newest")
+
+    def test_directories_and_manifest_keep_first(self):
+        policy = ConflictPolicy.parse("*=error")
+        self.assertEqual(policy.get("org/"), "first")
+        self.assertEqual(policy.get("META-INF/MANIFEST.MF"), "first")
+
+
+class EntryIndexTest(unittest.TestCase):
+
+    def test_first(self):
+        index = EntryIndex()
+        self.assertTrue(index.claim("a.txt", "one.jar", (1, 1)))
+        self.assertFalse(index.claim("a.txt", "two.jar", (2, 1)))
+
+    def test_last(self):
+        index = EntryIndex(ConflictPolicy.parse("*.txt=last"))
+        index.scan("one.jar", ["a.txt", "b.txt"])
+        index.scan("two.jar", ["a.txt"])
+        self.assertFalse(index.claim("a.txt", "one.jar", (1, 1)))
+        self.assertTrue(index.claim("b.txt", "one.jar", (1, 1)))
+        self.assertTrue(index.claim("a.txt", "two.jar", (2, 1)))
+
+    def test_error(self):
+        index = EntryIndex(ConflictPolicy.parse("*.txt=error"))
+        self.assertTrue(index.claim("a.txt", "one.jar", (1, 1)))
+        self.assertRaises(DuplicateEntryError, index.claim, "a.txt", "two.jar", (2, 1))
+
+    def test_error_allows_identical_duplicates(self):
+        index = EntryIndex(ConflictPolicy.parse("*.txt=error"))
+        self.assertTrue(index.claim("a.txt", "one.jar", (1, 1)))
+        self.assertFalse(index.claim("a.txt", "two.jar", lambda: (1, 1)))
+
+    def test_merge(self):
+        index = EntryIndex()
+        name = "META-INF/services/org.example.Plugin"
+        self.assertFalse(index.claim(name, "one.jar"))
+        index.merge(name, "org.one.Plugin\norg.shared.Plugin\n")
+        index.merge(name, "org.shared.Plugin\r\n\norg.two.Plugin")
+        self.assertEqual(list(index.merged_entries()),
+                         [(name, "org.one.Plugin\norg.shared.Plugin\norg.two.Plugin\n")])
+
+
+class ServicesSinglejarTest(SinglejarTestCase):
+
+    def test_merges_services(self):
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [("org/python/core/Py.class", "class")])
+        self.jython_jars.append(jython_jar)
+        name = "META-INF/services/org.example.Plugin"
+        one = self.path("one.jar")
+        write_jar(one, [(name, "org.one.Plugin\n"), ("a.txt", "one")])
+        two = self.path("two.jar")
+        write_jar(two, [(name, "org.two.Plugin\n"), ("a.txt", "two")])
+        output = self.path("single.jar")
+
+        create_singlejar(output, [one, two], None)
+
+        entries = read_entries(output)
+        self.assertEqual([data for entry, data in entries if entry == name], ["org.one.Plugin\norg.two.Plugin\n"])
+        self.assertEqual([data for entry, data in entries if entry == "a.txt"], ["one"])
+
+
+if __name__ == "__main__":
+    unittest.main()
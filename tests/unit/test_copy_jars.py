@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from clamp.build import create_singlejar
+from clamp.report import BuildReport
+
+from helpers import SinglejarTestCase, read_entries, write_jar
+
+
+class CopyJarsTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        self.dep_jar = self.path("dep-1.0.jar")
+        write_jar(self.dep_jar, [("org/dep/Dep.class", "dep")])
+        self.output = self.path("single.jar")
+
+    def copied_jars(self, classpath):
+        report = BuildReport("singlejar")
+        create_singlejar(self.output, classpath, None, report=report)
+        return [record["path"] for record in report.sections["jars"]]
+
+    def test_skips_other_files(self):
+        other = self.path("classes.zip")
+        write_jar(other, [("org/other/Other.class", "other")])
+        self.assertEqual(self.copied_jars([other, self.dep_jar]), [os.path.realpath(self.dep_jar)])
+        names = [name for name, data in read_entries(self.output)]
+        self.assertIn("org/dep/Dep.class", names)
+        self.assertNotIn("org/other/Other.class", names)
+
+    def test_copies_each_jar_once(self):
+        classpath = [self.dep_jar, self.path(".", "dep-1.0.jar"), self.dep_jar]
+        if hasattr(os, "symlink"):
+            os.symlink(self.dep_jar, self.path("linked.jar"))
+            classpath.append(self.path("linked.jar"))
+        self.assertEqual(self.copied_jars(classpath), [os.path.realpath(self.dep_jar)])
+        names = [name for name, data in read_entries(self.output)]
+        self.assertEqual(names.count("org/dep/Dep.class"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
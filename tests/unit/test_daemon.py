@@ -0,0 +1,97 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+from clamp.daemon import BuildDaemon, DaemonUnavailable, isolated, submit
+
+from helpers import TempDirTestCase
+
+
+class FakeConnection(object):
+
+    def __init__(self, request):
+        self.request = request
+        self.sent = []
+
+    def makefile(self, mode):
+        return StringIO(json.dumps(self.request) + "\n")
+
+    def sendall(self, data):
+        self.sent.extend(json.loads(line) for line in data.splitlines())
+
+
+class IsolatedTest(TempDirTestCase):
+
+    def test_prepends_client_path(self):
+        path = list(sys.path)
+        client_path = [self.path("src"), path[-1]]
+        with isolated(self.root, 1, client_path):
+            self.assertEqual(sys.path[:2], client_path)
+            self.assertEqual(sys.path.count(path[-1]), 1)
+            self.assertEqual(os.path.realpath(os.getcwd()), os.path.realpath(self.root))
+        self.assertEqual(sys.path, path)
+
+    def test_applies_client_environment(self):
+        self.addCleanup(os.environ.pop, "SOURCE_DATE_EPOCH", None)
+        os.environ["SOURCE_DATE_EPOCH"] = "1"
+        cache_dir = os.environ["CLAMP_CACHE_DIR"]
+        with isolated(self.root, 1, (), {"CLAMP_CACHE_DIR": self.path("client-cache")}):
+            self.assertNotIn("SOURCE_DATE_EPOCH", os.environ)
+            self.assertEqual(os.environ["CLAMP_CACHE_DIR"], self.path("client-cache"))
+        self.assertEqual(os.environ["SOURCE_DATE_EPOCH"], "1")
+        self.assertEqual(os.environ["CLAMP_CACHE_DIR"], cache_dir)
+
+
+class BuildDaemonTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.daemon = BuildDaemon(path=self.path("daemon.json"))
+
+    def test_refuses_other_prefix(self):
+        conn = FakeConnection({"token": self.daemon.token, "job": {"command": "build_jar"},
+                               "cwd": self.root, "path": [], "prefix": self.path("other-jython")})
+        self.daemon.handle(conn)
+        self.assertEqual([message["status"] for message in conn.sent], ["unavailable"])
+
+    def test_refuses_invalid_token(self):
+        conn = FakeConnection({"token": "wrong", "job": {"command": "ping"}, "prefix": sys.prefix})
+        self.daemon.handle(conn)
+        self.assertEqual(conn.sent, [{"status": "error", "error": "Invalid token"}])
+
+    def test_refuses_malformed_requests(self):
+        for request in ([self.daemon.token], {"token": self.daemon.token, "job": ["ping"]}):
+            conn = FakeConnection(request)
+            self.daemon.handle(conn)
+            self.assertEqual(conn.sent, [{"status": "error", "error": "Malformed request"}])
+
+    def test_survives_failed_requests(self):
+        handle = self.daemon.handle
+        failed = []
+
+        def failing_handle(conn):
+            if not failed:
+                failed.append(conn)
+                raise socket.error("Broken pipe")
+            return handle(conn)
+
+        self.daemon.handle = failing_handle
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.daemon = True
+        thread.start()
+        deadline = time.time() + 10
+        while not os.path.exists(self.daemon.path) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertRaises(DaemonUnavailable, submit, {"command": "ping"}, path=self.daemon.path)
+        self.assertIsNone(submit({"command": "stop"}, path=self.daemon.path))
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
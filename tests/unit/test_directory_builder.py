@@ -0,0 +1,70 @@
+import os
+import unittest
+
+from clamp.build import OUTPUTS_NAME, DirectoryBuilder, build_jar
+
+from helpers import TempDirTestCase, write_file
+
+
+class FakeBytes(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def toByteArray(self):
+        return self
+
+    def tostring(self):
+        return self.data
+
+
+class DirectoryBuilderTest(TempDirTestCase):
+
+    def build(self, classes, keep=()):
+        with DirectoryBuilder(self.path("classes"), keep=keep) as builder:
+            for classname, data in classes:
+                builder.write_class_bytes("org", classname, FakeBytes(data))
+        return builder
+
+    def test_removes_only_stale_outputs(self):
+        self.build([("org.sample.A", "a"), ("org.sample.old.B", "b")])
+        write_file(self.path("classes", "org", "sample", "Handwritten.class"), "h")
+        write_file(self.path("classes", "META-INF", "services", "x"), "x")
+
+        self.build([("org.sample.A", "a2")])
+        self.assertFalse(os.path.exists(self.path("classes", "org", "sample", "old")))
+        self.assertTrue(os.path.exists(self.path("classes", "org", "sample", "Handwritten.class")))
+        self.assertTrue(os.path.exists(self.path("classes", "META-INF", "services", "x")))
+        with open(self.path("classes", OUTPUTS_NAME)) as f:
+            self.assertEqual(f.read(), "org/sample/A.class\n")
+
+    def test_keeps_listed_outputs(self):
+        self.build([("org.sample.A", "a"), ("org.sample.B", "b")])
+        self.build([("org.sample.A", "a")], keep=["org/sample/B.class"])
+        self.assertTrue(os.path.exists(self.path("classes", "org", "sample", "B.class")))
+        with open(self.path("classes", OUTPUTS_NAME)) as f:
+            self.assertEqual(f.read().split(), ["org/sample/A.class", "org/sample/B.class"])
+
+
+class BuildJarTest(TempDirTestCase):
+
+    def test_directory_mode_is_explicit(self):
+        class Setup(object):
+            modules = []
+        jar = build_jar("sample", "sample-1.0.jar", Setup(), self.path("sample"))
+        self.assertFalse(isinstance(jar, DirectoryBuilder))
+        self.assertTrue(os.path.isfile(self.path("sample")))
+        classes = build_jar("sample", "sample-1.0.jar", Setup(), self.path("classes") + os.sep)
+        self.assertTrue(isinstance(classes, DirectoryBuilder))
+        self.assertTrue(os.path.isdir(self.path("classes")))
+
+    def test_without_proxy_cache(self):
+        class Setup(object):
+            modules = []
+        self.assertIsNotNone(build_jar("sample", "sample-1.0.jar", Setup(), self.path("cached.jar")).proxy_cache)
+        self.assertIsNone(build_jar("sample", "sample-1.0.jar", Setup(), self.path("uncached.jar"),
+                                    proxy_cache=False).proxy_cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
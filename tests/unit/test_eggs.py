@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from clamp.archive import ArchiveWriter
+from clamp.build import create_singlejar
+
+from helpers import SinglejarTestCase, read_entries, write_file, write_jar
+
+
+class ZippedEggTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [("org/python/core/Py.class", "class")])
+        self.jython_jars.append(jython_jar)
+        write_jar(os.path.join(self.site_packages, "good.egg"), [("good/__init__.py", ""), ("good/mod.py", "")])
+        write_file(os.path.join(self.site_packages, "easy-install.pth"), "./good.egg\n")
+        self.output = self.path("single.jar")
+
+    def test_skips_unreadable_egg(self):
+        write_file(os.path.join(self.site_packages, "broken.egg"), "not a zip")
+        write_file(os.path.join(self.site_packages, "easy-install.pth"), "./broken.egg\n./good.egg\n")
+        create_singlejar(self.output, [], None)
+        names = [name for name, data in read_entries(self.output)]
+        self.assertIn("Lib/good/__init__.py", names)
+        self.assertIn("Lib/good/mod.py", names)
+
+    def test_raises_after_partial_copy(self):
+        write_raw = ArchiveWriter.write_raw
+
+        def failing_write_raw(writer, archive, info, name=None):
+            if name == "Lib/good/mod.py":
+                raise IOError("Disk full")
+            return write_raw(writer, archive, info, name)
+
+        self.patch(ArchiveWriter, "write_raw", failing_write_raw)
+        self.assertRaises(IOError, create_singlejar, self.output, [], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
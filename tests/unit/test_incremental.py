@@ -0,0 +1,44 @@
+import os
+import unittest
+
+from clamp.build import create_singlejar
+
+from helpers import SinglejarTestCase, read_bytes, read_entries, write_file, write_jar
+
+
+class IncrementalSinglejarTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [("org/python/core/Py.class", "class"), ("Lib/os.py", "")])
+        self.jython_jars.append(jython_jar)
+        self.add_lib_file("Lib/stat.py", "")
+        self.dep_jar = self.path("dep.jar")
+        write_jar(self.dep_jar, [("org/dep/Kept.class", "kept"), ("org/dep/Removed.class", "removed")])
+        self.runpy = self.path("__run__.py")
+        write_file(self.runpy, "import os\n")
+        self.output = self.path("single.jar")
+
+    def build(self):
+        create_singlejar(self.output, [self.dep_jar], self.runpy, incremental=True)
+        return read_bytes(self.output)
+
+    def test_unchanged_rebuild_is_identical(self):
+        first = self.build()
+        self.assertEqual(self.build(), first)
+
+    def test_removed_entry_is_dropped(self):
+        self.build()
+        write_jar(self.dep_jar, [("org/dep/Kept.class", "kept")])
+        os.utime(self.dep_jar, (0, 0))  # changed, whatever the resolution of mtimes
+        self.build()
+        entries = dict(read_entries(self.output))
+        self.assertEqual(entries["org/dep/Kept.class"], "kept")
+        self.assertNotIn("org/dep/Removed.class", entries)
+        self.assertIn("Lib/os.py", entries)
+        self.assertIn("Lib/stat.py", entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import threading
+import unittest
+
+from clamp.build import JarPth, read_pth
+
+from helpers import SinglejarTestCase, read_bytes, write_file
+
+
+class JarPthTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        self.jar_pth_path = os.path.join(self.site_packages, "jar.pth")
+
+    def test_concurrent_changes_are_merged(self):
+        with JarPth() as paths:
+            paths["removed"] = "./jars/removed-1.0.jar"
+        # All read jar.pth before any writes it, as concurrent installs may
+        installs = [JarPth() for i in xrange(8)]
+        for i, paths in enumerate(installs):
+            paths["package{}".format(i)] = "./jars/package{}-1.0.jar".format(i)
+        del installs[0]["removed"]
+        threads = [threading.Thread(target=paths.close) for paths in installs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(dict(read_pth(self.jar_pth_path)),
+                         dict(("package{}".format(i), "./jars/package{}-1.0.jar".format(i)) for i in xrange(8)))
+
+    def test_replaced_atomically(self):
+        with JarPth() as paths:
+            paths["first"] = "./jars/first-1.0.jar"
+        previous = read_bytes(self.jar_pth_path)
+        renames = []
+        rename = os.rename
+
+        def checked_rename(src, dst):
+            if dst == self.jar_pth_path:
+                self.assertEqual(os.path.dirname(src), self.site_packages)
+                self.assertEqual(read_bytes(dst), previous)  # still whole until replaced
+                renames.append(read_bytes(src))
+            rename(src, dst)
+
+        self.patch(os, "rename", checked_rename)
+        with JarPth() as paths:
+            paths["second"] = "./jars/second-1.0.jar"
+        self.assertEqual(renames, [read_bytes(self.jar_pth_path)])
+        self.assertEqual(sorted(name for name in os.listdir(self.site_packages) if name.startswith("jar.pth")),
+                         ["jar.pth", "jar.pth.lock"])  # no temporary files left
+
+    def test_keeps_entries_written_since_read(self):
+        paths = JarPth()
+        write_file(self.jar_pth_path, "./jars/other-2.0.jar\n")
+        paths["mine"] = "./jars/mine-1.0.jar"
+        paths.close()
+        self.assertEqual(sorted(read_pth(self.jar_pth_path).values()), ["./jars/mine-1.0.jar", "./jars/other-2.0.jar"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import errno
+import os
+import unittest
+
+from clamp.build import copy_included_jars, jar_store_dir, read_pth
+
+from helpers import SinglejarTestCase, read_bytes, write_jar
+
+
+class JarStoreTest(SinglejarTestCase):
+
+    def write_package(self, src_dir, version):
+        path = os.path.join(src_dir, "sample", "lib", "dep.jar")
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        write_jar(path, [("org/dep/Version.class", version)])
+        return path
+
+    def stored_jars(self):
+        return sorted(filename for dirpath, dirs, files in os.walk(jar_store_dir())
+                      for filename in files if filename.endswith(".jar"))
+
+    def install(self, src_dir, package_name):
+        return copy_included_jars(package_name, ["sample"], src_dir)
+
+    @unittest.skipUnless(hasattr(os, "link"), "needs hardlinks")
+    def test_packages_share_a_stored_jar(self):
+        self.write_package(self.path("one"), "1")
+        self.write_package(self.path("two"), "1")
+        one, = self.install(self.path("one"), "one")
+        two, = self.install(self.path("two"), "two")
+        self.assertTrue(os.path.samefile(one, two))
+        self.assertEqual(len(self.stored_jars()), 1)
+
+    @unittest.skipUnless(hasattr(os, "link"), "needs hardlinks")
+    def test_replaced_jars_are_pruned(self):
+        self.write_package(self.path("one"), "1")
+        self.install(self.path("one"), "one")
+        old = self.stored_jars()
+        self.write_package(self.path("one"), "2")
+        installed, = self.install(self.path("one"), "one")
+        stored = self.stored_jars()
+        self.assertEqual(len(stored), 1)
+        self.assertNotEqual(stored, old)
+        self.assertEqual(read_bytes(installed), read_bytes(self.path("one", "sample", "lib", "dep.jar")))
+
+    def test_copies_when_links_fail(self):
+        def cross_device_link(src, dst):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        self.patch(os, "link", cross_device_link)
+        source = self.write_package(self.path("one"), "1")
+        installed, = self.install(self.path("one"), "one")
+        self.assertEqual(read_bytes(installed), read_bytes(source))
+        self.assertEqual(self.stored_jars(), [])  # a copy does not keep the stored jar in use
+
+    def registered(self):
+        return sorted(read_pth(os.path.join(self.site_packages, "jar.pth")).values())
+
+    def test_registers_jars_without_a_dash(self):
+        self.write_package(self.path("one"), "1")
+        write_jar(self.path("one", "sample", "lib", "other.jar"), [("org/other/Other.class", "")])
+        self.install(self.path("one"), "one")
+        self.assertEqual(self.registered(), [os.path.join(".", "one", "sample", "lib", "dep.jar"),
+                                             os.path.join(".", "one", "sample", "lib", "other.jar")])
+
+    def test_unregisters_jars_no_longer_included(self):
+        self.write_package(self.path("one"), "1")
+        write_jar(self.path("one", "sample", "lib", "other-1.0.jar"), [("org/other/Other.class", "")])
+        self.install(self.path("one"), "one")
+        os.remove(self.path("one", "sample", "lib", "other-1.0.jar"))
+        write_jar(self.path("one", "sample", "lib", "other-2.0.jar"), [("org/other/Other.class", "2")])
+        self.install(self.path("one"), "one")
+        self.assertEqual(self.registered(), [os.path.join(".", "one", "sample", "lib", "dep.jar"),
+                                             os.path.join(".", "one", "sample", "lib", "other-2.0.jar")])
+
+
+if __name__ == "__main__":
+    unittest.main()
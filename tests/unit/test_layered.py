@@ -0,0 +1,75 @@
+import os
+import unittest
+
+from clamp.build import LAYER_MARKER, LAYERS_SITECUSTOMIZE, create_layered_jars
+
+from helpers import SinglejarTestCase, read_entries, read_manifest, write_file, write_jar
+
+
+class LayeredJarsTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [("org/python/core/Py.class", "py")])
+        self.jython_jars.append(jython_jar)
+        self.add_lib_file("Lib/os.py", "os")
+        self.classpath_jar = self.path("lib-1.0.jar")
+        write_jar(self.classpath_jar, [("org/lib/Lib.class", "lib")])
+        for dir_name in ("jars", "app"):
+            os.makedirs(os.path.join(self.site_packages, dir_name))
+        write_jar(os.path.join(self.site_packages, "jars", "app-1.0.jar"), [("org/app/App.class", "app")])
+        write_jar(os.path.join(self.site_packages, "app", "dep-2.0.jar"), [("org/dep/Dep.class", "dep")])
+        write_file(os.path.join(self.site_packages, "jar.pth"), "./app/dep-2.0.jar\n./jars/app-1.0.jar\n")
+        write_jar(os.path.join(self.site_packages, "egg-1.0.egg"), [("egg/__init__.py", "egg")])
+        write_file(os.path.join(self.site_packages, "easy-install.pth"), "./egg-1.0.egg\n")
+        write_file(os.path.join(self.site_packages, "app", "__init__.py"), "app")
+        self.runpy = self.path("__run__.py")
+        write_file(self.runpy, "run")
+        self.output = self.path("app.jar")
+        self.paths = create_layered_jars(self.output, [self.classpath_jar], self.runpy)
+
+    def entries(self, path):
+        return dict(read_entries(path))
+
+    def test_writes_three_layers(self):
+        self.assertEqual(self.paths, [self.path("app-runtime.jar"), self.path("app-deps.jar"), self.output])
+
+        runtime = self.entries(self.path("app-runtime.jar"))
+        self.assertIn("org/python/core/Py.class", runtime)
+        self.assertEqual(runtime["Lib/os.py"], "os")
+        self.assertEqual(runtime["Lib/sitecustomize.py"], LAYERS_SITECUSTOMIZE)
+        self.assertNotIn(LAYER_MARKER, runtime)
+
+        deps = self.entries(self.path("app-deps.jar"))
+        for name in ("org/lib/Lib.class", "org/dep/Dep.class", "Lib/egg/__init__.py"):
+            self.assertIn(name, deps)
+        self.assertEqual(deps[LAYER_MARKER], "deps\n")
+
+        app = self.entries(self.output)
+        for name in ("org/app/App.class", "Lib/app/__init__.py", "__run__.py"):
+            self.assertIn(name, app)
+        self.assertEqual(app[LAYER_MARKER], "app\n")
+        for name in ("org/python/core/Py.class", "org/lib/Lib.class", "org/dep/Dep.class", "Lib/egg/__init__.py"):
+            self.assertNotIn(name, app)
+
+    def test_app_links_the_other_layers(self):
+        manifest = read_manifest(self.output)
+        self.assertEqual(manifest["Class-Path"], "app-deps.jar app-runtime.jar")
+        self.assertEqual(manifest["Main-Class"], "org.python.util.JarRunner")
+        # The JVM ignores Class-Path in a jar with an index
+        self.assertNotIn("META-INF/INDEX.LIST", self.entries(self.output))
+        for layer in ("runtime", "deps"):
+            path = self.path("app-{}.jar".format(layer))
+            self.assertNotIn("Class-Path", read_manifest(path))
+            self.assertIn(os.path.basename(path), self.entries(path)["META-INF/INDEX.LIST"].splitlines())
+
+    def test_sitecustomize_adds_the_lib_of_each_layer(self):
+        # Every layer but the runtime, whose Lib is already on sys.path, has the marker
+        self.assertIn('getResources("{}")'.format(LAYER_MARKER), LAYERS_SITECUSTOMIZE)
+        self.assertIn('getPath() + "/Lib"', LAYERS_SITECUSTOMIZE)
+        compile(LAYERS_SITECUSTOMIZE, "Lib/sitecustomize.py", "exec")
+
+
+if __name__ == "__main__":
+    unittest.main()
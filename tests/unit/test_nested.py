@@ -0,0 +1,105 @@
+import io
+import os
+import unittest
+import zipfile
+
+from clamp.build import create_singlejar
+from clamp.launcher import (
+    NESTED_DIR, NESTED_LIST_NAME, SITECUSTOMIZE, EntryWindow, NestedJar, NestedJarLoader, open_nested_jars)
+
+from helpers import SinglejarTestCase, TempDirTestCase, read_bytes, read_manifest, write_file, write_jar
+
+
+class EntryWindowTest(unittest.TestCase):
+
+    def test_reads_only_its_range(self):
+        window = EntryWindow(io.BytesIO("0123456789"), 2, 5)
+        self.assertEqual(window.read(), "23456")
+        self.assertEqual(window.read(), "")
+        window.seek(1)
+        self.assertEqual(window.read(2), "34")
+        self.assertEqual(window.tell(), 3)
+        window.seek(-1, 2)
+        self.assertEqual(window.read(10), "6")
+        window.seek(-10, 1)
+        self.assertEqual(window.tell(), 0)
+
+    def test_opens_a_stored_zip(self):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w") as nested:
+            nested.writestr("a.txt", "a")
+        f = io.BytesIO("prefix" + data.getvalue() + "suffix")
+        with zipfile.ZipFile(EntryWindow(f, len("prefix"), len(data.getvalue()))) as nested:
+            self.assertEqual(nested.read("a.txt"), "a")
+
+
+class NestedSinglejarTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [("org/python/core/Py.class", "py")])
+        self.jython_jars.append(jython_jar)
+        os.makedirs(self.path("one"))
+        os.makedirs(self.path("two"))
+        self.dep_jars = [self.path("one", "dep.jar"), self.path("two", "dep.jar")]
+        write_jar(self.dep_jars[0], [("org/one/One.class", "one"), ("one.properties", "one")])
+        write_jar(self.dep_jars[1], [("org/two/Two.class", "two")])
+        for dir_name in ("jars", "app"):
+            os.makedirs(os.path.join(self.site_packages, dir_name))
+        write_jar(os.path.join(self.site_packages, "jars", "app-1.0.jar"), [("org/app/App.class", "app")])
+        self.included_jar = os.path.join(self.site_packages, "app", "included-2.0.jar")
+        write_jar(self.included_jar, [("org/included/Included.class", "included")])
+        write_file(os.path.join(self.site_packages, "jar.pth"), "./app/included-2.0.jar\n./jars/app-1.0.jar\n")
+        self.output = self.path("single.jar")
+        create_singlejar(self.output, self.dep_jars, None, nested=True)
+
+    def test_nests_dependency_jars_intact(self):
+        names = ["dep.jar", "dep-2.jar", "included-2.0.jar"]
+        with zipfile.ZipFile(self.output) as single:
+            self.assertEqual(single.read(NESTED_LIST_NAME).splitlines(), names)
+            for name, path in zip(names, self.dep_jars + [self.included_jar]):
+                info = single.getinfo(NESTED_DIR + name)
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(single.read(info), read_bytes(path))
+            self.assertEqual(single.read("Lib/sitecustomize.py"), SITECUSTOMIZE)
+            flat = single.namelist()
+        # Jython and the clamped jars are copied, as loading the nested jars needs them
+        self.assertIn("org/python/core/Py.class", flat)
+        self.assertIn("org/app/App.class", flat)
+        for name in ("org/one/One.class", "org/two/Two.class", "org/included/Included.class"):
+            self.assertNotIn(name, flat)
+        self.assertEqual(read_manifest(self.output)["Main-Class"], "org.python.util.jython")
+
+    def test_reads_nested_jars_in_place(self):
+        one, two, included = open_nested_jars(self.output, ["dep.jar", "dep-2.jar", "included-2.0.jar"])
+        self.assertEqual(one.name, "dep.jar")
+        self.assertIn("org/one/One.class", one)
+        self.assertNotIn("org/two/Two.class", one)
+        self.assertEqual(two.read("org/two/Two.class"), "two")
+        self.assertIsNone(two.read("org/one/One.class"))
+        self.assertEqual(included.read("org/included/Included.class"), "included")
+
+    def test_loader_finds_resources_in_order(self):
+        loader = NestedJarLoader(None, open_nested_jars(self.output, ["dep.jar", "dep-2.jar"]))
+        self.assertEqual(loader.read("dep-2.jar", "org/two/Two.class"), "two")
+        self.assertIsNone(loader.read("missing.jar", "org/two/Two.class"))
+        url = loader.findResource("one.properties")
+        self.assertEqual(url.getFile(), "dep.jar!/one.properties")
+        self.assertIsNone(loader.findResource("missing.properties"))
+
+
+class CompressedNestedJarTest(TempDirTestCase):
+
+    def test_rejects_compressed_jars(self):
+        path = self.path("single.jar")
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as single:
+            single.writestr(NESTED_DIR + "dep.jar", "not stored")
+        with open(path, "rb") as f:
+            with zipfile.ZipFile(path) as single:
+                info = single.getinfo(NESTED_DIR + "dep.jar")
+            self.assertRaises(ValueError, NestedJar, f, None, info)
+
+
+if __name__ == "__main__":
+    unittest.main()
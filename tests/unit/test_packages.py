@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+
+from org.python.core import SyspathArchive
+
+from clamp.packages import LOAD_SITE_CACHE, SITE_LOADER_MODULE, install_site_loader, update_site_cache
+from clamp.sitecache import load_site_cache
+
+from helpers import TempDirTestCase, write_jar
+
+
+class SiteCacheTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.jar_path = self.path("jars", "cached-1.0.jar")
+        os.makedirs(self.path("jars"))
+        write_jar(self.jar_path, [("org/cached/Sample.class", "not read")])
+        self.old_path = list(sys.path)
+        sys.path.append(self.jar_path)
+
+    def tearDown(self):
+        sys.path[:] = self.old_path
+        sys.modules.pop(SITE_LOADER_MODULE, None)
+        TempDirTestCase.tearDown(self)
+
+    def test_cached_jars_are_not_scanned(self):
+        update_site_cache(self.root, ["./jars/cached-1.0.jar"])
+        load_site_cache(self.root)
+        self.assertIsInstance(sys.path[-1], SyspathArchive)
+        self.assertEqual(str(sys.path[-1]), self.jar_path)
+
+    def test_changed_jars_are_left_to_jython(self):
+        update_site_cache(self.root, ["./jars/cached-1.0.jar"])
+        write_jar(self.jar_path, [("org/cached/Sample.class", "changed"), ("org/cached/Other.class", "")])
+        load_site_cache(self.root)
+        self.assertNotIsInstance(sys.path[-1], SyspathArchive)
+
+    def test_load_line_imports_only_the_installed_loader(self):
+        update_site_cache(self.root, ["./jars/cached-1.0.jar"])
+        install_site_loader(self.root)
+        sys.path.insert(0, self.root)
+        clamp_modules = dict((name, module) for name, module in sys.modules.iteritems() if name.startswith("clamp"))
+        for name in clamp_modules:
+            del sys.modules[name]
+        try:
+            exec LOAD_SITE_CACHE in {}
+            self.assertEqual([name for name in sys.modules if name.startswith("clamp")], [SITE_LOADER_MODULE])
+        finally:
+            sys.modules.update(clamp_modules)
+        self.assertIsInstance(sys.path[-1], SyspathArchive)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import random
+import threading
+import time
+import unittest
+
+from clamp.parallel import WorkerPool, imap_ordered
+
+
+def slow_square(n):
+    time.sleep(random.random() * 0.005)  # so results complete out of order
+    return n * n
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_runs_on_the_calling_thread_with_one_worker(self):
+        pool = WorkerPool(1)
+        self.assertEqual(pool.submit(threading.current_thread).get(), threading.current_thread())
+        pool.close()
+
+    def test_runs_on_workers(self):
+        pool = WorkerPool(3)
+        try:
+            results = [pool.submit(lambda: threading.current_thread().name) for i in xrange(30)]
+            names = set(result.get() for result in results)
+        finally:
+            pool.close()
+        self.assertTrue(names)
+        self.assertTrue(all(name.startswith("clamp-worker-") for name in names))
+
+    def test_get_raises_the_error_of_the_call(self):
+        pool = WorkerPool(2)
+        try:
+            result = pool.submit(int, "not a number")
+            self.assertRaises(ValueError, result.get)
+            self.assertEqual(pool.submit(int, "42").get(), 42)  # the worker survives
+        finally:
+            pool.close()
+
+
+class ImapOrderedTest(unittest.TestCase):
+
+    def test_yields_in_input_order(self):
+        for workers in (1, 4):
+            self.assertEqual(list(imap_ordered(slow_square, xrange(100), workers)), [n * n for n in xrange(100)])
+
+    def test_bounds_pending_results(self):
+        consumed = []
+        started = []
+
+        def record(n):
+            started.append(n)
+            return n
+
+        for n in imap_ordered(record, xrange(50), 2, window=4):
+            consumed.append(n)
+            self.assertLessEqual(len(started), len(consumed) + 4)
+        self.assertEqual(consumed, range(50))
+
+    def test_raises_the_first_error_in_order(self):
+        def fail_on_odd(n):
+            if n % 2:
+                raise ValueError(n)
+            return n
+
+        for workers in (1, 4):
+            results = imap_ordered(fail_on_odd, xrange(10), workers)
+            self.assertEqual(next(results), 0)
+            try:
+                next(results)
+            except ValueError, e:
+                self.assertEqual(e.args, (1,))
+            else:
+                self.fail("Expected ValueError")
+            finally:
+                results.close()  # closing its pool
+
+
+if __name__ == "__main__":
+    unittest.main()
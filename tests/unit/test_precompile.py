@@ -0,0 +1,126 @@
+import os
+import threading
+import unittest
+
+from clamp.build import create_singlejar
+from clamp.precompile import Precompiler, compiled_name, module_name
+
+from helpers import SinglejarTestCase, TempDirTestCase, read_entries, write_file, write_jar
+
+
+class RecordingPrecompiler(Precompiler):
+    """Compiles a source to a stand-in $py.class, recording each source compiled"""
+
+    def __init__(self, mode="add"):
+        Precompiler.__init__(self, mode)
+        self.compiled = []
+        self.lock = threading.Lock()
+
+    def compile(self, relpath, source, millis):
+        with self.lock:
+            self.compiled.append((relpath, source))
+        return "compiled " + source
+
+
+class PrecompilerTest(TempDirTestCase):
+
+    def test_module_names(self):
+        self.assertEqual(module_name("Lib/foo.py"), "foo")
+        self.assertEqual(module_name("Lib/foo/bar.py"), "foo.bar")
+        self.assertEqual(module_name("Lib/foo/__init__.py"), "foo")
+        self.assertIsNone(module_name("foo.py"))
+        self.assertIsNone(module_name("Lib/foo.txt"))
+        self.assertEqual(compiled_name("Lib/foo/bar.py"), "Lib/foo/bar$py.class")
+
+    def test_rejects_unknown_modes(self):
+        self.assertRaises(ValueError, Precompiler, "always")
+        self.assertTrue(Precompiler("add").keep_source)
+        self.assertFalse(Precompiler("replace").keep_source)
+
+    def test_caches_compiled_modules(self):
+        precompiler = Precompiler()
+        compiled = precompiler.compile("Lib/cached.py", "x = 1\n", 1000000000000)
+        self.assertTrue(compiled)
+        self.assertEqual(sum(len(files) for dirpath, dirs, files in os.walk(precompiler.cache.path)), 1)
+        self.assertEqual(Precompiler().compile("Lib/cached.py", "x = 1\n", 1000000000000), compiled)
+        self.assertIsNone(precompiler.compile("Lib/cached.txt", "x = 1\n", 1000000000000))
+
+
+class FilePrecompileTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        self.add_lib_file("Lib/mod.py", "mod")
+        self.add_lib_file("Lib/pkg/__init__.py", "init")
+        self.add_lib_file("Lib/pkg/data.txt", "data")
+        self.output = self.path("single.jar")
+
+    def build(self, mode, workers=1):
+        create_singlejar(self.output, [], None, workers=workers, precompiler=RecordingPrecompiler(mode))
+        return dict(read_entries(self.output))
+
+    def test_add_keeps_sources(self):
+        for workers in (1, 4):
+            entries = self.build("add", workers)
+            self.assertEqual(entries["Lib/mod.py"], "mod")
+            self.assertEqual(entries["Lib/mod$py.class"], "compiled mod")
+            self.assertEqual(entries["Lib/pkg/__init__$py.class"], "compiled init")
+            self.assertEqual(entries["Lib/pkg/data.txt"], "data")
+            self.assertNotIn("Lib/pkg/data$py.class", entries)
+
+    def test_replace_drops_sources(self):
+        for workers in (1, 4):
+            entries = self.build("replace", workers)
+            self.assertNotIn("Lib/mod.py", entries)
+            self.assertNotIn("Lib/pkg/__init__.py", entries)
+            self.assertEqual(entries["Lib/mod$py.class"], "compiled mod")
+            self.assertEqual(entries["Lib/pkg/data.txt"], "data")
+
+    def test_stale_compiled_modules_are_regenerated(self):
+        self.add_lib_file("Lib/mod$py.class", "stale")
+        self.add_lib_file("Lib/orphan$py.class", "orphan")
+        entries = self.build("add")
+        self.assertEqual(entries["Lib/mod$py.class"], "compiled mod")
+        self.assertEqual(entries["Lib/orphan$py.class"], "orphan")  # without a source, kept as is
+
+
+class ArchivePrecompileTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        write_jar(os.path.join(self.site_packages, "good.egg"),
+                  [("good/__init__.py", "init"), ("good/mod.py", "mod"), ("good/data.txt", "data")])
+        write_jar(os.path.join(self.site_packages, "shadowed.egg"), [("good/mod.py", "shadowed")])
+        write_file(os.path.join(self.site_packages, "easy-install.pth"), "./good.egg\n./shadowed.egg\n")
+        self.output = self.path("single.jar")
+
+    def build(self, workers=1, mode="add", incremental=False):
+        precompiler = RecordingPrecompiler(mode)
+        create_singlejar(self.output, [], None, incremental, workers=workers, precompiler=precompiler)
+        return precompiler, read_entries(self.output)
+
+    def test_compiles_only_claimed_sources(self):
+        precompiler, entries = self.build(1)
+        self.assertEqual(sorted(precompiler.compiled), [("Lib/good/__init__.py", "init"), ("Lib/good/mod.py", "mod")])
+        entries = dict(entries)
+        self.assertEqual(entries["Lib/good/mod.py"], "mod")
+        self.assertEqual(entries["Lib/good/mod$py.class"], "compiled mod")
+        self.assertEqual(entries["Lib/good/data.txt"], "data")
+
+    def test_workers_write_the_same_entries(self):
+        precompiler, serial = self.build(1)
+        os.remove(self.output)
+        precompiler, parallel = self.build(4)
+        self.assertEqual([name for name, data in parallel], [name for name, data in serial])
+        self.assertEqual(parallel, serial)
+
+    def test_replaced_sources_are_carried_over(self):
+        precompiler, first = self.build(mode="replace", incremental=True)
+        self.assertNotIn("Lib/good/mod.py", dict(first))
+        precompiler, second = self.build(mode="replace", incremental=True)
+        self.assertEqual(precompiler.compiled, [])
+        self.assertEqual(second, first)
+
+
+if __name__ == "__main__":
+    unittest.main()
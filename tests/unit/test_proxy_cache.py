@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+import unittest
+import zipfile
+
+from clamp.commands import run_job
+from clamp.watch import in_packages
+
+from helpers import TempDirTestCase, write_file
+
+CLAMPED_SOURCE = """\
+from java.lang import Object
+from clamp.declarative import clamp_class
+
+
+@clamp_class("org")
+class Cached(Object):
+{body}
+"""
+
+
+class ProxyCacheTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.package = "proxy_cache_sample_{}".format(abs(hash(self.root)))
+        self.write_module("    pass\n")
+        sys.path.insert(0, self.path("src"))
+        self.class_name = "org/{}/Cached.class".format(self.package)
+
+    def tearDown(self):
+        sys.path.remove(self.path("src"))
+        self.unload()
+        TempDirTestCase.tearDown(self)
+
+    def write_module(self, body):
+        write_file(self.path("src", self.package, "__init__.py"), CLAMPED_SOURCE.format(body=body))
+
+    def unload(self):
+        for module in [module for module in sys.modules if in_packages(module, [self.package])]:
+            del sys.modules[module]
+
+    def build(self, name, proxy_cache=True):
+        """Builds the jar `name` in a fresh import of the module, returning (whether its class was cached, bytes)"""
+        self.unload()
+        output = self.path(name)
+        report = self.path(name + ".json")
+        run_job({
+            "command": "build_jar",
+            "package_name": self.package,
+            "jar_name": name,
+            "modules": [self.package],
+            "output": output,
+            "compression": None,
+            "workers": 1,
+            "report": report,
+            "proxy_cache": proxy_cache,
+        })
+        with open(report) as f:
+            classes = json.load(f)["classes"]
+        self.assertEqual([record["name"] for record in classes], ["org.{}.Cached".format(self.package)])
+        with zipfile.ZipFile(output) as jar:
+            return classes[0]["cached"], jar.read(self.class_name)
+
+    def cached_proxies(self):
+        return sum(len(files) for dirpath, dirs, files in os.walk(self.path("cache", "proxies")))
+
+    def test_unchanged_class_is_cached(self):
+        cached, generated = self.build("first.jar")
+        self.assertFalse(cached)
+        self.assertEqual(self.cached_proxies(), 1)
+        cached, from_cache = self.build("second.jar")
+        self.assertTrue(cached)
+        self.assertEqual(from_cache, generated)
+
+    def test_changed_shape_is_generated(self):
+        self.build("first.jar")
+        self.write_module("    def added(self):\n        return 1\n")
+        cached, changed = self.build("second.jar")
+        self.assertFalse(cached)
+        self.assertIn("added", changed)
+        self.assertEqual(self.cached_proxies(), 2)
+
+    def test_no_proxy_cache(self):
+        self.assertFalse(self.build("first.jar", proxy_cache=False)[0])
+        self.assertEqual(self.cached_proxies(), 0)
+        self.build("second.jar")  # cached now, but not read without the cache
+        self.assertFalse(self.build("third.jar", proxy_cache=False)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import sys
+import unittest
+
+from clamp import commands
+from clamp.build import create_singlejar
+from clamp.prune import Pruner
+
+from helpers import SinglejarTestCase, read_entries, write_file, write_jar
+
+
+class PruneSinglejarTest(SinglejarTestCase):
+
+    def test_prunes_modules_in_jars(self):
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [
+            ("org/python/core/Py.class", "class"),
+            ("Lib/os.py", "import posixpath\n"),
+            ("Lib/posixpath.py", "import stat\n"),
+            ("Lib/unused.py", ""),
+        ])
+        self.jython_jars.append(jython_jar)
+        self.add_lib_file("Lib/stat.py", "")
+        self.add_lib_file("Lib/other.py", "")
+        runpy = self.path("__run__.py")
+        write_file(runpy, "import os\n")
+        output = self.path("single.jar")
+
+        create_singlejar(output, [], runpy, pruner=Pruner())
+
+        names = [name for name, data in read_entries(output)]
+        for name in ("org/python/core/Py.class", "Lib/os.py", "Lib/posixpath.py", "Lib/stat.py", "__run__.py"):
+            self.assertIn(name, names)
+        for name in ("Lib/unused.py", "Lib/other.py"):
+            self.assertNotIn(name, names)
+
+
+
+class PruneOptionsTest(unittest.TestCase):
+
+    def test_include_modules_needs_prune(self):
+        def run_build(job, daemon=False, verbose=1):
+            self.fail("Built without --prune")
+
+        self.addCleanup(setattr, commands, "run_build", commands.run_build)
+        commands.run_build = run_build
+        self.addCleanup(setattr, sys, "argv", sys.argv)
+        sys.argv = ["singlejar", "--include-modules", "myapp.plugins.*"]
+        with self.assertRaises(SystemExit) as raised:
+            commands.singlejar_script_command()
+        self.assertEqual(raised.exception.code, 2)  # a usage error
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import os
+import unittest
+import zipfile
+
+from collections import OrderedDict
+
+from clamp.build import create_singlejar
+from clamp.report import REPORT_VERSION, BuildReport, NullReport
+
+from helpers import SinglejarTestCase, TempDirTestCase, write_file, write_jar
+
+
+class BuildReportTest(TempDirTestCase):
+
+    def test_timer_records_fields_and_seconds(self):
+        report = BuildReport("build_jar")
+        with report.timer("classes", name="org.Foo") as record:
+            record["bytes"] = 42
+        self.assertEqual(report.sections["classes"], [{"name": "org.Foo", "bytes": 42, "seconds": record["seconds"]}])
+        self.assertGreaterEqual(record["seconds"], 0)
+
+    def test_timer_records_failures(self):
+        report = BuildReport("build_jar")
+        try:
+            with report.timer("modules", name="broken"):
+                raise ImportError("broken")
+        except ImportError:
+            pass
+        self.assertEqual([record["name"] for record in report.sections["modules"]], ["broken"])
+
+    def test_measures_jars_and_directories(self):
+        jar_path = self.path("out.jar")
+        with zipfile.ZipFile(jar_path, "w") as jar:
+            jar.writestr("a.txt", "a" * 100, zipfile.ZIP_DEFLATED)
+            jar.writestr("b.txt", "b" * 10, zipfile.ZIP_STORED)
+        write_file(self.path("classes", "org", "Foo.class"), "x" * 7)
+        report = BuildReport("singlejar")
+        report.measure_output(jar_path)
+        report.measure_output(self.path("classes"), layer="classes")
+        self.assertEqual(report.totals["entries"], 2)
+        self.assertEqual(report.totals["uncompressed_bytes"], 110)
+        self.assertLess(report.totals["compressed_bytes"], 110)
+        self.assertEqual(report.sections["layers"], [{
+            "name": "classes", "output": self.path("classes"), "entries": 1,
+            "uncompressed_bytes": 7, "compressed_bytes": 7}])
+
+    def test_saves_json(self):
+        report = BuildReport("build_jar")
+        report.add("jars", path="dep.jar", bytes=3)
+        path = self.path("report.json")
+        report.save(path)
+        with open(path) as f:
+            saved = json.load(f, object_pairs_hook=OrderedDict)
+        self.assertEqual(saved.keys(), ["version", "command", "seconds", "totals",
+                                        "modules", "classes", "jars", "phases", "layers"])
+        self.assertEqual(saved["version"], REPORT_VERSION)
+        self.assertEqual(saved["command"], "build_jar")
+        self.assertIsNone(saved["totals"])
+        self.assertEqual(saved["jars"], [{"path": "dep.jar", "bytes": 3}])
+
+    def test_null_report_records_nothing(self):
+        with NullReport.timer("phases", name="nothing") as record:
+            record["bytes"] = 1
+        NullReport.add("phases", name="nothing")
+        NullReport.measure_output(self.path("missing.jar"))
+
+
+class SinglejarReportTest(SinglejarTestCase):
+
+    def test_reports_phases_jars_and_totals(self):
+        jar_path = self.path("dep-1.0.jar")
+        write_jar(jar_path, [("org/dep/Dep.class", "dep")])
+        self.add_lib_file("Lib/os.py", "os")
+        output = self.path("single.jar")
+        report = BuildReport("singlejar")
+        create_singlejar(output, [jar_path], None, report=report)
+        report.measure_output(output)
+        phases = [record["name"] for record in report.sections["phases"]]
+        for phase in ("walk-stdlib", "walk-site-packages", "jars", "stdlib"):
+            self.assertIn(phase, phases)
+        self.assertEqual([(record["path"], record["bytes"]) for record in report.sections["jars"]],
+                         [(os.path.realpath(jar_path), os.path.getsize(jar_path))])
+        with zipfile.ZipFile(output) as single:
+            self.assertEqual(report.totals["entries"], len(single.infolist()))
+            self.assertEqual(report.totals["output"], output)
+
+
+if __name__ == "__main__":
+    unittest.main()
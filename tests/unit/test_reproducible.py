@@ -0,0 +1,64 @@
+import os
+import time
+import unittest
+
+from clamp.build import create_singlejar
+
+from helpers import SinglejarTestCase, read_bytes, write_file, write_jar
+
+
+class ReproducibleSinglejarTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        self.old_epoch = os.environ.pop("SOURCE_DATE_EPOCH", None)
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [("org/python/core/Py.class", "class"), ("Lib/os.py", "")])
+        self.jython_jars.append(jython_jar)
+        self.add_lib_file("Lib/stat.py", "")
+        self.add_lib_file("Lib/json/__init__.py", "")
+        for name in ("a", "b", "c"):
+            write_file(os.path.join(self.site_packages, "sample", name + ".py"), "NAME = {!r}\n".format(name))
+        write_file(os.path.join(self.site_packages, "sample", "__init__.py"), "")
+        self.dep_jar = self.path("dep.jar")
+        write_jar(self.dep_jar, [("org/dep/A.class", "a"), ("org/dep/B.class", "b")])
+        self.runpy = self.path("__run__.py")
+        write_file(self.runpy, "import sample\n")
+
+    def tearDown(self):
+        if self.old_epoch is not None:
+            os.environ["SOURCE_DATE_EPOCH"] = self.old_epoch
+        SinglejarTestCase.tearDown(self)
+
+    def build(self):
+        output = self.path("single.jar")  # its name is in INDEX.LIST
+        create_singlejar(output, [self.dep_jar], self.runpy, reproducible=True)
+        data = read_bytes(output)
+        os.remove(output)
+        return data
+
+    def touch_inputs(self, mtime):
+        for dirpath, dirs, files in os.walk(self.root):
+            for filename in files:
+                os.utime(os.path.join(dirpath, filename), (mtime, mtime))
+
+    def test_identical_across_mtimes_and_listing_order(self):
+        self.touch_inputs(time.time() - 86400)
+        first = self.build()
+
+        self.touch_inputs(time.time())
+        listdir = os.listdir
+        self.patch(os, "listdir", lambda path: list(reversed(sorted(listdir(path)))))
+        second = self.build()
+
+        self.assertEqual(first, second)
+
+    def test_source_date_epoch(self):
+        first = self.build()
+        os.environ["SOURCE_DATE_EPOCH"] = "1500000000"
+        self.addCleanup(os.environ.pop, "SOURCE_DATE_EPOCH", None)
+        self.assertNotEqual(self.build(), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import unittest
+import zipfile
+
+from clamp.archive import MANIFEST_NAME
+from clamp.build import create_singlejar
+from clamp.commands import startup_order
+from clamp.startup import class_entries, loaded_classes, read_profile, startup_entries, write_profile
+
+from helpers import SinglejarTestCase, read_entries, read_manifest, write_file, write_jar
+
+VERBOSE_CLASS_OUTPUT = """\
+[Opened /usr/lib/jvm/jre/lib/rt.jar]
+[Loaded java.lang.Object from /usr/lib/jvm/jre/lib/rt.jar]
+[Loaded org.python.core.Py from file:/app/single.jar]
+[0.052s][info][class,load] org.dep.Dep source: file:/app/single.jar
+[0.053s][info][class,load ] app$py source: __pyclasspath__/Lib/app.py
+[Loaded __run__$py from __pyclasspath__/__run__.py]
+Hello
+"""
+
+
+class StartupProfileTest(SinglejarTestCase):
+
+    def setUp(self):
+        SinglejarTestCase.setUp(self)
+        jython_jar = self.path("jython.jar")
+        write_jar(jython_jar, [("org/python/core/Py.class", "py"), ("org/python/core/Unused.class", "unused")])
+        self.jython_jars.append(jython_jar)
+        self.dep_jar = self.path("dep-1.0.jar")
+        write_jar(self.dep_jar, [("org/dep/Dep.class", "dep"), ("org/dep/Other.class", "other")])
+        self.add_lib_file("Lib/app.py", "app")
+        self.add_lib_file("Lib/unused.py", "unused")
+        self.runpy = self.path("__run__.py")
+        write_file(self.runpy, "run")
+        self.output = self.path("single.jar")
+
+    def test_parses_class_loading(self):
+        classes = list(loaded_classes(VERBOSE_CLASS_OUTPUT.splitlines()))
+        self.assertEqual(classes, ["java.lang.Object", "org.python.core.Py", "org.dep.Dep", "app$py", "__run__$py"])
+        self.assertEqual(class_entries("org.dep.Dep"), ["org/dep/Dep.class"])
+        self.assertEqual(class_entries("__run__$py"), ["__run__.py"])
+        self.assertEqual(class_entries("pkg.mod$py"), ["Lib/pkg/mod$py.class", "Lib/pkg/mod.py",
+                                                       "Lib/pkg/mod/__init__$py.class", "Lib/pkg/mod/__init__.py"])
+
+    def test_profile_lists_entries_in_load_order(self):
+        create_singlejar(self.output, [self.dep_jar], self.runpy)
+        entries = startup_entries(loaded_classes(VERBOSE_CLASS_OUTPUT.splitlines()), [self.output])
+        self.assertEqual(entries, ["org/python/core/Py.class", "org/dep/Dep.class", "Lib/app.py", "__run__.py"])
+        profile = self.path("startup.profile")
+        write_profile(profile, entries)
+        self.assertEqual(read_profile(profile), entries)
+        job = {"startup_profile": profile}
+        self.assertEqual(startup_order(job), entries)
+        job["train_startup"] = True
+        self.assertIsNone(startup_order(job))  # about to be retrained
+
+    def test_writes_profile_entries_first(self):
+        create_singlejar(self.output, [self.dep_jar], self.runpy)
+        unordered = read_entries(self.output)
+        manifest = read_manifest(self.output)
+        os.remove(self.output)
+        profile = ["__run__.py", "Lib/app.py", "org/dep/Dep.class", "org/python/core/Py.class", "missing.class"]
+        create_singlejar(self.output, [self.dep_jar], self.runpy, startup_order=profile)
+        ordered = read_entries(self.output)
+        self.assertEqual([name for name, data in ordered[:5]], [MANIFEST_NAME] + profile[:4])
+        self.assertEqual(sorted(ordered), sorted(unordered))
+        self.assertEqual(read_manifest(self.output), manifest)
+        with zipfile.ZipFile(self.output) as single:
+            self.assertIsNone(single.testzip())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+import time
+import unittest
+import zipfile
+
+from clamp.build import JarBuilder, import_modules
+from clamp.watch import JarWatcher, in_packages
+
+from helpers import TempDirTestCase, write_file
+
+WATCHED_SOURCE = """\
+from java.lang import Object
+from clamp.declarative import clamp_class
+
+
+@clamp_class("org")
+class Watched(Object):
+{body}
+"""
+
+
+class JarWatcherTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.package = "watch_sample_{}".format(abs(hash(self.root)))
+        write_file(self.path("src", self.package, "__init__.py"), "from . import watched\n")
+        self.write_watched("    pass\n")
+        sys.path.insert(0, self.path("src"))
+        self.output = self.path("watched.jar")
+        self.class_name = "org/{}/watched/Watched.class".format(self.package)
+
+    def tearDown(self):
+        sys.path.remove(self.path("src"))
+        for module in [module for module in sys.modules if in_packages(module, [self.package])]:
+            del sys.modules[module]
+        TempDirTestCase.tearDown(self)
+
+    def write_watched(self, body, mtime=None):
+        path = self.path("src", self.package, "watched.py")
+        write_file(path, WATCHED_SOURCE.format(body=body))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))  # so the change is seen whatever the resolution of mtimes
+
+    def read_class(self):
+        with zipfile.ZipFile(self.output) as jar:
+            return jar.read(self.class_name)
+
+    def test_watches_submodules(self):
+        with JarBuilder(output_path=self.output) as builder:
+            import_modules(builder, [self.package])
+        watcher = JarWatcher([self.package], builder)
+        self.assertEqual(sorted(watcher.sources), [self.package, self.package + ".watched"])
+
+    def test_submodule_change_regenerates_class(self):
+        with JarBuilder(output_path=self.output) as builder:
+            import_modules(builder, [self.package])
+        before = self.read_class()
+        old_module = sys.modules[self.package + ".watched"]
+        watcher = JarWatcher([self.package], builder)
+
+        self.write_watched("    def added(self):\n        return 1\n", time.time() + 10)
+        mtimes = watcher.stat()
+        changed = [module for module in mtimes if mtimes[module] != watcher.mtimes[module]]
+        self.assertEqual(changed, [self.package + ".watched"])
+        self.assertTrue(watcher.rebuild(changed))
+
+        after = self.read_class()
+        self.assertNotEqual(before, after)
+        self.assertIn("added", after)
+        self.assertIsNot(sys.modules[self.package + ".watched"], old_module)
+        self.assertEqual(watcher.class_modules[self.class_name], self.package + ".watched")
+
+    def test_rebuild_keeps_build_settings(self):
+        with JarBuilder(output_path=self.output, reproducible=True) as builder:
+            import_modules(builder, [self.package])
+        report_path = self.path("report.json")
+        watcher = JarWatcher([self.package], builder, report_path=report_path)
+
+        self.write_watched("    def added(self):\n        return 1\n", time.time() + 10)
+        self.assertTrue(watcher.rebuild([self.package + ".watched"]))
+
+        with zipfile.ZipFile(self.output) as jar:
+            self.assertEqual(jar.read("META-INF/INDEX.LIST").splitlines()[2], "watched.jar")
+            self.assertEqual(set(info.date_time for info in jar.infolist()), set([jar.infolist()[0].date_time]))
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(report["totals"]["output"], self.output)
+        self.assertIn(self.package, [record["name"] for record in report["modules"]])
+        self.assertEqual([name for name in os.listdir(self.root) if name.startswith(".")], [])  # no temporary jar left
+
+
+if __name__ == "__main__":
+    unittest.main()